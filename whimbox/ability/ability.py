@@ -41,10 +41,9 @@ class AbilityManager:
         self.battle_ability = None
 
     def get_current_ability(self):
-        cap = itt.capture(posi=AreaAbilityButton.position)
         lower_white = [0, 0, 230]
         upper_white = [180, 60, 255]
-        img = process_with_hsv_limit(cap, lower_white, upper_white)
+        img = itt.frame_context().hsv_mask(AreaAbilityButton.position, lower_white, upper_white)
         for icon in ability_hsv_icons:
             resize_icon = cv2.resize(icon.image, None, fx=0.63, fy=0.63, interpolation=cv2.INTER_LINEAR)
             rate = similar_img(img, resize_icon[:, :, 0], ret_mode=IMG_RATE)
@@ -52,18 +51,24 @@ class AbilityManager:
                 return icon_name_to_ability_name.get(icon.name, None)
         return None
 
-    def _get_ability_hsv_icon(self, center, cap):
-        area = area_offset((-ability_icon_radius, -ability_icon_radius, ability_icon_radius, ability_icon_radius), offset=center)
-        img = crop(cap, area)
+    def _ability_icon_area(self, center):
+        return area_offset((-ability_icon_radius, -ability_icon_radius, ability_icon_radius, ability_icon_radius), offset=center)
+
+
+    def _ability_icon_areas(self):
+        return [self._ability_icon_area(center) for center in ability_icon_centers]
+
+
+    def _get_ability_hsv_icon(self, center, ctx):
+        area = self._ability_icon_area(center)
         lower_white = [0, 0, 230]
         upper_white = [180, 60, 255]
-        img = process_with_hsv_limit(img, lower_white, upper_white)
-        return img
+        return ctx.hsv_mask(area, lower_white, upper_white)
 
 
     def _check_jump_ability(self):
-        cap = itt.capture()
-        img = self._get_ability_hsv_icon(jump_ability_center, cap)
+        ctx = itt.frame_context()
+        img = self._get_ability_hsv_icon(jump_ability_center, ctx)
         for icon in jump_ability_hsv_icons:
             rate = similar_img(img, icon.image[:, :, 0], ret_mode=IMG_RATE)
             if rate > 0.8:
@@ -77,9 +82,9 @@ class AbilityManager:
 
     def _check_ability_keymap(self):
         ability_keymap = {}
-        cap = itt.capture()
+        ctx = itt.frame_context()
         for i, center in enumerate(ability_icon_centers):
-            img = self._get_ability_hsv_icon(center, cap)
+            img = self._get_ability_hsv_icon(center, ctx)
             for icon in ability_hsv_icons:
                 rate = similar_img(img, icon.image[:, :, 0], ret_mode=IMG_RATE)
                 if rate > 0.8:
@@ -188,7 +193,8 @@ class AbilityManager:
             # 如果没配置，根据配置文件，配置到对应的方案和键位
             ability_plan = global_config.get_int('Game', 'ability_plan')
             self._change_ability_plan(ability_plan)
-            itt.wait_until_stable(threshold=0.99)
+            # 能力配置界面有角色待机动画，只检测能力图标区域
+            itt.wait_until_stable(area=self._ability_icon_areas())
             self._check_ability_keymap()
             key = self.ability_keymap.get(ability_name, None)
             if key is None:
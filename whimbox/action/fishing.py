@@ -10,7 +10,6 @@ from whimbox.interaction.interaction_core import itt
 from whimbox.ui.page_assets import page_main
 from whimbox.ui.ui import ui_control
 from whimbox.ui.ui_assets import *
-from whimbox.common.utils.img_utils import count_px_with_hsv_limit
 from whimbox.common.utils.posi_utils import union_bbox
 from whimbox.ability.ability import ability_manager
 from whimbox.ability.cvar import ABILITY_NAME_FISH
@@ -77,8 +76,7 @@ class FishingTask(TaskTemplate):
         itt.key_down(key)
         while not self.need_stop():
             time.sleep(0.5)
-            cap = itt.capture(posi=AreaFishingDetection.position)
-            current_px_count = count_px_with_hsv_limit(cap, hsv_limit[0], hsv_limit[1])
+            current_px_count = itt.frame_context().count_hsv(AreaFishingDetection.position, hsv_limit[0], hsv_limit[1])
             if current_px_count < px_count:
                 logger.debug(f"方向正确: {key}, {px_count} -> {current_px_count}")
                 px_count = current_px_count
@@ -93,8 +91,7 @@ class FishingTask(TaskTemplate):
     def handle_pull_line(self):
         """处理拉扯鱼线状态的核心逻辑"""
         self.log_to_gui("进入拉扯鱼线状态")
-        cap = itt.capture(posi=AreaFishingDetection.position)
-        px_count = count_px_with_hsv_limit(cap, hsv_limit[0], hsv_limit[1])
+        px_count = itt.frame_context().count_hsv(AreaFishingDetection.position, hsv_limit[0], hsv_limit[1])
         while px_count > 0 and not self.need_stop():
             px_count = self._pull_in_direction('a', px_count)
             if px_count == 0:
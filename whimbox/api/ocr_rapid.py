@@ -1,16 +1,27 @@
 from rapidocr import RapidOCR
+from rapidocr.ch_ppocr_rec import TextRecInput
 import os
 import threading
 import time
+import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, Future
 import cv2
+import numpy as np
 from whimbox.common.logger import logger
+from whimbox.common.cache import LRUCache
 from whimbox.common.path_lib import ASSETS_PATH
+from whimbox.config.config import global_config
 
 # 错误替换表
 REPLACE_DICT = {}
 
 class RapidOcr():
 
+    CACHE_SIZE = 256 # 缓存的识别结果条数
+    # 同时存在的RapidOCR会话数。推理时onnxruntime会释放GIL，多个会话可以真正并行
+    WORKERS = max(1, min(global_config.get_int('General', 'ocr_workers', default=2), os.cpu_count() or 1))
+
     _instance = None
     _initialized = False
 
@@ -23,13 +34,43 @@ class RapidOcr():
     def __init__(self):
         if self._initialized:
             return
+        self._lock = threading.Lock()
+        # 空闲的会话，第一个会话立即创建，其余的在并发不够用时再创建
+        self._sessions = queue.LifoQueue()
+        self._session_count = 1
+        self._executor = None
+        self.ocr = self._create_session()
+        self._sessions.put(self.ocr)
+        # 以图片内容的哈希为键缓存识别结果，画面没变时不用重复识别
+        self.cache = LRUCache(maxsize=self.CACHE_SIZE, name='ocr')
+        self._initialized = True
+
+    def _create_session(self):
         logger.info(f"Creating RapidOCR object")
         pt = time.time()
         config_path = os.path.join(ASSETS_PATH, 'rapidocr.yaml')
-        self.ocr = RapidOCR(config_path=config_path)
+        session = RapidOCR(config_path=config_path)
         logger.info(f"created RapidOCR. cost {round(time.time() - pt, 2)}")
-        self._lock = threading.Lock()
-        self._initialized = True
+        return session
+
+    def _acquire_session(self):
+        try:
+            return self._sessions.get_nowait()
+        except queue.Empty:
+            pass
+        # 锁里只占一个名额，创建会话耗时较长，放到锁外面，不阻塞其他线程取用空闲会话
+        with self._lock:
+            reserved = self._session_count < self.WORKERS
+            if reserved:
+                self._session_count += 1
+        if not reserved:
+            return self._sessions.get()
+        try:
+            return self._create_session()
+        except Exception:
+            with self._lock:
+                self._session_count -= 1
+            raise
 
     def _replace_texts(self, text: str):
         for i in REPLACE_DICT:
@@ -37,23 +78,84 @@ class RapidOcr():
                 text = text.replace(i, REPLACE_DICT[i])
         return text
 
-    def analyze(self, img):
-        """直接调用 RapidOCR 的接口"""
+    @staticmethod
+    def _img_key(img):
+        img = np.ascontiguousarray(img)
+        return img.shape, img.dtype.str, hashlib.blake2b(img.data, digest_size=16).digest()
+
+    def analyze(self, img, rec_only=False):
+        """直接调用 RapidOCR 的接口，相同内容的图片直接返回缓存结果
+
+        Args:
+            rec_only (bool): 跳过文字检测和方向分类，把整张图当作一行文字直接识别
+        """
+        key = (*self._img_key(img), rec_only)
+        result = self.cache.get(key)
+        if result is None:
+            session = self._acquire_session()
+            try:
+                if rec_only:
+                    result = session(img, use_det=False, use_cls=False, use_rec=True)
+                else:
+                    result = session(img)
+            finally:
+                self._sessions.put(session)
+            self.cache.put(key, result)
+        return result
+
+    def get_batch_texts(self, imgs: list) -> list:
+        """只识别模式的批量版本：每张图都当作一行文字，一次送进识别模型，不做检测和方向分类
+
+        Args:
+            imgs (list): 多张单行文字的截图，尺寸可以不同
+
+        Returns:
+            list[str]: 和imgs一一对应的识别结果
+        """
+        keys = [(*self._img_key(img), 'rec_batch') for img in imgs]
+        texts = [self.cache.get(key) for key in keys]
+        misses = [i for i, text in enumerate(texts) if text is None]
+        if misses:
+            session = self._acquire_session()
+            try:
+                # 和session(img, use_det=False)一样先转为BGR并限制尺寸，识别模型按rec_batch_num分批推理
+                batch = [session.preprocess_img(session.load_img(imgs[i]))[0] for i in misses]
+                res = session.text_rec(TextRecInput(img=batch))
+            finally:
+                self._sessions.put(session)
+            for i, txt in zip(misses, res.txts or ('',) * len(misses)):
+                texts[i] = self._replace_texts(txt) if len(txt) > 1 else ''
+                self.cache.put(keys[i], texts[i])
+        return texts
+
+    def _get_executor(self) -> ThreadPoolExecutor:
         with self._lock:
-            result = self.ocr(img)
-            return result
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='ocr')
+            return self._executor
+
+    def submit_all_texts(self, img, mode=0, rec_only=False) -> Future:
+        """get_all_texts的异步版本，返回Future，多个区域可以同时识别"""
+        return self._get_executor().submit(self.get_all_texts, img, mode, rec_only=rec_only)
+
+    def submit_detect_and_ocr(self, img) -> Future:
+        """detect_and_ocr的异步版本，返回Future"""
+        return self._get_executor().submit(self.detect_and_ocr, img)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
 
-    def get_all_texts(self, img, mode=0, per_monitor=False):
+    def get_all_texts(self, img, mode=0, per_monitor=False, rec_only=False):
         if per_monitor:
             pt = time.time()
-        res = self.analyze(img)  # res is a RapidOCROutput object
+        res = self.analyze(img, rec_only=rec_only)  # res is a RapidOCROutput object
 
         rec_texts = []
         if res and hasattr(res, 'txts') and res.txts:
             rec_texts = [self._replace_texts(txt) for txt in res.txts if len(txt) > 1]
 
         if per_monitor:
-            logger.info(f"ocr performance: {round(time.time() - pt, 2)}")
+            logger.info(f"ocr performance: {round(time.time() - pt, 2)}, cache: {self.cache_stats()}")
 
         if mode == 1:
             return ''.join(rec_texts)
@@ -0,0 +1,154 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    线程安全的定长LRU缓存，记录命中率，方便调整缓存大小。
+    on_evict(key, value)在淘汰时调用，可用于释放资源。
+    """
+
+    def __init__(self, maxsize=128, name='', on_evict=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        evicted = []
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+        if self.on_evict is not None:
+            for k, v in evicted:
+                self.on_evict(k, v)
+
+    def get_or_compute(self, key, func):
+        """
+        命中则返回缓存，否则调用func()计算并缓存。
+        func在锁外执行，并发时可能重复计算，但结果一致。
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = func()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __str__(self):
+        return f'LRUCache({self.stats()})'
+
+    __repr__ = __str__
+
+
+class ArtifactCache:
+    """
+    预计算数据的磁盘缓存，每个key保存为一个npz文件。
+    文件中记录了version，生成算法变化时修改version，旧文件会自动重建。
+    key中应该包含生成时用到的参数（地图名、缩放等），参数变化时自然就是另一个文件。
+    """
+
+    def __init__(self, name, version, path=None):
+        if path is None:
+            from whimbox.common.path_lib import CACHE_PATH
+            path = CACHE_PATH
+        self.path = os.path.join(path, name)
+        self.version = version
+        self._data = {}
+        # _lock只保护_data和_key_locks，生成数据时只持有对应key的锁，不同key可以并行生成
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.npz')
+
+    def _load(self, key):
+        try:
+            with np.load(self._file(key)) as f:
+                if int(f['__version__']) != self.version:
+                    return None
+                return f['data']
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save(self, key, data):
+        from whimbox.common.logger import logger
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._file(key) + '.tmp.npz'
+            np.savez(tmp_file, data=data, __version__=np.array(self.version))
+            os.replace(tmp_file, self._file(key))
+        except OSError as e:
+            logger.warning(f'save artifact {key} failed: {e}')
+
+    def get_or_build(self, key, func, keep=True) -> np.ndarray:
+        """
+        依次从内存、磁盘读取，都没有时调用func()生成并保存。
+
+        Args:
+            keep: 是否留在内存中。由调用方管理生命周期的数据（如随地图包释放的）传False，只用磁盘缓存
+        """
+        with self._lock:
+            data = self._data.get(key)
+        if data is not None:
+            return data
+        with self._key_lock(key):
+            # 等锁期间可能已经由其他线程生成
+            with self._lock:
+                data = self._data.get(key)
+            if data is not None:
+                return data
+            data = self._load(key)
+            if data is None:
+                data = np.asarray(func())
+                self._save(key, data)
+            # 多处共享同一份数据，设为只读防止被意外修改
+            data.flags.writeable = False
+            if keep:
+                with self._lock:
+                    self._data[key] = data
+            return data
@@ -42,4 +42,9 @@ THREAD_PAUSE_FORCE_TERMINATE = 1
 
 # 字符串匹配模式
 CONTAIN_MATCHING = 0
-ACCURATE_MATCHING = 1
\ No newline at end of file
+ACCURATE_MATCHING = 1
+# 画面稳定检测
+STABLE_BLOCK_SIZE = 30 # 每个块对应的原图像素边长，1080p全屏为64x36个块
+STABLE_BLOCK_TOLERANCE = 8 # 块平均亮度变化超过该值视为变化块
+STABLE_THRESHOLD_STATIC = 0.98 # 静态界面（菜单、大地图）的未变化块比例，允许约2%的块在变化（光标高亮、图标闪烁）
+STABLE_THRESHOLD_TRANSITION = 0.85 # 页面切换时的未变化块比例，画面里可能有待机动画的角色和场景
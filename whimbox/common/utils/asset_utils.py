@@ -42,7 +42,8 @@ class AssetBase():
 
     def get_img_path(self):
         if self.name in ASSETS_INDEX_JSON:
-            return os.path.join(ASSETS_PATH, ASSETS_INDEX_JSON[self.name]['rel_path'])
+            # 索引中是Windows路径分隔符，按分隔符拆开再拼接，其他系统上也能找到
+            return os.path.join(ASSETS_PATH, *ASSETS_INDEX_JSON[self.name]['rel_path'].split('\\'))
         r = self.search_path(self.name)
         if r != None:
             return r
@@ -471,4 +471,36 @@ def count_px_with_hsv_limit(image, lower_limit, upper_limit):
     """
     hsv_img = process_with_hsv_limit(image, lower_limit, upper_limit)
     px_count = cv2.countNonZero(hsv_img)
-    return px_count
\ No newline at end of file
+    return px_count
+
+def luma_thumbnail(image, block_size=STABLE_BLOCK_SIZE):
+    """
+    把图片缩成亮度缩略图，每个像素是原图一个block_size*block_size块的平均亮度。
+
+    Args:
+        image (np.ndarray): BGR/BGRA或灰度图
+        block_size (int): 块边长
+
+    Returns:
+        np.ndarray: Shape (h//block_size, w//block_size)，uint8
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    h, w = image.shape[:2]
+    size = (max(1, w // block_size), max(1, h // block_size))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def dirty_block_ratio(thumb1, thumb2, tolerance=STABLE_BLOCK_TOLERANCE) -> float:
+    """
+    两张亮度缩略图中发生变化的块的比例。
+
+    Args:
+        thumb1, thumb2 (np.ndarray): luma_thumbnail的结果，形状需一致
+        tolerance (int): 块亮度变化超过该值才算变化，用来过滤噪声
+
+    Returns:
+        float: 0~1，0表示完全没有变化
+    """
+    diff = cv2.absdiff(thumb1, thumb2)
+    return np.count_nonzero(diff > tolerance) / diff.size
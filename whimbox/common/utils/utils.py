@@ -1,6 +1,6 @@
 
 import os, json
-import win32gui, win32process, psutil, ctypes
+import psutil, ctypes
 import numpy as np
 from collections import OrderedDict
 from typing import Union
@@ -60,6 +60,7 @@ def is_admin():
 
 def get_active_window_process_name():
     try:
+        import win32gui, win32process
         pid = win32process.GetWindowThreadProcessId(win32gui.GetForegroundWindow())
         name = psutil.Process(pid[-1]).name()
         if name:
@@ -0,0 +1,91 @@
+"""
+启动预热：在等待游戏启动时，用后台线程提前创建OCR会话、跑几次空推理、解码地图和模板图片，
+避免第一次goto_page、第一次识别小地图时卡顿。
+"""
+
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from whimbox.common.logger import logger
+
+
+def _dummy_text_img(text):
+    img = np.full((48, 320, 3), 255, dtype=np.uint8)
+    cv2.putText(img, text, (8, 34), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    return img
+
+
+def warmup_ocr():
+    from whimbox.api.ocr_rapid import ocr
+    # 完整流程和只识别流程各跑一次
+    ocr.get_all_texts(_dummy_text_img('warm up'))
+    ocr.get_all_texts(_dummy_text_img('warm up'), rec_only=True)
+    # 同时提交多张不同的图，把会话池里的其余会话也创建并预热（相同的图会命中缓存）
+    futures = [ocr.submit_all_texts(_dummy_text_img(f'warm up {i}')) for i in range(ocr.WORKERS)]
+    for future in futures:
+        future.result()
+
+
+def warmup_map_assets():
+    from whimbox.map.map_pack import map_packs
+    from whimbox.map.detection.cvars import MAP_NAME_MIRALAND
+    from whimbox.map.detection.map_assets import MAP_ASSETS_DICT, get_feature_index, get_arrow_embedding
+    get_arrow_embedding()
+    # 瓦片地图和重定位用的特征索引第一次生成要几秒，之后从磁盘读取。
+    # 只预热上次用的地图，其他地图切换过去时再加载
+    map_name = map_packs.last_used(default=MAP_NAME_MIRALAND)
+    if map_name in MAP_ASSETS_DICT:
+        MAP_ASSETS_DICT[map_name]["luma_05x"].tiles
+        get_feature_index(map_name)
+
+
+def warmup_ui_assets():
+    import whimbox.ui.page_assets
+
+
+WARMUP_STEPS = {
+    'ocr': warmup_ocr,
+    'map_assets': warmup_map_assets,
+    'ui_assets': warmup_ui_assets,
+}
+
+
+def _run_step(name, func, costs):
+    pt = time.time()
+    try:
+        func()
+    except Exception as e:
+        logger.warning(f"warm-up {name} failed: {e}")
+        return
+    costs[name] = round(time.time() - pt, 2)
+    logger.info(f"warm-up {name} cost {costs[name]}s")
+
+
+def start_warmup() -> threading.Thread:
+    """
+    每个预热步骤开一个后台线程，全部完成后打印汇总。
+
+    Returns:
+        threading.Thread: 汇总线程，需要等预热完成时可以join
+    """
+    costs = {}
+    threads = []
+    for name, func in WARMUP_STEPS.items():
+        t = threading.Thread(target=_run_step, args=(name, func, costs), name=f'warmup_{name}')
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    def _summary():
+        pt = time.time()
+        for t in threads:
+            t.join()
+        logger.info(f"warm-up finished in {round(time.time() - pt, 2)}s: {costs}")
+
+    summary_thread = threading.Thread(target=_summary, name='warmup')
+    summary_thread.daemon = True
+    summary_thread.start()
+    return summary_thread
@@ -1,71 +1,301 @@
-'''生成用于匹配的地图图片'''
+'''
+生成用于匹配的地图资源
+
+从原始地图生成地图包（见whimbox.map.map_pack），输出到<out>/<name>.json和<out>/<name>/：
+    python -m whimbox.dev_tool.map_assets_gen pack <原始地图.png> --name miraland --out map_packs \
+        --manifest whimbox/assets/map_packs/miraland.json --mask w01_v8_mask_0125x.png
+    --manifest: 从已有的manifest中复制区域名、缩放、坐标偏移，也可以用--regions、--minimap-scale等直接指定
+    --mask: 大地图可匹配位置的遮罩（任意缩放），不指定时用原图的透明通道或非黑色区域
+    已生成过的部分，输入和参数没变、文件校验值也对得上时会跳过，--force全部重新生成
+'''
 import os
+import sys
+import json
+import time
+import threading
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from whimbox.common.logger import logger
+
 from whimbox.map.detection.utils import *
 from whimbox.common.utils.img_utils import *
 from whimbox.map.detection.cvars import *
+from whimbox.map.detection.tiled_map import TiledMap
+from whimbox.map.detection.feature_index import build_feature_index, feature_index_params
 
-def gen_luma_05x_0125x_map(org_map: MapAsset):
-    '''
-    生成luma_05x和luma_0125x的地图图片
-    '''
-    image = org_map.img
-    luma_image = rgb2luma(image)
-    luma_05x_image = cv2.resize(luma_image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_NEAREST)
-    luma_05x_path = org_map.path.replace('.png', '_luma_05x.png')
-    save_image(luma_05x_image, luma_05x_path)
-    luma_0125x_image = cv2.resize(luma_image, None, fx=0.125, fy=0.125, interpolation=cv2.INTER_NEAREST)
-    luma_0125x_path = org_map.path.replace('.png', '_luma_0125x.png')
-    save_image(luma_0125x_image, luma_0125x_path)
-
-
-def gen_arrows_map(arrow: MapAsset):
-    arrows = {}
-    for degree in range(0, 360):
-        rotated = rotate_bound(arrow.img, degree)
-        rotated = crop(rotated, area=get_bbox(rotated, threshold=15))
-        rotated = color_similarity_2d(rotated, color=(255,255,255))
-        arrows[degree] = rotated
-    return arrows
-
-def gen_ArrowRotateMap(arrow: MapAsset, arrows_map):
-    radius = DIRECTION_RADIUS
-    image = np.zeros((10 * radius * 2, 9 * radius * 2), dtype=np.uint8)
-    for degree in range(0, 360, 5):
-        y, x = divmod(degree / 5, 8)
-        rotated = arrows_map.get(degree)
-        point = (radius + int(y) * radius * 2, radius + int(x) * radius * 2)
-        image[point[0]:point[0] + rotated.shape[0], point[1]:point[1] + rotated.shape[1]] = rotated
-    image = cv2.resize(image, None,
-                        fx=DIRECTION_SEARCH_SCALE, fy=DIRECTION_SEARCH_SCALE,
-                        interpolation=cv2.INTER_NEAREST)
-
-    path = arrow.path.replace('ARROW.png', 'ArrowRotateMap.png')
-    save_image(image, path)
-
-def gen_ArrowRotateMapAll(arrow: MapAsset, arrows_map):
-    radius = DIRECTION_RADIUS
-    image = np.zeros((136 * radius * 2, 9 * radius * 2), dtype=np.uint8)
-    for degree in range(360 * 3):
-        y, x = divmod(degree, 8)
-        rotated = arrows_map.get(degree % 360)
-        point = (radius + int(y) * radius * 2, radius + int(x) * radius * 2)
-        image[point[0]:point[0] + rotated.shape[0], point[1]:point[1] + rotated.shape[1]] = rotated
-    image = cv2.resize(image, None,
-                        fx=DIRECTION_SEARCH_SCALE, fy=DIRECTION_SEARCH_SCALE,
-                        interpolation=cv2.INTER_NEAREST)
-
-    path = arrow.path.replace('ARROW.png', 'ArrowRotateMapAll.png')
-    save_image(image, path)
+# 地图包格式的版本，生成方法变化时加一
+PACK_FORMAT_VERSION = 1
+# 金字塔各层相对原图的缩放和插值方法，05x、0125x与旧版本生成方法保持一致，缩放参数不用重新调
+PYRAMID_LEVELS = {
+    '05x': (0.5, cv2.INTER_NEAREST),
+    '0125x': (0.125, cv2.INTER_NEAREST),
+    '003125x': (0.125 * BIGMAP_COARSE_SCALE, cv2.INTER_AREA),
+}
+MANIFEST_FIELDS = ['regions', 'gameloc_to_pngmap_offset', 'minimap_position_scale', 'bigmap_position_scale']
 
 
-if __name__ == '__main__':
-    # MiralandMapOrg = MapAsset('w01_v8')
-    # gen_luma_05x_0125x_map(MiralandMapOrg)
+def file_sha256(file):
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_hash(*params):
+    return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+class MapPackBuilder:
+    """
+    从原始地图生成地图包：多层亮度金字塔、可匹配位置遮罩、瓦片、重定位特征索引，以及所有文件的校验值。
+    每一步记录输入的hash，重新生成时输入没变、输出文件校验值对得上的步骤会跳过。
+    """
+
+    def __init__(self, source, name, out, fields: dict, mask=None, teleporters=None, workers=4, force=False):
+        self.source = source
+        self.name = name
+        self.out = out
+        self.fields = fields
+        self.mask = mask
+        self.teleporters = teleporters
+        self.workers = workers
+        self.force = force
+        self.pack_dir = os.path.join(out, name)
+        self.manifest_file = os.path.join(out, f'{name}.json')
+        old = {}
+        if os.path.exists(self.manifest_file) and not force:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                old = json.load(f)
+        if old.get('version') != PACK_FORMAT_VERSION:
+            old = {}
+        self.old_inputs = old.get('build', {}).get('inputs', {})
+        self.old_checksums = old.get('checksums', {})
+        self.inputs = {}
+        self.checksums = {}
+        self._luma = None
+        self._lock = threading.Lock()
+
+    def _rel(self, *names):
+        return '/'.join([self.name, *names])
+
+    def _abs(self, rel):
+        return os.path.join(self.out, *rel.split('/'))
+
+    def _run_step(self, step, outputs, input_hash, func):
+        """
+        outputs: 该步骤生成的文件（相对out的路径），目录以/结尾，表示目录下的所有文件
+        """
+        def expand(rels):
+            files = []
+            for rel in rels:
+                if rel.endswith('/'):
+                    files += [k for k in self.old_checksums if k.startswith(rel)]
+                else:
+                    files.append(rel)
+            return files
+
+        old_files = expand(outputs)
+        up_to_date = (
+            self.old_inputs.get(step) == input_hash and old_files
+            and all(os.path.exists(self._abs(f)) and file_sha256(self._abs(f)) == self.old_checksums.get(f)
+                    for f in old_files))
+        if up_to_date:
+            logger.info(f'{step}: up to date')
+            files = old_files
+        else:
+            pt = time.time()
+            func()
+            files = []
+            for rel in outputs:
+                if rel.endswith('/'):
+                    root = self._abs(rel)
+                    files += [f'{rel}{f}' for f in sorted(os.listdir(root))]
+                else:
+                    files.append(rel)
+            logger.info(f'{step}: built in {round(time.time() - pt, 2)}s')
+        checksums = {f: file_sha256(self._abs(f)) for f in files}
+        with self._lock:
+            self.inputs[step] = input_hash
+            self.checksums.update(checksums)
+
+    def luma(self):
+        """原图亮度，只在需要重新生成金字塔时读取"""
+        with self._lock:
+            if self._luma is None:
+                self._luma = rgb2luma(load_image(self.source))
+            return self._luma
+
+    def _validity(self):
+        if self.mask is not None:
+            return np.array(Image.open(self.mask).convert('L')) > 0
+        image = Image.open(self.source)
+        if 'A' in image.getbands():
+            return np.array(image.getchannel('A')) > 0
+        return self.luma() > 0
+
+    def build_level(self, tag):
+        scale, interpolation = PYRAMID_LEVELS[tag]
+        rel = self._rel(f'luma_{tag}.png')
+
+        def build():
+            save_image(cv2.resize(self.luma(), None, fx=scale, fy=scale, interpolation=interpolation), self._abs(rel))
+
+        self._run_step(f'luma_{tag}', [rel], params_hash(self.source_hash, scale, interpolation), build)
+
+    def build_masks(self):
+        # map_assets导入时会生成小地图遮罩等数据，用到时再导入
+        from whimbox.map.detection.map_assets import create_coarse_mask
+        rel_0125x, rel_coarse = self._rel('mask_0125x.png'), self._rel('mask_003125x.png')
+        source_hash = self.source_hash if self.mask is None else file_sha256(self.mask)
 
-    # ARROW = MapAsset('ARROW')
-    # arrows_map = gen_arrows_map(ARROW)
-    # gen_ArrowRotateMap(ARROW, arrows_map)
-    # gen_ArrowRotateMapAll(ARROW, arrows_map)
+        def build():
+            valid = self._validity().astype(np.uint8) * 255
+            h, w = self.luma_shape
+            size = (int(round(w * 0.125)), int(round(h * 0.125)))
+            mask = cv2.resize(valid, size, interpolation=cv2.INTER_NEAREST)
+            save_image(mask, self._abs(rel_0125x))
+            save_image(create_coarse_mask(mask), self._abs(rel_coarse))
 
-    StartSeaMapOrg = MapAsset('w14000000_v2')
-    gen_luma_05x_0125x_map(StartSeaMapOrg)
+        self._run_step('mask', [rel_0125x, rel_coarse], params_hash(source_hash, BIGMAP_COARSE_SCALE), build)
+
+    def build_tiles(self):
+        level = self._abs(self._rel('luma_05x.png'))
+        tiles_dir = self._abs(self._rel('tiles'))
+        asset_name = f'{self.name}_luma_05x'
+
+        def build():
+            shutil.rmtree(tiles_dir, ignore_errors=True)
+            TiledMap.build(load_image(level), os.path.join(tiles_dir, f'{asset_name}.npy'),
+                           os.path.join(tiles_dir, f'{asset_name}.json'), {'sha256': source_sha256})
+
+        # 瓦片索引记录源图片的sha256，加载时和manifest中的checksums比对，复制、解压改变mtime也不受影响
+        source_sha256 = self.checksums[self._rel('luma_05x.png')]
+        input_hash = params_hash(source_sha256, 'sha256', MAP_TILE_SIZE, MAP_ARTIFACT_VERSION)
+        self._run_step('tiles', [self._rel('tiles') + '/'], input_hash, build)
+
+    def build_features(self):
+        level = self._abs(self._rel('luma_05x.png'))
+        rel_points, rel_descriptors = self._rel('features', 'points.npy'), self._rel('features', 'descriptors.npy')
+
+        def build():
+            points, descriptors = build_feature_index(load_image(level))
+            os.makedirs(os.path.dirname(self._abs(rel_points)), exist_ok=True)
+            np.save(self._abs(rel_points), points)
+            np.save(self._abs(rel_descriptors), descriptors)
+
+        input_hash = params_hash(self.checksums[self._rel('luma_05x.png')], feature_index_params())
+        self._run_step('features', [rel_points, rel_descriptors], input_hash, build)
+
+    def build(self):
+        pt = time.time()
+        os.makedirs(self.pack_dir, exist_ok=True)
+        self.source_hash = file_sha256(self.source)
+        with Image.open(self.source) as image:
+            self.luma_shape = (image.height, image.width)
+
+        # 金字塔各层和遮罩互不依赖，并行生成；瓦片和特征都依赖luma_05x，之后再并行生成
+        with ThreadPoolExecutor(self.workers) as executor:
+            futures = [executor.submit(self.build_level, tag) for tag in PYRAMID_LEVELS]
+            futures.append(executor.submit(self.build_masks))
+            for future in futures:
+                future.result()
+            futures = [executor.submit(self.build_tiles), executor.submit(self.build_features)]
+            for future in futures:
+                future.result()
+
+        manifest = {
+            'name': self.name,
+            'version': PACK_FORMAT_VERSION,
+            **self.fields,
+            'assets': {
+                'luma_05x': {'name': f'{self.name}_luma_05x', 'path': self._rel('luma_05x.png'),
+                             'tiled': True, 'tiles': self._rel('tiles')},
+                'luma_0125x': {'name': f'{self.name}_luma_0125x', 'path': self._rel('luma_0125x.png')},
+                'luma_003125x': {'name': f'{self.name}_luma_003125x', 'path': self._rel('luma_003125x.png')},
+                'mask_0125x': {'name': f'{self.name}_mask_0125x', 'path': self._rel('mask_0125x.png')},
+                'mask_003125x': {'name': f'{self.name}_mask_003125x', 'path': self._rel('mask_003125x.png')},
+            },
+            'features': {
+                'params': feature_index_params(),
+                'points': self._rel('features', 'points.npy'),
+                'descriptors': self._rel('features', 'descriptors.npy'),
+            },
+        }
+        if self.teleporters is not None:
+            rel = self._rel('teleporters.json')
+            shutil.copyfile(self.teleporters, self._abs(rel))
+            self.checksums[rel] = file_sha256(self._abs(rel))
+            manifest['teleporters'] = rel
+        manifest['checksums'] = dict(sorted(self.checksums.items()))
+        manifest['build'] = {'source': os.path.basename(self.source), 'source_sha256': self.source_hash,
+                             'inputs': dict(sorted(self.inputs.items()))}
+        # manifest最后写入，中途失败时不会留下不完整的地图包
+        with open(self.manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
+        logger.info(f'map pack {self.name} -> {self.manifest_file} ({round(time.time() - pt, 2)}s)')
+        return manifest
+
+
+def verify_pack(manifest_file):
+    """检查地图包中所有文件的校验值，返回不一致的文件"""
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    root = os.path.dirname(manifest_file)
+    return [rel for rel, sha in manifest.get('checksums', {}).items()
+            if not os.path.exists(os.path.join(root, *rel.split('/')))
+            or file_sha256(os.path.join(root, *rel.split('/'))) != sha]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='map_assets_gen', description='生成用于匹配的地图资源')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    pack = sub.add_parser('pack', help='从原始地图生成地图包')
+    pack.add_argument('source', help='原始地图图片')
+    pack.add_argument('--name', required=True, help='地图名，即Map.map_name')
+    pack.add_argument('--out', default='map_packs', help='输出目录，默认为./map_packs（启动时会扫描该目录）')
+    pack.add_argument('--manifest', help='从已有的manifest中复制区域名、缩放、坐标偏移')
+    pack.add_argument('--regions', nargs='+', help='大地图上OCR到的区域名')
+    pack.add_argument('--minimap-scale', type=float)
+    pack.add_argument('--bigmap-scale', type=float)
+    pack.add_argument('--offset', type=float, nargs=2, help='游戏坐标到图片坐标的偏移')
+    pack.add_argument('--mask', help='大地图可匹配位置的遮罩')
+    pack.add_argument('--teleporters', help='传送点json，格式同checkpoints.json中的一张地图')
+    pack.add_argument('--workers', type=int, default=4)
+    pack.add_argument('--force', action='store_true', help='忽略已生成的文件，全部重新生成')
+
+    verify = sub.add_parser('verify', help='检查地图包的文件校验值')
+    verify.add_argument('manifest')
+
+    args = parser.parse_args(argv)
+    if args.command == 'pack':
+        fields = {}
+        if args.manifest is not None:
+            with open(args.manifest, 'r', encoding='utf-8') as f:
+                base = json.load(f)
+            fields = {k: base[k] for k in MANIFEST_FIELDS if k in base}
+        for field, value in [('regions', args.regions), ('minimap_position_scale', args.minimap_scale),
+                             ('bigmap_position_scale', args.bigmap_scale), ('gameloc_to_pngmap_offset', args.offset)]:
+            if value is not None:
+                fields[field] = value
+        missing = [k for k in MANIFEST_FIELDS if k not in fields]
+        if missing:
+            parser.error(f'missing {missing}, use --manifest or specify them')
+        MapPackBuilder(args.source, args.name, args.out, fields, mask=args.mask, teleporters=args.teleporters,
+                       workers=args.workers, force=args.force).build()
+    elif args.command == 'verify':
+        bad = verify_pack(args.manifest)
+        for rel in bad:
+            logger.error(f'checksum mismatch: {rel}')
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,410 @@
+'''
+小地图识别的基准测试
+
+在带真值的小地图数据上依次运行update_position、update_direction、update_rotation，
+统计每次调用耗时的分位数、吞吐量和误差分布，可以和保存的基准结果比较，变差时返回1，用于判断识别代码的优化有没有效果。
+
+生成合成数据（用地图和箭头素材渲染，真值准确）：
+    python -m whimbox.dev_tool.minimap_benchmark synth <输出目录> --map starsea --frames 300
+    注意合成的小地图就是从定位时匹配的luma_05x渲染的，没有游戏里的图标、缩放插值和色调差异，
+    position的误差几乎只反映渲染和匹配的插值，不能代表真实截图上的准确度，适合比较耗时和发现明显的退化。
+    合成数据的frames.json中记录"synthetic": true，结果和基准中也会带上，
+    基准全部来自合成数据时--baseline会给出警告，准确度的比较最好用录制的真实截图。
+
+position的误差分成两部分统计：bias为所有帧的平均偏移（固定的系统误差），error为减去bias之后的误差。
+定位本身有约(-1.4, -1.4)png像素的固定偏移：小地图用INTER_NEAREST缩小时取的是每块左上角的像素，
+亚像素峰值的坐标又比像素中心少了半个luma_05x像素（precise_loca -= 5），POSITION_MOVE只抵消了一部分。
+传送点坐标、录制的路线都是按定位结果的坐标约定标的，所以不改定位，只在结果中单独列出bias，和基准比较时也单独比较。
+运行：
+    python -m whimbox.dev_tool.minimap_benchmark run <数据目录> [--baseline base.json] [--save-baseline base.json]
+
+数据目录同ReplayCapture的目录格式（frames.json + png截图），frames.json中额外记录地图名和每帧的真值：
+    {
+        "map": "starsea",
+        "synthetic": false,           # 可选，是否为synth生成的数据
+        "init_position": [x, y],      # 可选，默认为第一个有真值的位置
+        "frames": [{"file": "000000.png", "t": 0.0, "position": [x, y], "direction": 30.5, "rotation": -12.0}, ...]
+    }
+    截图可以是全屏截图，也可以只是以小地图中心为中心、边长2*MINIMAP_RADIUS的小地图
+    position为png坐标，direction、rotation的约定同MiniMap，缺少的真值只统计耗时
+    回放时按t伪造time.time()，运动模型和速度校验的行为和录制时一致
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from whimbox.common.logger import logger
+from whimbox.interaction.replay_capture import INDEX_FILE_NAME
+from whimbox.map.detection.cvars import *
+from whimbox.map.detection.utils import MapAsset, rotate_bound, create_circle_mask
+
+ESTIMATORS = ('position', 'direction', 'rotation')
+# 误差超过该值算识别失败（position为png像素，其余为角度）
+FAIL_THRESHOLD = {'position': 5., 'direction': 5., 'rotation': 5.}
+# 和基准比较时允许的变化：耗时按比例，误差按绝对值，失败率按比例点
+LATENCY_TOLERANCE = 0.2
+ERROR_TOLERANCE = {'position': 0.2, 'direction': 0.5, 'rotation': 0.5}
+FAIL_RATE_TOLERANCE = 0.02
+
+
+def to_minimap_degree(degree):
+    '''顺时针、正北为0的角度，换算为MiniMap的角度约定'''
+    degree = degree % 360
+    return 360 - degree if degree > 180 else -degree
+
+
+def angle_error(a, b):
+    return abs((a - b + 180) % 360 - 180)
+
+
+class MinimapDataset:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.map_name = index['map']
+        self.frames = index['frames']
+        self.synthetic = bool(index.get('synthetic', False))
+        self.init_position = index.get('init_position')
+        if self.init_position is None:
+            self.init_position = next((f['position'] for f in self.frames if 'position' in f), None)
+        if self.init_position is None:
+            raise ValueError(f'{path}: no init_position or position label')
+
+    def __len__(self):
+        return len(self.frames)
+
+    def read(self, i) -> np.ndarray:
+        image = cv2.imread(os.path.join(self.path, self.frames[i]['file']), cv2.IMREAD_COLOR)
+        h, w = image.shape[:2]
+        if h >= MINIMAP_CAPTURE_AREA[3] and w >= MINIMAP_CAPTURE_AREA[2]:
+            return image
+        # 只有小地图时，放到截图中小地图的位置上
+        canvas = np.zeros((MINIMAP_CAPTURE_AREA[3], MINIMAP_CAPTURE_AREA[2], 3), dtype=np.uint8)
+        x, y = MINIMAP_CENTER[0] - w // 2, MINIMAP_CENTER[1] - h // 2
+        canvas[y:y + h, x:x + w] = image
+        return canvas
+
+
+class _ReplayClock:
+    '''按录制的时间戳返回time.time()'''
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def _summary(costs, errors, estimator) -> dict:
+    costs = np.array(costs) * 1000
+    result = {
+        'samples': len(costs),
+        'latency_ms': {
+            'mean': round(float(costs.mean()), 3),
+            'p50': round(float(np.percentile(costs, 50)), 3),
+            'p95': round(float(np.percentile(costs, 95)), 3),
+            'p99': round(float(np.percentile(costs, 99)), 3),
+            'max': round(float(costs.max()), 3),
+        },
+        'throughput': round(float(1000 / costs.mean()), 1),
+    }
+    if errors:
+        errors = np.array(errors)
+        if errors.ndim == 2:
+            # 位置误差是(dx, dy)，固定偏移单独统计，误差分布按去掉偏移后的距离计算
+            bias = errors.mean(axis=0)
+            result['bias'] = [round(float(v), 3) for v in bias]
+            errors = np.linalg.norm(errors - bias, axis=1)
+        result['error'] = {
+            'samples': len(errors),
+            'mean': round(float(errors.mean()), 3),
+            'p50': round(float(np.percentile(errors, 50)), 3),
+            'p95': round(float(np.percentile(errors, 95)), 3),
+            'p99': round(float(np.percentile(errors, 99)), 3),
+            'max': round(float(errors.max()), 3),
+        }
+        result['fail_rate'] = round(float(np.mean(errors > FAIL_THRESHOLD[estimator])), 4)
+    return result
+
+
+def run(dataset: MinimapDataset) -> dict:
+    '''
+    和MiniMap.update_minimap一样，每帧依次定位、识别人物朝向和镜头朝向，分别计时
+    '''
+    from whimbox.map.detection.minimap import MiniMap
+
+    clock = _ReplayClock()
+    clock.now = dataset.frames[0]['t'] - MOTION_MODEL_MAX_DT - 1
+    costs = {e: [] for e in ESTIMATORS}
+    errors = {e: [] for e in ESTIMATORS}
+    with mock.patch('time.time', clock):
+        # MiniMap的计时器要在回放时钟下创建，否则预热帧的速度校验会得到很大的负dt
+        minimap = MiniMap()
+        minimap.map_name = dataset.map_name
+        # 先跑一帧，地图加载、遮罩生成等一次性开销不计入耗时
+        minimap.init_position(tuple(dataset.init_position))
+        image = dataset.read(0)
+        minimap.update_position(image)
+        minimap.update_direction(image)
+        minimap.update_rotation(image, update_position=False)
+
+        minimap.init_position(tuple(dataset.init_position))
+        minimap.pos_change_timer.reset()
+        for i, frame in enumerate(dataset.frames):
+            image = dataset.read(i)
+            clock.now = frame['t']
+            pt = time.perf_counter()
+            position = minimap.update_position(image)
+            costs['position'].append(time.perf_counter() - pt)
+            pt = time.perf_counter()
+            direction = minimap.update_direction(image)
+            costs['direction'].append(time.perf_counter() - pt)
+            pt = time.perf_counter()
+            rotation = minimap.update_rotation(image, update_position=False)
+            costs['rotation'].append(time.perf_counter() - pt)
+
+            if 'position' in frame:
+                errors['position'].append(np.subtract(position, frame['position']).astype(float))
+            if 'direction' in frame:
+                # 没找到箭头时direction为None，算作最大误差
+                errors['direction'].append(180. if direction is None else angle_error(direction, frame['direction']))
+            if 'rotation' in frame:
+                errors['rotation'].append(angle_error(rotation, frame['rotation']))
+    report = {e: _summary(costs[e], errors[e], e) for e in ESTIMATORS}
+    report['synthetic'] = dataset.synthetic
+    return report
+
+
+def print_report(report, title=''):
+    if title:
+        print(title)
+    for estimator in ESTIMATORS:
+        r = report[estimator]
+        lat = r['latency_ms']
+        line = (f'  {estimator:9s} p50 {lat["p50"]:7.3f}ms  p95 {lat["p95"]:7.3f}ms  p99 {lat["p99"]:7.3f}ms  '
+                f'max {lat["max"]:7.3f}ms  {r["throughput"]:8.1f}/s')
+        if 'error' in r:
+            err = r['error']
+            line += (f'  | error mean {err["mean"]:.3f}  p50 {err["p50"]:.3f}  p95 {err["p95"]:.3f}  '
+                     f'max {err["max"]:.3f}  fail {r["fail_rate"] * 100:.1f}%')
+        if 'bias' in r:
+            line += f'  bias ({r["bias"][0]:.3f}, {r["bias"][1]:.3f})'
+        print(line)
+
+
+def compare(report, baseline, latency_tolerance=LATENCY_TOLERANCE) -> list:
+    '''
+    Returns:
+        list[str]: 比基准变差的项，为空时没有退化
+    '''
+    regressions = []
+    for estimator in ESTIMATORS:
+        new, old = report.get(estimator), baseline.get(estimator)
+        if not new or not old:
+            continue
+        for key in ('p50', 'p95'):
+            a, b = new['latency_ms'][key], old['latency_ms'][key]
+            if a > b * (1 + latency_tolerance):
+                regressions.append(f'{estimator} latency {key}: {b}ms -> {a}ms')
+        if 'error' in new and 'error' in old:
+            a, b = new['error']['p95'], old['error']['p95']
+            if a > b + ERROR_TOLERANCE[estimator]:
+                regressions.append(f'{estimator} error p95: {b} -> {a}')
+            a, b = new['fail_rate'], old['fail_rate']
+            if a > b + FAIL_RATE_TOLERANCE:
+                regressions.append(f'{estimator} fail rate: {b} -> {a}')
+        if 'bias' in new and 'bias' in old:
+            a, b = new['bias'], old['bias']
+            if np.linalg.norm(np.subtract(a, b)) > ERROR_TOLERANCE[estimator]:
+                regressions.append(f'{estimator} bias: {b} -> {a}')
+    return regressions
+
+
+class MinimapSynthesizer:
+    '''
+    用luma_05x地图和箭头素材渲染小地图：地图按小地图比例放大，叠加半透明的白色视野扇形和人物箭头。
+    人物沿地图上可以走的地方随机移动，箭头朝向移动方向，镜头朝向缓慢随机变化。
+    '''
+
+    # 视野扇形的张角和亮度
+    SIGHT_ANGLE = 90
+    SIGHT_ALPHA = 0.2
+    # 小地图圆外的颜色
+    BORDER_COLOR = 40
+    # 起点附近地图亮度的最小标准差
+    MIN_TEXTURE = 15
+    # 箭头底色的亮度比例
+    ARROW_BACKDROP = 0.1
+
+    def __init__(self, map_name, seed=0):
+        from whimbox.map.detection.map_assets import MAP_ASSETS_DICT
+
+        self.map_name = map_name
+        self.assets = MAP_ASSETS_DICT[map_name]
+        self.scale = MINIMAP_POSITION_SCALE_DICT[map_name] * POSITION_SEARCH_SCALE
+        self.rng = np.random.default_rng(seed)
+        self.arrow = MapAsset('ARROW').img
+        d = MINIMAP_RADIUS * 2
+        self.circle = create_circle_mask(d, d)
+        self.arrow_backdrop = create_circle_mask(d, d, radius=DIRECTION_RADIUS)
+        y, x = np.mgrid[:d, :d] - MINIMAP_RADIUS + 0.5
+        # 每个像素顺时针、正北为0的角度
+        self.pixel_angle = np.degrees(np.arctan2(x, -y)) % 360
+
+    def is_valid(self, position):
+        # mask_0125x上非0的位置是地图内
+        mask = self.assets['mask_0125x'].img
+        x, y = (np.array(position) * 0.125).astype(int)
+        return 0 <= y < mask.shape[0] and 0 <= x < mask.shape[1] and mask[y, x] > 0
+
+    def random_position(self):
+        '''地图内的随机位置，起点选在纹理较多的地方，纯色区域本来就没法定位'''
+        mask = self.assets['mask_0125x'].img
+        valid = np.argwhere(mask > 0)
+        for _ in range(100):
+            y, x = valid[self.rng.integers(len(valid))]
+            position = (x + 0.5) * 8, (y + 0.5) * 8
+            cx, cy = np.array(position) * POSITION_SEARCH_SCALE
+            r = MINIMAP_RADIUS * self.scale
+            if self.assets['luma_05x'].crop((cx - r, cy - r, cx + r, cy + r)).std() >= self.MIN_TEXTURE:
+                break
+        return position
+
+    def render(self, position, direction, rotation) -> np.ndarray:
+        '''
+        Args:
+            position: png坐标
+            direction: 人物朝向，顺时针、正北为0
+            rotation: 镜头朝向，顺时针、正北为0
+
+        Returns:
+            np.ndarray: 边长2*MINIMAP_RADIUS的BGR小地图
+        '''
+        d = MINIMAP_RADIUS * 2
+        s = self.scale
+        center = np.array(position) * POSITION_SEARCH_SCALE
+        half = int(np.ceil(MINIMAP_RADIUS * s)) + 4
+        x1, y1 = np.floor(center).astype(int) - half
+        patch = self.assets['luma_05x'].crop((x1, y1, x1 + 2 * half, y1 + 2 * half)).astype(np.float32)
+        # 小地图像素中心(i + 0.5)对应地图上的center + (i + 0.5 - R) * s
+        offset = center - (x1, y1) - MINIMAP_RADIUS * s - 0.5 + 0.5 * s
+        warp = np.float32([[s, 0, offset[0]], [0, s, offset[1]]])
+        luma = cv2.warpAffine(patch, warp, (d, d), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP)
+
+        # 视野扇形
+        sight = angle_error(self.pixel_angle, rotation) <= self.SIGHT_ANGLE / 2
+        luma = np.where(sight, luma + (255 - luma) * self.SIGHT_ALPHA, luma)
+        luma = np.clip(luma + self.rng.normal(0, 2, luma.shape), 0, 255)
+        luma[~self.circle] = self.BORDER_COLOR
+        image = np.repeat(luma[:, :, None], 3, axis=2)
+
+        # 箭头周围压暗，浅色的灰度地图和DIRECTION_SIMILARITY_COLOR很接近，会被当成箭头。
+        # 这个范围被位置匹配的遮罩扣掉了，镜头朝向也只检测更外面的一圈，不影响另外两项
+        image[self.arrow_backdrop] *= self.ARROW_BACKDROP
+        # 人物箭头，素材是黑底白色，亮度作为透明度，颜色为DIRECTION_SIMILARITY_COLOR
+        arrow = rotate_bound(self.arrow, direction)
+        alpha = (arrow.max(axis=2) if arrow.ndim == 3 else arrow).astype(np.float32)[:, :, None] / 255
+        h, w = alpha.shape[:2]
+        ay, ax = MINIMAP_RADIUS - h // 2, MINIMAP_RADIUS - w // 2
+        region = image[ay:ay + h, ax:ax + w]
+        image[ay:ay + h, ax:ax + w] = region * (1 - alpha) + np.array(DIRECTION_SIMILARITY_COLOR) * alpha
+        return np.round(image).astype(np.uint8)
+
+    def generate(self, path, frames=300, fps=10, speed=15):
+        '''
+        Args:
+            path: 输出目录
+            frames: 帧数
+            fps: 帧率
+            speed: 移动速度，png像素/秒，不要超过MOVE_SPEED
+        '''
+        os.makedirs(path, exist_ok=True)
+        position = np.array(self.random_position())
+        heading = self.rng.uniform(0, 360)
+        rotation = self.rng.uniform(0, 360)
+        init_position = position.copy()
+        index = []
+        for i in range(frames):
+            # 随机转弯，走出地图时换个方向
+            heading = (heading + self.rng.normal(0, 15)) % 360
+            rotation = (rotation + self.rng.normal(0, 10)) % 360
+            for _ in range(36):
+                step = speed / fps * np.array([np.sin(np.radians(heading)), -np.cos(np.radians(heading))])
+                if self.is_valid(position + step):
+                    position = position + step
+                    break
+                heading = (heading + 10) % 360
+            file = f'{i:06d}.png'
+            cv2.imwrite(os.path.join(path, file), self.render(position, heading, rotation))
+            index.append({
+                'file': file,
+                't': round(i / fps, 6),
+                'position': [round(float(v), 3) for v in position],
+                'direction': round(float(to_minimap_degree(heading)), 3),
+                'rotation': round(float(to_minimap_degree(rotation)), 3),
+            })
+        with open(os.path.join(path, INDEX_FILE_NAME), 'w', encoding='utf-8') as f:
+            json.dump({'map': self.map_name, 'synthetic': True,
+                       'init_position': [round(float(v), 3) for v in init_position],
+                       'frames': index}, f, indent=1)
+        logger.info(f'{frames} frames of {self.map_name} written to {path}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='小地图识别的基准测试')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('synth', help='生成合成数据')
+    p.add_argument('out')
+    p.add_argument('--map', required=True)
+    p.add_argument('--frames', type=int, default=300)
+    p.add_argument('--fps', type=float, default=10)
+    p.add_argument('--speed', type=float, default=15, help='移动速度，png像素/秒')
+    p.add_argument('--seed', type=int, default=0)
+
+    p = sub.add_parser('run', help='运行基准测试')
+    p.add_argument('dataset', nargs='+')
+    p.add_argument('--baseline', help='和该基准结果比较，变差时返回1')
+    p.add_argument('--save-baseline', help='把结果保存为基准')
+    p.add_argument('--latency-tolerance', type=float, default=LATENCY_TOLERANCE)
+
+    args = parser.parse_args(argv)
+    if args.command == 'synth':
+        MinimapSynthesizer(args.map, seed=args.seed).generate(
+            args.out, frames=args.frames, fps=args.fps, speed=args.speed)
+        return 0
+
+    reports = {}
+    for path in args.dataset:
+        reports[os.path.basename(os.path.normpath(path))] = report = run(MinimapDataset(path))
+        print_report(report, title=f'{path}, {report["position"]["samples"]} frames')
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = []
+        compared = [name for name in reports if name in baseline]
+        for name in compared:
+            regressions += [f'{name}: {r}' for r in compare(reports[name], baseline[name], args.latency_tolerance)]
+        if compared and all(baseline[name].get('synthetic', False) for name in compared):
+            logger.warning('baseline only contains synthetic datasets, '
+                           'position errors on them say little about accuracy on real screenshots')
+        for r in regressions:
+            print(f'REGRESSION {r}')
+        if regressions:
+            return 1
+        print('no regression')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
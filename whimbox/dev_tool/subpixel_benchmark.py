@@ -0,0 +1,94 @@
+'''
+亚像素峰值定位方法的精度和耗时对比
+
+合成数据（有真值）：
+    python -m whimbox.dev_tool.subpixel_benchmark synthetic
+录制数据（以cubic为参照，比较其他方法的偏差）：
+    python -m whimbox.dev_tool.subpixel_benchmark replay <录制路径> <map_name> <x> <y>
+'''
+
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from whimbox.map.detection.cvars import SUBPIXEL_CUBIC, SUBPIXEL_QUADRATIC, SUBPIXEL_GAUSSIAN
+from whimbox.map.detection.utils import subpixel_find_maximum
+
+METHODS = [SUBPIXEL_CUBIC, SUBPIXEL_QUADRATIC, SUBPIXEL_GAUSSIAN]
+
+
+def _print_report(errors: dict, costs: dict, title):
+    print(title)
+    for method in METHODS:
+        err = np.array(errors[method])
+        print(f'  {method:10s} mean {err.mean():.3f}px  p95 {np.percentile(err, 95):.3f}px  '
+              f'max {err.max():.3f}px  cost {np.mean(costs[method]) * 1e6:.1f}us')
+
+
+def synthetic(times=300, texture=None, seed=0):
+    '''
+    把纹理平移一个已知的亚像素距离后做模板匹配，比较各方法找回的平移量
+    '''
+    rng = np.random.default_rng(seed)
+    if texture is None:
+        texture = cv2.GaussianBlur(rng.integers(0, 255, (400, 400)).astype(np.float32), (0, 0), 3)
+        texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    errors = {m: [] for m in METHODS}
+    costs = {m: [] for m in METHODS}
+    for _ in range(times):
+        dx, dy = rng.uniform(-0.5, 0.5, 2)
+        shifted = cv2.warpAffine(texture, np.float32([[1, 0, -dx], [0, 1, -dy]]), texture.shape[::-1], flags=cv2.INTER_CUBIC)
+        template = shifted[150:250, 150:250]
+        result = cv2.matchTemplate(texture[135:265, 135:265], template, cv2.TM_CCOEFF_NORMED)
+        _, _, _, loca = cv2.minMaxLoc(result)
+        precise = result[loca[1] - 4:loca[1] + 4, loca[0] - 4:loca[0] + 4]
+        truth = np.array([15 + dx, 15 + dy])
+        for method in METHODS:
+            pt = time.perf_counter()
+            _, precise_loca = subpixel_find_maximum(precise, precision=0.05, method=method)
+            costs[method].append(time.perf_counter() - pt)
+            # 和minimap中一样减去5，再补回cubic的坐标约定
+            est = np.array(loca) + precise_loca - 5 + 0.5 + 0.025
+            errors[method].append(np.linalg.norm(est - truth))
+    _print_report(errors, costs, f'synthetic, {times} samples (error to ground truth)')
+    return errors, costs
+
+
+def replay(path, map_name, position):
+    '''
+    在录制的小地图上定位，每帧都从同一个起点用各方法计算，以cubic结果为参照
+    '''
+    from whimbox.interaction.replay_capture import ReplayCapture
+    from whimbox.map.detection.minimap import MiniMap
+    from whimbox.map.detection.cvars import MINIMAP_POSITION_RADIUS, MINIMAP_POSITION_SCALE_DICT
+    from whimbox.common.utils.img_utils import rgb2luma
+
+    capture = ReplayCapture(path, speed=0)
+    minimap = MiniMap()
+    minimap.map_name = map_name
+    minimap.init_position(position)
+    errors = {m: [] for m in METHODS}
+    costs = {m: [] for m in METHODS}
+    while not capture.finished:
+        image = capture.capture()
+        local = rgb2luma(minimap._get_minimap(image, MINIMAP_POSITION_RADIUS))
+        results = {}
+        for method in METHODS:
+            minimap.subpixel_method = method
+            pt = time.perf_counter()
+            _, _, results[method] = minimap._predict_position(local, MINIMAP_POSITION_SCALE_DICT[map_name])
+            costs[method].append(time.perf_counter() - pt)
+        for method in METHODS:
+            errors[method].append(np.linalg.norm(results[method] - results[SUBPIXEL_CUBIC]))
+        minimap.position = tuple(results[SUBPIXEL_CUBIC])
+    _print_report(errors, costs, f'replay {path}, {capture.frame_count} frames (deviation from cubic, cost of whole _predict_position)')
+    return errors, costs
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 6 and sys.argv[1] == 'replay':
+        replay(sys.argv[2], sys.argv[3], (float(sys.argv[4]), float(sys.argv[5])))
+    else:
+        synthetic()
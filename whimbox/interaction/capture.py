@@ -1,7 +1,3 @@
-import threading
-import time
-
-from whimbox.common import timer_module
 import numpy as np
 from whimbox.common.handle_lib import HANDLE_OBJ
 import win32ui
@@ -9,88 +5,9 @@ import cv2
 import win32gui
 import ctypes
 from whimbox.common.logger import logger
-from whimbox.common.cvars import DEBUG_MODE
-
-
-class Capture():
-    def __init__(self):
-        self.capture_cache = np.zeros_like((1080,1920,3), dtype="uint8")
-        self.resolution = None
-        self.max_fps = 30
-        self.fps_timer = timer_module.Timer(diff_start_time=1)
-        self.capture_cache_lock = threading.Lock()
-        self.capture_times = 0
-        self.cap_per_sec = timer_module.CyclicCounter(limit=3).start()
-        self.last_cap_times = 0
+from whimbox.interaction.capture_base import Frame, CaptureProducer, Capture
 
-    def _cover_privacy(self, img: np.ndarray) -> np.ndarray:
-        return img
-
-    def _normalize_shape(self, img: np.ndarray) -> np.ndarray:
-        if self._check_shape(img):
-            self.resolution = img.shape[:2]
-            if img.shape == (1080,1920,4):
-                return img
-            else:
-                return cv2.resize(img, (1920, 1080), interpolation=cv2.INTER_AREA)
-        else:
-            self.resolution = None
-            return None
-    
-    def _get_capture(self) -> np.ndarray:
-        """
-        需要根据不同截图方法实现该函数。
-        """
-    
-    def _check_shape(self, img:np.ndarray):
-        if img is None:
-            return False
-        if img.shape == [1080,1920,4]:
-            return True
-        else:
-            return False
-        
-    def capture(self, force=False) -> np.ndarray:
-        """
-        供外部调用的截图接口
 
-        Args:
-            force: 无视帧率限制，强制截图
-        """
-        if DEBUG_MODE:
-            r = self.cap_per_sec.count_times()
-            if r:
-                if r != self.last_cap_times:
-                    logger.trace(f"capps: {r/3}")
-                    self.last_cap_times = r
-                elif r >= 10*3:
-                    logger.trace(f"capps: {r/3}")
-                elif r >= 20*3:
-                    logger.debug(f"capps: {r/3}")
-                elif r >= 40*3:
-                    logger.info(f"capps: {r/3}")
-        self._capture(force)
-        self.capture_cache_lock.acquire()
-        cp = self.capture_cache.copy()
-        self.capture_cache_lock.release()
-        return cp
-    
-    def _capture(self, force) -> None:
-        if (self.fps_timer.get_diff_time() >= 1/self.max_fps) or force:
-            self.fps_timer.reset()
-            self.capture_cache_lock.acquire()
-            self.capture_times+=1
-            while 1:
-                normalized_img = self._normalize_shape(self._get_capture())
-                if normalized_img is not None:
-                    self.capture_cache = normalized_img
-                    break
-                else:
-                    time.sleep(2)
-            self.capture_cache_lock.release()
-        else:
-            pass
-    
 from ctypes.wintypes import RECT
 import win32print, win32api
 
@@ -0,0 +1,268 @@
+"""
+与平台无关的截图基类和帧，不依赖win32，回放录制的截图时（包括非Windows系统）只需要这个模块。
+具体的截图方法见capture.py、winsdk_capture.py。
+"""
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from whimbox.common import timer_module
+from whimbox.common.logger import logger
+from whimbox.common.cvars import DEBUG_MODE
+from whimbox.common.base_threading import AdvanceThreading
+from whimbox.common.utils.img_utils import crop
+
+
+class Frame():
+    """
+    一帧截图。
+
+    raw为游戏窗口原分辨率的截图，image为缩放到1920x1080的截图，均为只读数组，
+    多个调用方可以直接共享同一帧，不需要复制。
+    frame_id单调递增，可用于判断两次读取是否来自同一帧。
+    """
+    __slots__ = ('frame_id', 'timestamp', 'raw', 'scale', '_image')
+
+    def __init__(self, frame_id: int, timestamp: float, raw: np.ndarray):
+        raw.flags.writeable = False
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.raw = raw
+        # 原分辨率相对1080p的缩放比例
+        self.scale = raw.shape[1] / 1920
+        self._image = raw if raw.shape[:2] == (1080, 1920) else None
+
+    @property
+    def image(self) -> np.ndarray:
+        """1920x1080的完整截图，非1080p分辨率时在第一次访问时才缩放"""
+        if self._image is None:
+            image = cv2.resize(self.raw, (1920, 1080), interpolation=cv2.INTER_AREA)
+            image.flags.writeable = False
+            self._image = image
+        return self._image
+
+    def crop(self, area) -> np.ndarray:
+        """
+        截取1080p坐标系下的区域。
+
+        非1080p分辨率时，只把原图中对应的区域缩放到目标大小，不缩放整张截图。
+
+        Args:
+            area: (x1, y1, x2, y2)，1080p坐标
+
+        Returns:
+            np.ndarray: 区域截图，可能是原帧的只读视图
+        """
+        if self._image is not None:
+            return crop(self._image, area, copy=False)
+        x1, y1, x2, y2 = map(int, map(round, area))
+        s = self.scale
+        native = crop(self.raw, (x1 * s, y1 * s, x2 * s, y2 * s), copy=False)
+        return cv2.resize(native, (x2 - x1, y2 - y1), interpolation=cv2.INTER_AREA)
+
+    def __repr__(self):
+        return f'Frame(id={self.frame_id}, t={round(self.timestamp, 3)}, shape={self.raw.shape})'
+
+
+class CaptureProducer(AdvanceThreading):
+    """
+    后台截图线程。按固定帧率截图并发布到Capture的环形缓冲区，
+    截图耗时不再由调用capture的控制循环承担。
+    """
+
+    def __init__(self, capture_obj, fps):
+        super().__init__(thread_name="CaptureProducer")
+        self.capture_obj = capture_obj
+        self.interval = 1 / fps
+        self.while_sleep = 0
+        self.daemon = True
+
+    def loop(self):
+        pt = time.time()
+        self.capture_obj._capture(force=True, producer=self)
+        time.sleep(max(0, self.interval - (time.time() - pt)))
+
+
+class Capture():
+    # 环形缓冲区保留的帧数
+    FRAME_BUFFER_SIZE = 4
+    # 截图分辨率不对时的重试间隔
+    INVALID_SHAPE_RETRY_INTERVAL = 2
+    # 停止后台截图线程时最多等待的秒数，大于重试间隔
+    PRODUCER_JOIN_TIMEOUT = 3
+
+    def __init__(self):
+        self.frame_buffer = deque(maxlen=self.FRAME_BUFFER_SIZE)
+        self.frame_id = 0
+        self.resolution = None
+        self.max_fps = 30
+        self.fps_timer = timer_module.Timer(diff_start_time=1)
+        self.capture_cache_lock = threading.Lock()
+        # 截图本身较慢，单独加锁，避免读取缓冲区时被截图阻塞
+        self.grab_lock = threading.Lock()
+        # 有新帧发布时通知所有等待者
+        self.frame_cond = threading.Condition(self.capture_cache_lock)
+        self.producer = None
+        self.capture_times = 0
+        self.cap_per_sec = timer_module.CyclicCounter(limit=3).start()
+        self.last_cap_times = 0
+
+    def _cover_privacy(self, img: np.ndarray) -> np.ndarray:
+        return img
+
+    def _normalize_shape(self, img: np.ndarray) -> np.ndarray:
+        """
+        检查截图分辨率。这里不再缩放到1080p，缩放交给Frame按需进行，
+        这样只读取小区域时不需要缩放整张2K/4K截图。
+        """
+        if self._check_shape(img):
+            self.resolution = img.shape[:2]
+            return img
+        else:
+            self.resolution = None
+            return None
+    
+    def _get_capture(self) -> np.ndarray:
+        """
+        需要根据不同截图方法实现该函数。
+        """
+    
+    def _check_shape(self, img:np.ndarray):
+        if img is None:
+            return False
+        if img.shape == [1080,1920,4]:
+            return True
+        else:
+            return False
+
+    def _print_capps(self):
+        r = self.cap_per_sec.count_times()
+        if r:
+            if r != self.last_cap_times:
+                logger.trace(f"capps: {r/3}")
+                self.last_cap_times = r
+            elif r >= 10*3:
+                logger.trace(f"capps: {r/3}")
+            elif r >= 20*3:
+                logger.debug(f"capps: {r/3}")
+            elif r >= 40*3:
+                logger.info(f"capps: {r/3}")
+
+    def capture(self, force=False) -> np.ndarray:
+        """
+        供外部调用的截图接口
+
+        Args:
+            force: 无视帧率限制，强制截图
+
+        Returns:
+            np.ndarray: 只读的1920x1080x4截图，不要原地修改
+        """
+        return self.capture_frame(force).image
+
+    def capture_frame(self, force=False) -> Frame:
+        """
+        获取最新的一帧，同一帧内的多次识别应共享返回的Frame对象
+
+        Args:
+            force: 无视帧率限制，强制截图
+        """
+        if DEBUG_MODE:
+            self._print_capps()
+        # 后台线程在截图时，直接取最新帧
+        if force or not (self.is_producing() and self.frame_buffer):
+            self._capture(force)
+        with self.capture_cache_lock:
+            return self.frame_buffer[-1]
+
+    def wait_frame(self, after_id: int, timeout=1.0) -> Frame:
+        """
+        阻塞等待一帧frame_id大于after_id的新帧
+
+        Args:
+            after_id: 已经处理过的帧id
+            timeout: 超时时间，超时后返回当前最新帧
+
+        Returns:
+            Frame: 新帧
+        """
+        if not self.is_producing():
+            return self.capture_frame(force=True)
+        with self.frame_cond:
+            self.frame_cond.wait_for(
+                lambda: self.frame_buffer and self.frame_buffer[-1].frame_id > after_id,
+                timeout=timeout)
+            if self.frame_buffer:
+                return self.frame_buffer[-1]
+        return self.capture_frame()
+
+    def is_producing(self) -> bool:
+        return self.producer is not None and self.producer.is_alive()
+
+    def start_producer(self, fps=None):
+        """
+        开启后台截图线程
+
+        Args:
+            fps: 后台截图帧率，默认为max_fps
+        """
+        if self.is_producing():
+            return
+        fps = fps or self.max_fps
+        self.producer = CaptureProducer(self, fps)
+        self.producer.start()
+        logger.debug(f"capture producer started, fps: {fps}")
+
+    def stop_producer(self):
+        if self.producer is None:
+            return
+        self.producer.stop_threading()
+        self.producer.join(timeout=self.PRODUCER_JOIN_TIMEOUT)
+        if self.producer.is_alive():
+            # 线程是daemon的，卡在截图里也不会阻止程序退出
+            logger.warning("capture producer did not stop in time")
+        self.producer = None
+        logger.debug("capture producer stopped")
+
+    def get_frame(self, frame_id: int) -> Frame:
+        """从环形缓冲区中取出指定id的帧，已被覆盖则返回None"""
+        with self.capture_cache_lock:
+            for frame in reversed(self.frame_buffer):
+                if frame.frame_id == frame_id:
+                    return frame
+        return None
+
+    def _publish_frame(self, img: np.ndarray) -> Frame:
+        """发布新帧，调用时需持有capture_cache_lock"""
+        self.frame_id += 1
+        frame = Frame(self.frame_id, time.time(), img)
+        self.frame_buffer.append(frame)
+        self.frame_cond.notify_all()
+        return frame
+    
+    def _capture(self, force, producer=None) -> None:
+        """
+        截图并发布到缓冲区
+
+        Args:
+            force: 无视帧率限制，强制截图
+            producer: 由后台截图线程调用时传入，线程停止后不再等待分辨率恢复
+        """
+        if (self.fps_timer.get_diff_time() >= 1/self.max_fps) or force or not self.frame_buffer:
+            self.fps_timer.reset()
+            with self.grab_lock:
+                self.capture_times+=1
+                while 1:
+                    normalized_img = self._normalize_shape(self._get_capture())
+                    if normalized_img is not None:
+                        break
+                    if producer is not None and producer.stop_threading_flag:
+                        return
+                    time.sleep(self.INVALID_SHAPE_RETRY_INTERVAL)
+                with self.capture_cache_lock:
+                    self._publish_frame(normalized_img)
+        else:
+            pass
@@ -0,0 +1,78 @@
+import threading
+
+import cv2
+import numpy as np
+
+from whimbox.interaction.capture_base import Frame
+from whimbox.common.utils.img_utils import rgb2luma
+
+
+class FrameContext():
+    """
+    一帧截图的预处理缓存。
+
+    亮度、HSV、灰度等转换按区域惰性计算并缓存，同一帧上的多个识别模块共享结果。
+    请求的区域被已经算过的更大区域包含时，直接从大区域中切出来，不重复转换。
+    返回的数组都是只读的，需要修改时请先copy。
+    """
+
+    def __init__(self, frame: Frame):
+        self.frame = frame
+        self.frame_id = frame.frame_id
+        # kind -> [(area, plane)]
+        self._planes = {}
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize_area(area):
+        return tuple(int(round(v)) for v in np.ravel(area)[:4])
+
+    def _get_plane(self, kind, area, func):
+        area = self._normalize_area(area)
+        x1, y1, x2, y2 = area
+        with self._lock:
+            for (ax1, ay1, ax2, ay2), plane in self._planes.get(kind, []):
+                if ax1 <= x1 and ay1 <= y1 and x2 <= ax2 and y2 <= ay2:
+                    return plane[y1 - ay1:y2 - ay1, x1 - ax1:x2 - ax1]
+        plane = func(self.bgr(area))
+        plane.flags.writeable = False
+        with self._lock:
+            self._planes.setdefault(kind, []).append((area, plane))
+        return plane
+
+    def bgr(self, area) -> np.ndarray:
+        """三通道截图，同itt.capture(posi=area)"""
+        img = self.frame.crop(area)
+        if img.ndim == 3 and img.shape[2] == 4:
+            img = img[:, :, :3]
+        return img
+
+    def luma(self, area) -> np.ndarray:
+        """亮度，同rgb2luma"""
+        return self._get_plane('luma', area, rgb2luma)
+
+    def hsv(self, area) -> np.ndarray:
+        """HSV，同cv2.cvtColor(img, cv2.COLOR_BGR2HSV)"""
+        return self._get_plane('hsv', area, lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+
+    def gray(self, area) -> np.ndarray:
+        """灰度，同cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)"""
+        return self._get_plane('gray', area, lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+    def hsv_mask(self, area, lower_limit, upper_limit) -> np.ndarray:
+        """HSV颜色范围内的掩码，同process_with_hsv_limit"""
+        key = (self._normalize_area(area), tuple(lower_limit), tuple(upper_limit))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = cv2.inRange(self.hsv(area), np.array(lower_limit), np.array(upper_limit))
+            mask.flags.writeable = False
+            self._masks[key] = mask
+        return mask
+
+    def count_hsv(self, area, lower_limit, upper_limit) -> int:
+        """HSV颜色范围内的像素数，同count_px_with_hsv_limit"""
+        return cv2.countNonZero(self.hsv_mask(area, lower_limit, upper_limit))
+
+    def __repr__(self):
+        return f'FrameContext({self.frame})'
@@ -4,16 +4,19 @@ import random
 import threading
 import time
 import cv2
+import numpy as np
 import os
-import ctypes
+import sys
 
 from whimbox.ui.template import img_manager, text_manager, posi_manager
 from whimbox.common.timer_module import TimeoutTimer, AdvanceTimer
+from whimbox.common.cache import LRUCache
+from whimbox.interaction.frame_context import FrameContext
 from whimbox.common.cvars import *
 from whimbox.common.path_lib import ROOT_PATH
 from whimbox.common.logger import logger, get_logger_format_date
 from whimbox.common.utils.utils import get_active_window_process_name
-from whimbox.common.utils.img_utils import crop, process_with_hsv_limit, similar_img, add_padding
+from whimbox.common.utils.img_utils import process_with_hsv_limit, similar_img, add_padding, luma_thumbnail, dirty_block_ratio
 from whimbox.config.config import global_config
 
 ocr_type = global_config.get('General', 'ocr')
@@ -42,19 +45,6 @@ def before_operation(print_log=False):
         return wrapper
     return outwrapper
 
-GetDC = ctypes.windll.user32.GetDC
-CreateCompatibleDC = ctypes.windll.gdi32.CreateCompatibleDC
-GetClientRect = ctypes.windll.user32.GetClientRect
-CreateCompatibleBitmap = ctypes.windll.gdi32.CreateCompatibleBitmap
-SelectObject = ctypes.windll.gdi32.SelectObject
-BitBlt = ctypes.windll.gdi32.BitBlt
-SRCCOPY = 0x00CC0020
-GetBitmapBits = ctypes.windll.gdi32.GetBitmapBits
-DeleteObject = ctypes.windll.gdi32.DeleteObject
-ReleaseDC = ctypes.windll.user32.ReleaseDC
-PostMessageW = ctypes.windll.user32.PostMessageW
-MapVirtualKeyW = ctypes.windll.user32.MapVirtualKeyW
-
 
 class InteractionBGD:
     """
@@ -64,6 +54,9 @@ class InteractionBGD:
     """
 
     RECAPTURE_LIMIT = 0.5 # Screenshot Cache Maximum Interval
+    REC_ONLY_PADDING = 4 # 只识别模式下的padding，识别模型只需要很小的边距
+    DETECT_CACHE_SIZE = 256 # 同一帧识别结果的缓存条数
+    FRAME_CONTEXT_CACHE_SIZE = 4 # 保留最近几帧的预处理结果
     
 
     def __init__(self):
@@ -74,13 +67,78 @@ class InteractionBGD:
         self.itt_exec = None
         self.capture_obj = None
         self.operation_lock = threading.Lock()
-        import whimbox.interaction.interaction_normal
-        self.itt_exec = whimbox.interaction.interaction_normal.InteractionNormal()
-        from whimbox.interaction.capture import PrintWindowCapture
-        self.capture_obj = PrintWindowCapture()
+        # 以(frame_id, 识别类型, 资源名/区域, 预处理参数)为键，缓存同一帧上的识别结果
+        self.detect_cache = LRUCache(maxsize=self.DETECT_CACHE_SIZE, name='detect')
+        self.frame_contexts = LRUCache(maxsize=self.FRAME_CONTEXT_CACHE_SIZE, name='frame_context')
+        if sys.platform == 'win32':
+            import whimbox.interaction.interaction_normal
+            self.itt_exec = whimbox.interaction.interaction_normal.InteractionNormal()
+            from whimbox.interaction.capture import PrintWindowCapture
+            self.capture_obj = PrintWindowCapture()
+        else:
+            # 非Windows系统没有游戏窗口，只能识别：用set_capture_obj(ReplayCapture(...))回放录制的截图，键鼠操作不可用
+            logger.info("not on Windows, set a capture backend with set_capture_obj() before use")
+
+
+    def set_capture_obj(self, capture_obj):
+        """替换截图后端，比如用ReplayCapture回放录制的截图
+
+        Args:
+            capture_obj (Capture): 截图对象
+        """
+        logger.info(f"capture backend: {type(capture_obj).__name__}")
+        self.capture_obj = capture_obj
+        # 缓存按frame_id索引，新的截图后端会从1重新编号，旧后端的结果不能再用
+        self.detect_cache.clear()
+        self.frame_contexts.clear()
+
+
+    def capture_frame(self, force=False):
+        """获取最新一帧，供同一轮循环内的多次识别共享
+
+        Returns:
+            Frame: 带有frame_id的只读帧
+        """
+        return self.capture_obj.capture_frame(force)
+
+
+    def frame_context(self, frame=None) -> FrameContext:
+        """获取一帧的预处理缓存，同一帧上的各个识别模块共享亮度、HSV等转换结果
+
+        Args:
+            frame (Frame, optional): 指定帧，不传则使用最新帧
+
+        Returns:
+            FrameContext: 同一frame_id返回同一个对象
+        """
+        if frame is None:
+            frame = self.capture_frame()
+        return self.frame_contexts.get_or_compute(frame.frame_id, lambda: FrameContext(frame))
+
+
+    def wait_frame(self, after_id, timeout=1.0):
+        """等待一帧比after_id更新的帧，配合后台截图线程使用，避免重复处理同一帧
+
+        Args:
+            after_id (int): 上次处理的frame_id
+            timeout (float, optional): 超时时间. Defaults to 1.0.
+
+        Returns:
+            Frame: 新帧
+        """
+        return self.capture_obj.wait_frame(after_id, timeout)
+
+
+    def start_capture_producer(self, fps=None):
+        """开启后台截图线程，截图耗时不再阻塞调用方"""
+        self.capture_obj.start_producer(fps)
 
 
-    def capture(self, posi=None, jpgmode=NORMAL_CHANNELS):
+    def stop_capture_producer(self):
+        self.capture_obj.stop_producer()
+
+
+    def capture(self, posi=None, jpgmode=NORMAL_CHANNELS, frame=None):
         """窗口客户区截图
 
         Args:
@@ -89,14 +147,18 @@ class InteractionBGD:
                 0:return jpg (3 channels, delete the alpha channel)
                 1:return nikki background channel, background color is black
                 2:return nikki ui channel, background color is black
+            frame (Frame, optional): 从指定帧中截取，不传则使用最新帧。
 
         Returns:
-            numpy.ndarray: 图片数组
+            numpy.ndarray: 只读的图片数组（原帧的视图），需要修改时请先copy
         """
 
-        ret = self.capture_obj.capture()
+        if frame is None:
+            frame = self.capture_obj.capture_frame()
         if posi is not None:
-            ret = crop(ret, posi)
+            ret = frame.crop(posi)
+        else:
+            ret = frame.image
         if ret.shape[2]==3:
             pass
         elif jpgmode == NORMAL_CHANNELS:
@@ -106,23 +168,89 @@ class InteractionBGD:
         return ret
 
 
-    def ocr_single_line(self, area: posi_manager.Area, padding=50, hsv_limit=None) -> str:
-        cap = self.capture(posi = area.position)
-        if hsv_limit:
-            cap = process_with_hsv_limit(cap, hsv_limit[0], hsv_limit[1])
-        if padding:
-            cap = add_padding(cap, padding)
-        res = ocr.get_all_texts(cap, mode=1)
-        return res
+    def frame_cached(self, key, func, frame=None):
+        """同一帧上的重复识别直接返回缓存结果
+
+        Args:
+            key (tuple): 识别类型、资源名、区域、预处理参数等，需可哈希
+            func (callable): func(frame)，缓存未命中时调用
+            frame (Frame, optional): 在指定帧上识别，不传则使用最新帧
+
+        Returns:
+            func的返回值
+        """
+        if frame is None:
+            frame = self.capture_frame()
+        return self.detect_cache.get_or_compute((frame.frame_id, *key), lambda: func(frame))
+
+
+    @staticmethod
+    def _area_key(area):
+        return tuple(np.ravel(area).tolist())
+
 
-    def ocr_multiple_lines(self, area: posi_manager.Area, padding=50, hsv_limit=None) -> list:
-        cap = self.capture(posi = area.position)
+    def _ocr_area(self, area, padding, hsv_limit, mode, frame, rec_only=False):
+        cap = self.capture(posi = area.position, frame=frame)
         if hsv_limit:
             cap = process_with_hsv_limit(cap, hsv_limit[0], hsv_limit[1])
+        if rec_only:
+            padding = self.REC_ONLY_PADDING
         if padding:
             cap = add_padding(cap, padding)
-        res = ocr.get_all_texts(cap, mode=0)
-        return res
+        return ocr.get_all_texts(cap, mode=mode, rec_only=rec_only)
+
+    def ocr_single_line(self, area: posi_manager.Area, padding=50, hsv_limit=None, frame=None, rec_only=None) -> str:
+        """识别区域内的文字，拼成一个字符串
+
+        Args:
+            rec_only (bool, optional): 跳过文字检测直接识别，不传时按area的rec_only声明。此时忽略padding。
+        """
+        if rec_only is None:
+            rec_only = getattr(area, 'rec_only', False)
+        key = self._ocr_key(area, padding, hsv_limit, rec_only)
+        return self.frame_cached(key, lambda frame: self._ocr_area(area, padding, hsv_limit, 1, frame, rec_only), frame=frame)
+
+    def _ocr_key(self, area, padding, hsv_limit, rec_only):
+        # 只识别模式忽略padding，不同padding的调用共用一条缓存
+        if rec_only:
+            padding = self.REC_ONLY_PADDING
+        return ('ocr', self._area_key(area.position), padding, str(hsv_limit), 1, rec_only)
+
+    def ocr_batch(self, areas: list, hsv_limit=None, frame=None) -> list:
+        """在同一帧上识别多个单行文字区域，所有区域只调用一次识别模型
+
+        结果按ocr_single_line(area, rec_only=True)的缓存键写入同一帧的缓存，
+        之后在这一帧上对这些区域的ocr_single_line、get_text_existence直接命中。
+
+        Args:
+            areas (list[Area]): 要识别的区域，每个区域内只有一行文字
+            hsv_limit (optional): 同ocr_single_line，对所有区域生效
+            frame (Frame, optional): 在指定帧上识别，不传则使用最新帧
+
+        Returns:
+            list[str]: 和areas一一对应的识别结果
+        """
+        if frame is None:
+            frame = self.capture_frame()
+        keys = [(frame.frame_id, *self._ocr_key(area, None, hsv_limit, True)) for area in areas]
+        results = [self.detect_cache.get(key) for key in keys]
+        misses = [i for i, res in enumerate(results) if res is None]
+        if misses:
+            caps = []
+            for i in misses:
+                cap = self.capture(posi=areas[i].position, frame=frame)
+                if hsv_limit:
+                    cap = process_with_hsv_limit(cap, hsv_limit[0], hsv_limit[1])
+                caps.append(add_padding(cap, self.REC_ONLY_PADDING))
+            for i, text in zip(misses, ocr.get_batch_texts(caps)):
+                results[i] = text
+                self.detect_cache.put(keys[i], text)
+        return results
+
+    def ocr_multiple_lines(self, area: posi_manager.Area, padding=50, hsv_limit=None, frame=None) -> list:
+        key = ('ocr', self._area_key(area.position), padding, str(hsv_limit), 0, False)
+        res = self.frame_cached(key, lambda frame: self._ocr_area(area, padding, hsv_limit, 0, frame), frame=frame)
+        return list(res)
 
     def ocr_and_detect_posi(self, area: posi_manager.Area, padding=50, hsv_limit=None):
         cap = self.capture(posi=area.position)
@@ -155,28 +283,29 @@ class InteractionBGD:
     #         return None
 
 
-    def get_img_existence(self, imgicon: img_manager.ImgIcon, is_gray=False, ret_mode = IMG_BOOL, show_res = False, cap = None):
+    def get_img_existence(self, imgicon: img_manager.ImgIcon, is_gray=False, ret_mode = IMG_BOOL, show_res = False, cap = None, frame = None):
         """检测图片是否存在
 
         Args:
             imgicon (img_manager.ImgIcon): imgicon对象
             is_gray (bool, optional): 是否启用灰度匹配. Defaults to False.
             is_log (bool, optional): 是否打印日志. Defaults to False.
+            frame (Frame, optional): 在指定帧上检测. Defaults to None.
 
         Returns:
             bool: bool
         """
         upper_func_name = inspect.getframeinfo(inspect.currentframe().f_back)[2]
-        if cap is None:
-            cap = self.capture(posi=imgicon.cap_posi)
-
-        matching_rate = similar_img(cap, imgicon.image, is_gray=is_gray)
-        
-        if matching_rate >= imgicon.threshold:
-            if imgicon.win_text != None:
-                re_text = ocr.get_all_texts(cap, mode=1)
-                if imgicon.win_text not in re_text:
-                    matching_rate = 0
+        if cap is None and not show_res:
+            key = ('img', imgicon.name, self._area_key(imgicon.cap_posi), is_gray)
+            matching_rate = self.frame_cached(
+                key,
+                lambda frame: self._match_img(imgicon, self.capture(posi=imgicon.cap_posi, frame=frame), is_gray),
+                frame=frame)
+        else:
+            if cap is None:
+                cap = self.capture(posi=imgicon.cap_posi, frame=frame)
+            matching_rate = self._match_img(imgicon, cap, is_gray)
         
         if show_res:
             cv2.imshow(imgicon.name, cap)
@@ -203,11 +332,26 @@ class InteractionBGD:
             return matching_rate >= imgicon.threshold
 
 
-    def get_text_existence(self, textobj: text_manager.TextTemplate, ret_mode=IMG_BOOL, cap=None):
-        if cap == None:
-            cap = self.capture(posi = textobj.cap_area.position)
-        cap = add_padding(cap, 50)
-        res = ocr.get_all_texts(cap)
+    def _match_img(self, imgicon: img_manager.ImgIcon, cap, is_gray):
+        matching_rate = similar_img(cap, imgicon.image, is_gray=is_gray)
+        if matching_rate >= imgicon.threshold:
+            if imgicon.win_text != None:
+                re_text = ocr.get_all_texts(cap, mode=1)
+                if imgicon.win_text not in re_text:
+                    matching_rate = 0
+        return matching_rate
+
+
+    def get_text_existence(self, textobj: text_manager.TextTemplate, ret_mode=IMG_BOOL, cap=None, frame=None):
+        if cap is None:
+            if textobj.rec_only:
+                res = self.ocr_single_line(textobj.cap_area, frame=frame, rec_only=True)
+            else:
+                res = self.ocr_multiple_lines(textobj.cap_area, padding=50, frame=frame)
+        elif textobj.rec_only:
+            res = ocr.get_all_texts(add_padding(cap, self.REC_ONLY_PADDING), mode=1, rec_only=True)
+        else:
+            res = ocr.get_all_texts(add_padding(cap, 50))
         is_exist = textobj.match_results(res)
         if textobj.is_print_log(is_exist):
             logger.trace(f"get_text_existence: text: {textobj.text} {'Found' if is_exist else 'Not Found'}")
@@ -261,27 +405,57 @@ class InteractionBGD:
             return False
                 
 
-    def wait_until_stable(self, threshold = 0.9995, timeout = 10):
+    def _stable_thumbnail(self, areas, frame):
+        if areas is None:
+            return luma_thumbnail(frame.image)
+        # 多个ROI的缩略图拼成一维，一起计算变化比例
+        return np.concatenate([luma_thumbnail(frame.crop(area)).ravel() for area in areas])
+
+
+    def wait_until_stable(self, threshold = STABLE_THRESHOLD_STATIC, timeout = 10, area = None):
+        """等待画面稳定
+
+        把画面缩成亮度缩略图（每块30x30像素），比较相邻两帧中变化块的比例，
+        连续0.25秒（至少3次）未变化块比例都不低于threshold时认为画面稳定。
+
+        Args:
+            threshold (float): 未变化块的比例阈值，0.9表示允许10%的块在变化。
+                画面里有动画（角色待机、场景）时应传入area只检测需要的区域，而不是一味放宽阈值
+            timeout (int): 超时时间（秒）
+            area (optional): 只检测指定区域，可以是posi、Area或者它们的列表。不传则检测全屏。
+        """
+        if area is None:
+            areas = None
+        else:
+            if isinstance(area, posi_manager.Area) or not isinstance(area[0], (list, tuple, posi_manager.Area)):
+                area = [area]
+            areas = [a.position if isinstance(a, posi_manager.Area) else a for a in area]
+
         timeout_timer = TimeoutTimer(timeout)
-        last_cap = self.capture()
+        frame = self.capture_frame()
+        last_thumb = self._stable_thumbnail(areas, frame)
 
         pt = time.time()
         t = AdvanceTimer(0.25, 3).start()
         while 1:
-            time.sleep(0.1)
+            if self.capture_obj.is_producing():
+                frame = self.wait_frame(frame.frame_id, timeout=0.1)
+            else:
+                time.sleep(0.1)
+                frame = self.capture_frame()
             if timeout_timer.istimeout():
                 logger.warning("TIMEOUT")
                 break
-            curr_img = self.capture()
-            simi = similar_img(last_cap, curr_img)# abs((last_cap.astype(int)-curr_img.astype(int))).sum()
-            if simi > threshold:
+            curr_thumb = self._stable_thumbnail(areas, frame)
+            simi = 1 - dirty_block_ratio(last_thumb, curr_thumb)
+            if simi >= threshold:
                 pass
             else:
                 t.reset()
             if t.reached():
                 if DEBUG_MODE: print('wait time: ', time.time()-pt)
                 break
-            last_cap = curr_img.copy()
+            last_thumb = curr_thumb
 
 
     def delay(self, x, randtime=False, is_log=True, comment=''):
@@ -0,0 +1,272 @@
+"""
+离线回放截图，用于在没有游戏窗口的情况下运行识别代码（调试、回归测试、性能测试）。
+
+支持三种录制格式：
+    - 目录：若干png截图 + frames.json（记录每帧的文件名和时间戳）
+    - npz：np.savez_compressed生成的压缩包，每帧一个数组，另有timestamps数组
+    - 视频：cv2可读取的视频文件，同名的.json文件记录时间戳（可选，缺省按视频fps计算）
+"""
+
+import os
+import json
+import time
+import zipfile
+import threading
+
+import cv2
+import numpy as np
+
+from whimbox.interaction.capture_base import Capture, Frame
+from whimbox.common.logger import logger
+
+INDEX_FILE_NAME = 'frames.json'
+VIDEO_EXTS = ('.mp4', '.avi', '.mkv')
+
+
+def _to_bgra(img: np.ndarray) -> np.ndarray:
+    """统一成截图的BGRA格式"""
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    if img.shape[2] == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    return img
+
+
+class _DirSource:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE_NAME), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.files = [i['file'] for i in index['frames']]
+        self.timestamps = np.array([i['t'] for i in index['frames']], dtype=np.float64)
+
+    def read(self, i):
+        return cv2.imread(os.path.join(self.path, self.files[i]), cv2.IMREAD_UNCHANGED)
+
+
+class _NpzSource:
+    def __init__(self, path):
+        # npz中的数组在访问时才会解压，不会一次性读进内存
+        self.npz = np.load(path)
+        self.timestamps = self.npz['timestamps'].astype(np.float64)
+
+    def read(self, i):
+        return self.npz[f'frame_{i:06d}']
+
+
+class _VideoSource:
+    def __init__(self, path):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise FileNotFoundError(path)
+        self.pos = 0
+        index_path = os.path.splitext(path)[0] + '.json'
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.timestamps = np.array(json.load(f)['timestamps'], dtype=np.float64)
+        else:
+            count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+            self.timestamps = np.arange(count, dtype=np.float64) / fps
+
+    def read(self, i):
+        # 视频只能顺序读取，往回读时需要重新打开
+        if i < self.pos:
+            self.cap.release()
+            self.cap = cv2.VideoCapture(self.path)
+            self.pos = 0
+        while self.pos < i:
+            self.cap.grab()
+            self.pos += 1
+        ok, img = self.cap.read()
+        self.pos += 1
+        return img if ok else None
+
+
+def open_source(path):
+    if os.path.isdir(path):
+        return _DirSource(path)
+    if path.endswith('.npz'):
+        return _NpzSource(path)
+    if path.endswith(VIDEO_EXTS):
+        return _VideoSource(path)
+    raise ValueError(f"不支持的回放文件: {path}")
+
+
+class ReplayCapture(Capture):
+    """
+    从录制文件中读取截图。
+
+    Args:
+        path (str): 录制目录、npz文件或视频文件。
+        speed (float): 回放倍速。1为原速；为0时不看时间戳，每次截图都前进一帧，适合性能测试。
+        loop (bool): 播放完后是否从头开始。否则停在最后一帧，并设置finished。
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        super().__init__()
+        self.path = path
+        self.source = open_source(path)
+        self.timestamps = self.source.timestamps - self.source.timestamps[0]
+        self.frame_count = len(self.timestamps)
+        self.speed = speed
+        self.loop = loop
+        self.finished = False
+        self.max_fps = float('inf')
+        self.start_time = None
+        self.index = -1
+        logger.info(f"ReplayCapture loaded {self.frame_count} frames from {path}")
+
+    def restart(self):
+        self.start_time = None
+        self.index = -1
+        self.finished = False
+
+    def _next_index(self):
+        if self.speed:
+            if self.start_time is None:
+                self.start_time = time.time()
+            replay_time = (time.time() - self.start_time) * self.speed
+            if self.loop:
+                replay_time %= self.timestamps[-1] + 1e-6
+            elif replay_time >= self.timestamps[-1]:
+                self.finished = True
+            index = int(np.searchsorted(self.timestamps, replay_time, side='right')) - 1
+        else:
+            index = self.index + 1
+            if self.loop:
+                index %= self.frame_count
+            elif index >= self.frame_count:
+                index = self.frame_count - 1
+                self.finished = True
+        return max(index, 0)
+
+    def _check_shape(self, img: np.ndarray):
+        if img is None:
+            return False
+        return img.shape[2] == 4 and img.shape[1] / img.shape[0] == 1920 / 1080
+
+    def _get_capture(self):
+        return _to_bgra(self.source.read(self.index))
+
+    def _capture(self, force, producer=None) -> None:
+        index = self._next_index()
+        # 同一张录制图只发布一次，避免同一画面产生多个frame_id
+        if index == self.index and self.frame_buffer:
+            return
+        with self.grab_lock:
+            self.index = index
+            self.capture_times += 1
+            normalized_img = self._normalize_shape(self._get_capture())
+            if normalized_img is None:
+                raise ValueError(f"回放帧{index}分辨率异常")
+            with self.capture_cache_lock:
+                self._publish_frame(normalized_img)
+
+
+class FrameRecorder:
+    """
+    把截图录制为ReplayCapture可以读取的格式，格式由path决定：
+    以.npz结尾为npz，以视频后缀结尾为视频，其他为目录。
+    """
+
+    def __init__(self, path, fps=30):
+        self.path = path
+        self.fps = fps
+        self.timestamps = []
+        self.files = []
+        self.writer = None
+        if path.endswith('.npz'):
+            self.mode = 'npz'
+            # 每帧写入后就压缩进文件，不在内存中攒着，结束时再改成正式文件名
+            self.tmp_path = path + '.tmp'
+            self.writer = zipfile.ZipFile(self.tmp_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        elif path.endswith(VIDEO_EXTS):
+            self.mode = 'video'
+        else:
+            self.mode = 'dir'
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, frame: Frame):
+        i = len(self.timestamps)
+        if self.mode == 'dir':
+            file_name = f'{i:06d}.png'
+            cv2.imwrite(os.path.join(self.path, file_name), frame.raw)
+            self.files.append(file_name)
+        elif self.mode == 'npz':
+            self._write_npz_array(f'frame_{i:06d}', frame.raw)
+        else:
+            img = cv2.cvtColor(frame.raw, cv2.COLOR_BGRA2BGR)
+            if self.writer is None:
+                h, w = img.shape[:2]
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (w, h))
+            self.writer.write(img)
+        self.timestamps.append(frame.timestamp)
+
+    def _write_npz_array(self, name, array):
+        # 与np.savez_compressed的格式相同，每个数组是zip中的一个.npy文件
+        with self.writer.open(f'{name}.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+    def close(self):
+        if self.mode == 'dir':
+            index = {'frames': [{'file': f, 't': t} for f, t in zip(self.files, self.timestamps)]}
+            with open(os.path.join(self.path, INDEX_FILE_NAME), 'w', encoding='utf-8') as f:
+                json.dump(index, f, indent=2)
+        elif self.mode == 'npz':
+            self._write_npz_array('timestamps', np.array(self.timestamps))
+            self.writer.close()
+            os.replace(self.tmp_path, self.path)
+        else:
+            if self.writer is not None:
+                self.writer.release()
+            with open(os.path.splitext(self.path)[0] + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'timestamps': self.timestamps}, f)
+        logger.info(f"recorded {len(self.timestamps)} frames to {self.path}")
+
+
+def record(capture_obj: Capture, path, duration, fps=10, stop_event: threading.Event = None):
+    """
+    按指定帧率从capture_obj录制duration秒。
+
+    Args:
+        capture_obj (Capture): 截图对象
+        path (str): 输出路径
+        duration (float): 录制时长（秒）
+        fps (int): 录制帧率
+        stop_event (threading.Event, optional): 提前结束录制的信号
+    """
+    recorder = FrameRecorder(path, fps=fps)
+    last_frame_id = None
+    end_time = time.time() + duration
+    try:
+        while time.time() < end_time:
+            if stop_event is not None and stop_event.is_set():
+                break
+            pt = time.time()
+            frame = capture_obj.capture_frame(force=True)
+            if frame.frame_id != last_frame_id:
+                recorder.write(frame)
+                last_frame_id = frame.frame_id
+            time.sleep(max(0, 1 / fps - (time.time() - pt)))
+    finally:
+        recorder.close()
+    return path
+
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == 'record':
+        # python -m whimbox.interaction.replay_capture record <path> [duration] [fps]
+        from whimbox.interaction.interaction_core import itt
+        duration = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+        fps = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        record(itt.capture_obj, sys.argv[2], duration, fps)
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'play':
+        # python -m whimbox.interaction.replay_capture play <path> [speed]
+        speed = float(sys.argv[3]) if len(sys.argv) > 3 else 1
+        c = ReplayCapture(sys.argv[2], speed=speed)
+        while not c.finished:
+            cv2.imshow("replay test", c.capture())
+            cv2.waitKey(10)
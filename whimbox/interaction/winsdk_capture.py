@@ -1,6 +1,6 @@
 """一种更高效的d3d截图方式，不过需要手动维护缓冲池，暂时不使用"""
 
-from whimbox.interaction.capture import Capture
+from whimbox.interaction.capture_base import Capture
 from whimbox.common.handle_lib import HANDLE_OBJ
 import asyncio
 from winsdk.windows.ai.machinelearning import LearningModelDevice, LearningModelDeviceKind
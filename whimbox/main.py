@@ -42,7 +42,10 @@ def run_app():
     asyncio.run(mcp_agent.start())
 
     from whimbox.common.handle_lib import HANDLE_OBJ
+    from whimbox.common.warmup import start_warmup
     import time
+    # 等待游戏启动的同时，在后台预热OCR和各种资源
+    start_warmup()
     logger.info("WAIT_FOR_GAME_START")
     while not HANDLE_OBJ.get_handle():
         time.sleep(5)
@@ -3,6 +3,7 @@ from pydantic import BaseModel
 import typing
 import os
 from whimbox.common.path_lib import ASSETS_PATH
+from whimbox.map.map_pack import map_packs
 
 DICT_TELEPORTER ={}
 
@@ -14,6 +15,16 @@ class TeleporterModel(BaseModel):
     name: str
     position: typing.Tuple[float, float]
 
+def _to_teleporter(checkpoint):
+    return TeleporterModel(
+        region=checkpoint['region'],
+        province=checkpoint['province'],
+        map=checkpoint['map'],
+        type=checkpoint['type'],
+        name=checkpoint['name'],
+        position=(checkpoint['position'][0], checkpoint['position'][1])
+    )
+
 checkpoint_filepath = os.path.join(ASSETS_PATH, 'checkpoints.json')
 with open(checkpoint_filepath, 'r', encoding='utf-8') as f:
     checkpoints_dict = json.load(f)
@@ -21,12 +32,10 @@ with open(checkpoint_filepath, 'r', encoding='utf-8') as f:
         DICT_TELEPORTER[map_name] = []
         checkpoints = checkpoints_dict[map_name]
         for checkpoint in checkpoints:
-            t = TeleporterModel(
-                region=checkpoint['region'],
-                province=checkpoint['province'],
-                map=checkpoint['map'],
-                type=checkpoint['type'],
-                name=checkpoint['name'],
-                position=(checkpoint['position'][0], checkpoint['position'][1])
-            )
-            DICT_TELEPORTER[map_name].append(t)
+            DICT_TELEPORTER[map_name].append(_to_teleporter(checkpoint))
+
+# 地图包自带的传送点
+for map_name in map_packs:
+    checkpoints = map_packs.get(map_name).load_teleporters()
+    if checkpoints:
+        DICT_TELEPORTER[map_name] = [_to_teleporter(checkpoint) for checkpoint in checkpoints]
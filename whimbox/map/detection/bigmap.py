@@ -8,6 +8,25 @@ from whimbox.map.detection.utils import *
 import typing as t
 
 
+_REGION_BOUNDS = {}
+
+
+def get_region_bounds(map_name, region_name):
+    """
+    区域内所有传送点的外接矩形(x1, y1, x2, y2)，单位与bigmap_position相同，未知区域返回None
+    """
+    key = (map_name, region_name)
+    if key not in _REGION_BOUNDS:
+        from whimbox.map.data.nikki_teleporter import DICT_TELEPORTER
+        posi = [tp.position for tp in DICT_TELEPORTER.get(map_name, []) if tp.region == region_name]
+        if posi:
+            posi = np.array(posi)
+            _REGION_BOUNDS[key] = (*posi.min(axis=0), *posi.max(axis=0))
+        else:
+            _REGION_BOUNDS[key] = None
+    return _REGION_BOUNDS[key]
+
+
 class BigMap:
 
     def __init__(self):
@@ -17,34 +36,146 @@ class BigMap:
         self.bigmap_similarity_local = 0.
         # Current position on png
         self.bigmap_position: t.Tuple[float, float] = (0, 0)
+        # 匹配峰值的亚像素定位方法
+        self.subpixel_method = SUBPIXEL_METHOD
 
 
-    def _predict_bigmap(self, image):
+    def _match_bigmap(self, image, area=None):
         """
+        在luma_0125x上匹配缩小后的截图
+
         Args:
-            image:
+            image: 缩小后的截图亮度
+            area: 匹配结果（截图左上角）的搜索范围(x1, y1, x2, y2)，None为全图
 
-        Returns: (new)png position
+        Returns:
+            sim, local_sim, 峰值位置, 亚像素偏移
         """
-        scale = BIGMAP_POSITION_SCALE_DICT[self.map_name] * BIGMAP_SEARCH_SCALE
-        image = rgb2luma(image)
-        center = np.array(image_size(image)) / 2 * scale
-        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
-
-        result = cv2.matchTemplate(MAP_ASSETS_DICT[self.map_name]["luma_0125x"].img, image, cv2.TM_CCOEFF_NORMED)
+        map_img = MAP_ASSETS_DICT[self.map_name]["luma_0125x"].img
+        mask = MAP_ASSETS_DICT[self.map_name]["mask_0125x"].img
+        h, w = image.shape[:2]
+        if area is None:
+            area = (0, 0, map_img.shape[1] - w + 1, map_img.shape[0] - h + 1)
+        x1, y1, x2, y2 = area
+        result = cv2.matchTemplate(map_img[y1:y2 + h - 1, x1:x2 + w - 1], image, cv2.TM_CCOEFF_NORMED)
         _, sim, _, loca = cv2.minMaxLoc(result)
 
         # Gaussian filter to get local maximum
         local_maximum = cv2.subtract(result, cv2.GaussianBlur(result, (9, 9), 0))
-        mask = image_center_crop(MAP_ASSETS_DICT[self.map_name]["mask_0125x"].img, size=image_size(local_maximum))
-        local_maximum = cv2.copyTo(local_maximum, mask)
+        # 同image_center_crop(mask, size=image_size(全图result))，再取area对应的部分
+        left, top = (w - 1) // 2, (h - 1) // 2
+        local_maximum = cv2.copyTo(local_maximum, mask[y1 + top:y2 + top, x1 + left:x2 + left])
         _, local_sim, _, loca = cv2.minMaxLoc(local_maximum)
 
-        # Calculate the precise location using CUBIC
+        # Calculate the precise location
         precise = crop(result, area=area_offset((-4, -4, 4, 4), offset=loca))
-        precise_sim, precise_loca = cubic_find_maximum(precise, precision=0.05)
+        precise_sim, precise_loca = subpixel_find_maximum(precise, precision=0.05, method=self.subpixel_method)
         precise_loca -= 5
 
+        return sim, local_sim, np.array(loca) + (x1, y1), precise_loca
+
+    def _coarse_candidates(self, image, area=None):
+        """
+        在1/32的地图上粗匹配，返回相似度最高的几个候选位置（luma_0125x坐标）
+
+        Args:
+            image: 缩小后的截图亮度
+            area: 同_match_bigmap，为luma_0125x坐标
+        """
+        coarse_map, coarse_mask = get_bigmap_coarse(self.map_name)
+        template = cv2.resize(image, None, fx=BIGMAP_COARSE_SCALE, fy=BIGMAP_COARSE_SCALE, interpolation=cv2.INTER_AREA)
+        h, w = template.shape[:2]
+        x1, y1 = 0, 0
+        x2, y2 = coarse_map.shape[1] - w + 1, coarse_map.shape[0] - h + 1
+        if area is not None:
+            x1, y1 = max(x1, int(area[0] * BIGMAP_COARSE_SCALE)), max(y1, int(area[1] * BIGMAP_COARSE_SCALE))
+            x2, y2 = min(x2, int(area[2] * BIGMAP_COARSE_SCALE) + 1), min(y2, int(area[3] * BIGMAP_COARSE_SCALE) + 1)
+            if x2 <= x1 or y2 <= y1:
+                return []
+        result = cv2.matchTemplate(coarse_map[y1:y2 + h - 1, x1:x2 + w - 1], template, cv2.TM_CCOEFF_NORMED)
+        left, top = (w - 1) // 2, (h - 1) // 2
+        result[coarse_mask[y1 + top:y2 + top, x1 + left:x2 + left] == 0] = -1
+
+        candidates = []
+        for _ in range(BIGMAP_COARSE_CANDIDATES):
+            _, sim, _, loca = cv2.minMaxLoc(result)
+            if sim <= -1:
+                break
+            candidates.append((np.array(loca) + (x1, y1)) / BIGMAP_COARSE_SCALE)
+            cv2.circle(result, loca, BIGMAP_COARSE_NMS_RADIUS, -1, -1)
+        return candidates
+
+    def _region_search_area(self, image, region_name):
+        """区域内传送点的范围，换算为_match_bigmap的搜索范围"""
+        bounds = get_region_bounds(self.map_name, region_name)
+        if bounds is None:
+            return None
+        center = np.array(image_size(image)) / 2
+        x1, y1, x2, y2 = np.array(bounds) * BIGMAP_SEARCH_SCALE
+        margin = BIGMAP_REGION_MARGIN * BIGMAP_SEARCH_SCALE
+        return (x1 - margin - center[0], y1 - margin - center[1], x2 + margin - center[0], y2 + margin - center[1])
+
+    def _pyramid_match_bigmap(self, image, region_name=None):
+        """
+        先粗匹配出候选，再在候选附近的小窗口内精确匹配。
+        已知区域名时只在区域附近粗匹配，区域内找不到再搜全图。
+
+        Returns:
+            同_match_bigmap，候选都不可信时返回None
+        """
+        map_img = MAP_ASSETS_DICT[self.map_name]["luma_0125x"].img
+        h, w = image.shape[:2]
+        max_x, max_y = map_img.shape[1] - w + 1, map_img.shape[0] - h + 1
+
+        areas = [None]
+        if region_name:
+            region_area = self._region_search_area(image, region_name)
+            if region_area is not None:
+                areas.insert(0, region_area)
+
+        for area in areas:
+            matches = []
+            for candidate in self._coarse_candidates(image, area):
+                x, y = np.round(candidate).astype(int)
+                window = (
+                    max(x - BIGMAP_REFINE_MARGIN, 0), max(y - BIGMAP_REFINE_MARGIN, 0),
+                    min(x + BIGMAP_REFINE_MARGIN + 1, max_x), min(y + BIGMAP_REFINE_MARGIN + 1, max_y))
+                if window[2] <= window[0] or window[3] <= window[1]:
+                    continue
+                matches.append(self._match_bigmap(image, window))
+            if not matches:
+                continue
+            matches.sort(key=lambda m: m[0], reverse=True)
+            best = matches[0]
+            if best[0] < BIGMAP_REFINE_MIN_SIMILARITY:
+                continue
+            # 相邻候选的精匹配窗口可能收敛到同一个峰，只和其他位置的峰比较
+            others = [m[0] for m in matches[1:] if euclidean_distance(m[2], best[2]) > BIGMAP_REFINE_MARGIN]
+            if others and best[0] - others[0] < BIGMAP_REFINE_MIN_MARGIN:
+                logger.trace(f'BigMap pyramid search ambiguous: {round(best[0], 3)} vs {round(others[0], 3)}')
+                continue
+            return best
+        return None
+
+    def _predict_bigmap(self, image, region_name=None):
+        """
+        Args:
+            image:
+            region_name: 大地图上OCR到的区域名，用于缩小搜索范围
+
+        Returns: (new)png position
+        """
+        scale = BIGMAP_POSITION_SCALE_DICT[self.map_name] * BIGMAP_SEARCH_SCALE
+        image = rgb2luma(image)
+        center = np.array(image_size(image)) / 2 * scale
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+
+        match = self._pyramid_match_bigmap(image, region_name)
+        if match is None:
+            logger.trace('BigMap pyramid search failed, fallback to full search')
+            match = self._match_bigmap(image)
+        sim, local_sim, loca, precise_loca = match
+
         global_loca = (loca + precise_loca + center) / BIGMAP_SEARCH_SCALE
         self.bigmap_similarity = sim
         self.bigmap_similarity_local = local_sim
@@ -62,16 +193,20 @@ class BigMap:
 
         return sim, global_loca
 
-    def update_bigmap(self, image):
+    def update_bigmap(self, image, region_name=None):
         """
         Get position on bigmap (where you enter from the M button)
 
+        Args:
+            image:
+            region_name: 已知的区域名，用于缩小搜索范围
+
         The following attributes will be set:
         - bigmap_similarity
         - bigmap_similarity_local
         - bigmap
         """
-        self._predict_bigmap(image)
+        self._predict_bigmap(image, region_name)
 
         logger.trace(
             f'BigMap '
@@ -1,3 +1,5 @@
+from whimbox.map.map_pack import map_packs
+
 PROVINCE_NAMES = [
     "心愿原野",
     "星海",
@@ -8,16 +10,11 @@ MAP_NAME_MIRALAND = "miraland"
 MAP_NAME_STARSEA = "starsea"
 MAP_NAME_HOME = "home"
 
-REGION_NAME_TO_MAP_NAME_DICT = {
-    MAP_NAME_STARSEA: ["星海"],
-    MAP_NAME_MIRALAND: ["纪念山地", "花愿镇", "微风绿野", "小石树田村", "石树田无人区", "祈愿树林"]
-}
+# 各地图的区域名、缩放、坐标偏移写在地图包的manifest中（assets/map_packs），这里按地图名汇总
+REGION_NAME_TO_MAP_NAME_DICT = map_packs.collect('regions')
 
 GAMELOC_TO_PNGMAP_SCALE = 0.02222
-GAMELOC_TO_PNGMAP_OFFSET_DICT = {
-    MAP_NAME_MIRALAND: (6718, 5587),
-    MAP_NAME_STARSEA: (2447, 1046),
-}
+GAMELOC_TO_PNGMAP_OFFSET_DICT = map_packs.collect('gameloc_to_pngmap_offset')
 
 # 预计最大移动速度
 MOVE_SPEED = 22
@@ -25,11 +22,16 @@ MOVE_SPEED = 22
 # Magic numbers for 1920x1080 desktop
 MINIMAP_CENTER = (79 + 102, 20 + 102)
 MINIMAP_RADIUS = 102
+# 包含小地图的左上角截图区域，原点与全屏截图相同，小地图坐标无需换算
+MINIMAP_CAPTURE_AREA = (0, 0, MINIMAP_CENTER[0] + MINIMAP_RADIUS, MINIMAP_CENTER[1] + MINIMAP_RADIUS)
 MINIMAP_POSITION_RADIUS = 100
-MINIMAP_POSITION_SCALE_DICT = {
-    MAP_NAME_MIRALAND: 0.975,
-    MAP_NAME_STARSEA: 0.8,
-}
+MINIMAP_POSITION_SCALE_DICT = map_packs.collect('minimap_position_scale')
+
+# 小地图遮罩、旋转映射表等预计算数据的版本，生成方法变化时加一，旧的缓存文件会重建
+MAP_ARTIFACT_VERSION = 1
+
+# 大地图按瓦片存储时的瓦片大小，小地图定位每次只读取搜索框涉及的几块
+MAP_TILE_SIZE = 256
 
 # Downscale png map and minimap for faster run
 POSITION_SEARCH_SCALE = 0.5
@@ -38,18 +40,79 @@ POSITION_SEARCH_RADIUS = 1.3
 # Can't figure out why but the result_of_0.5_lookup_scale + 0.5 ~= result_of_1.0_lookup_scale
 POSITION_MOVE = (0.5, 0.5)
 
+# 小地图定位的运动模型（alpha-beta滤波），单位与position相同
+# 搜索框以预测位置为中心，向外扩展的距离由预测误差决定，限制在MIN~MAX之间
+POSITION_SEARCH_MARGIN_MIN = 8
+POSITION_SEARCH_MARGIN_MAX = 60
+# 预测误差的倍数，越大越不容易丢失目标
+POSITION_SEARCH_MARGIN_SIGMA = 3
+# 预计最大加速度，用于估计两次定位之间速度变化带来的误差
+MOVE_ACCELERATION = 100
+# 两次定位间隔超过该值时，速度不再可信，回退到固定搜索框
+MOTION_MODEL_MAX_DT = 2
+MOTION_MODEL_ALPHA = 0.5
+MOTION_MODEL_BETA = 0.3
+
+# 匹配峰值亚像素定位方法
+SUBPIXEL_CUBIC = 'cubic' # 邻域放大1/precision倍后取最大值，最慢
+SUBPIXEL_QUADRATIC = 'quadratic' # 3x3邻域拟合二次曲面
+SUBPIXEL_GAUSSIAN = 'gaussian' # 对数域拟合二次曲面（高斯峰），峰值必须为正，否则退回quadratic
+SUBPIXEL_METHOD = SUBPIXEL_QUADRATIC
+
 DIRECTION_SIMILARITY_COLOR = (155, 255, 255)
 # Radius to search direction arrow, about 15px
 DIRECTION_RADIUS = 13
-# Downscale direction arrows for faster run
-DIRECTION_SEARCH_SCALE = 0.5
 # Scale to png
 DIRECTION_ROTATION_SCALE = 1.0
+# 人物朝向：箭头二值化的阈值（color_similarity_2d之后）
+DIRECTION_BINARY_THRESHOLD = 128
+# 箭头特征的边长，比DIRECTION_RADIUS大一圈，重心对齐后箭头不会超出
+DIRECTION_EMBEDDING_SIZE = DIRECTION_RADIUS * 2 + 4
+# 箭头特征表的角度间隔
+DIRECTION_EMBEDDING_STEP = 0.5
 
 # Downscale png map to run faster
 BIGMAP_SEARCH_SCALE = 0.125
 # Magic number that resize a 1920*1080 screenshot to luma_05x_png
-BIGMAP_POSITION_SCALE_DICT = {
-    MAP_NAME_MIRALAND: 0.637,
-    MAP_NAME_STARSEA: 0.62,
-}
+BIGMAP_POSITION_SCALE_DICT = map_packs.collect('bigmap_position_scale')
+
+# 大地图金字塔搜索：先在缩小的地图上粗匹配出候选位置，再在luma_0125x的小窗口内精确匹配
+# 粗匹配地图相对luma_0125x的缩放，即原图的1/32
+BIGMAP_COARSE_SCALE = 0.25
+# 粗匹配保留的候选数量
+BIGMAP_COARSE_CANDIDATES = 3
+# 候选之间的最小距离，单位为粗匹配地图的像素
+BIGMAP_COARSE_NMS_RADIUS = 6
+# 精匹配窗口向外扩展的距离，单位为luma_0125x的像素，要能覆盖粗匹配的取整误差
+BIGMAP_REFINE_MARGIN = 12
+# 精匹配相似度低于该值时，认为候选都不对，回退到全图匹配。和全图匹配正常的相似度（0.4~0.5）一致
+BIGMAP_REFINE_MIN_SIMILARITY = 0.4
+# 最佳候选的相似度至少要比其他位置的候选高这么多，否则认为有歧义，回退到全图匹配
+BIGMAP_REFINE_MIN_MARGIN = 0.02
+# 已知区域名时，以区域内传送点的范围向外扩展该距离作为搜索范围，单位与bigmap_position相同
+BIGMAP_REGION_MARGIN = 1000
+
+# 小地图全局重定位：在luma_05x上按网格分块提取ORB特征建立索引，跟丢时只凭小地图找回位置
+FEATURE_INDEX_TILE_SIZE = 256
+# 每块最多提取的特征数
+FEATURE_INDEX_TILE_FEATURES = 2000
+# 小地图上最多提取的特征数
+FEATURE_QUERY_FEATURES = 300
+FEATURE_ORB_LEVELS = 3
+# 小地图缩放后只有200px左右，特征块要比默认的31小
+FEATURE_PATCH_SIZE = 15
+FEATURE_FAST_THRESHOLD = 5
+# 汉明距离超过该值的匹配直接丢弃
+FEATURE_MATCH_MAX_DISTANCE = 64
+# 平移投票的格子大小，luma_05x的像素
+FEATURE_VOTE_BIN = 4
+# 支持同一位置的匹配数少于该值时，认为重定位失败
+FEATURE_RELOCATE_MIN_VOTES = 8
+# 有先验位置时，先在附近这个范围内查找，单位与position相同
+FEATURE_RELOCATE_SEARCH_RADIUS = 600
+# 重定位结果与模板匹配精修结果的最大偏差，单位与position相同
+FEATURE_RELOCATE_MAX_ERROR = 10
+# 当前地图找不到、改在其他地图上找回位置时，最佳地图的票数至少是第二名的多少倍，否则不换地图
+FEATURE_RELOCATE_MAP_MARGIN = 1.5
+# 连续多少次定位结果被丢弃后，认为跟丢了
+POSITION_LOST_TIMES = 3
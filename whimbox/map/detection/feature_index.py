@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+from whimbox.map.detection.cvars import *
+
+
+def create_orb(nfeatures):
+    return cv2.ORB_create(
+        nfeatures=nfeatures, scaleFactor=1.2, nlevels=FEATURE_ORB_LEVELS,
+        edgeThreshold=FEATURE_PATCH_SIZE, patchSize=FEATURE_PATCH_SIZE, fastThreshold=FEATURE_FAST_THRESHOLD)
+
+
+def feature_index_params():
+    """生成参数，写在缓存文件名和地图包中，参数变了旧的索引就不再使用"""
+    return (f'orb_{FEATURE_INDEX_TILE_SIZE}_{FEATURE_INDEX_TILE_FEATURES}_'
+            f'{FEATURE_ORB_LEVELS}_{FEATURE_PATCH_SIZE}_{FEATURE_FAST_THRESHOLD}')
+
+
+def build_feature_index(image):
+    """
+    在地图上按网格分块提取ORB特征，每块单独提取，避免特征全部集中在纹理最多的地方
+
+    Args:
+        image: luma_05x地图
+
+    Returns:
+        points: (N, 2) float32，特征点在地图上的坐标
+        descriptors: (N, 32) uint8
+    """
+    orb = create_orb(FEATURE_INDEX_TILE_FEATURES)
+    size, pad = FEATURE_INDEX_TILE_SIZE, FEATURE_PATCH_SIZE
+    h, w = image.shape[:2]
+    points, descriptors = [], []
+    for y in range(0, h, size):
+        for x in range(0, w, size):
+            # 每块向外扩展一圈，块边缘的特征也能算出完整的描述子
+            x1, y1 = max(x - pad, 0), max(y - pad, 0)
+            keypoints, des = orb.detectAndCompute(image[y1:y + size + pad, x1:x + size + pad], None)
+            if des is None:
+                continue
+            pts = np.array([kp.pt for kp in keypoints], dtype=np.float32) + (x1, y1)
+            # 扩展区域里的特征属于相邻的块
+            keep = (pts[:, 0] >= x) & (pts[:, 0] < x + size) & (pts[:, 1] >= y) & (pts[:, 1] < y + size)
+            points.append(pts[keep])
+            descriptors.append(des[keep])
+    points = np.concatenate(points) if points else np.zeros((0, 2), dtype=np.float32)
+    descriptors = np.concatenate(descriptors) if descriptors else np.zeros((0, 32), dtype=np.uint8)
+    return points, descriptors
+
+
+class FeatureIndex:
+    """
+    地图的特征索引，用于跟丢后只凭小地图找回绝对位置。
+    特征点按所在的块排序，有先验范围时只和范围内的块匹配。
+    坐标都是luma_05x地图上的像素。
+    """
+
+    def __init__(self, points, descriptors, tile_size=FEATURE_INDEX_TILE_SIZE):
+        self.tile_size = tile_size
+        tiles = (points // tile_size).astype(np.int64)
+        self.cols = int(tiles[:, 0].max()) + 1 if len(points) else 1
+        tile_id = tiles[:, 1] * self.cols + tiles[:, 0]
+        order = np.argsort(tile_id, kind='stable')
+        self.points = points[order]
+        self.descriptors = descriptors[order]
+        # 排好序的块编号，用searchsorted找每块的起止位置
+        self.tile_id = tile_id[order]
+        self.orb = create_orb(FEATURE_QUERY_FEATURES)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _select(self, area):
+        """area (x1, y1, x2, y2) 范围内的块的特征下标"""
+        x1, y1, x2, y2 = (np.array(area) // self.tile_size).astype(np.int64)
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2 = min(x2, self.cols - 1)
+        if x2 < x1 or y2 < y1:
+            return np.zeros(0, dtype=np.int64)
+        tiles = (np.arange(y1, y2 + 1)[:, None] * self.cols + np.arange(x1, x2 + 1)).ravel()
+        starts = np.searchsorted(self.tile_id, tiles, side='left')
+        ends = np.searchsorted(self.tile_id, tiles, side='right')
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+    def query(self, image, mask=None, area=None):
+        """
+        Args:
+            image: 缩放到地图比例的小地图亮度
+            mask: 小地图的有效区域
+            area: 只在地图的这个范围内查找，None为全图
+
+        Returns:
+            tuple[float, float]: 小地图中心在地图上的位置，找不到时为None
+            int: 支持该位置的匹配数
+        """
+        keypoints, des = self.orb.detectAndCompute(image, mask)
+        if des is None or len(keypoints) < FEATURE_RELOCATE_MIN_VOTES:
+            return None, 0
+        if area is None:
+            points, descriptors = self.points, self.descriptors
+        else:
+            index = self._select(area)
+            points, descriptors = self.points[index], self.descriptors[index]
+        if len(points) < 2:
+            return None, 0
+
+        matches = [m for pair in self.matcher.knnMatch(des, descriptors, k=2)
+                   for m in pair if m.distance <= FEATURE_MATCH_MAX_DISTANCE]
+        if len(matches) < FEATURE_RELOCATE_MIN_VOTES:
+            return None, 0
+        query_idx = np.array([m.queryIdx for m in matches])
+        train_idx = np.array([m.trainIdx for m in matches])
+        query_pts = np.array([kp.pt for kp in keypoints], dtype=np.float32)[query_idx]
+        # 小地图是正北朝上、比例已知的，每对匹配给出一个平移量，投票找最多的那个
+        centers = points[train_idx] - query_pts + np.array(image.shape[1::-1]) / 2
+        bins = np.round(centers / FEATURE_VOTE_BIN).astype(np.int64)
+        uniq, counts = np.unique(bins, axis=0, return_counts=True)
+        best = uniq[counts.argmax()]
+        inliers = np.all(np.abs(bins - best) <= 1, axis=1)
+        # 同一个小地图特征最多投一票
+        votes = len(np.unique(query_idx[inliers]))
+        if votes < FEATURE_RELOCATE_MIN_VOTES:
+            return None, votes
+        return tuple(np.median(centers[inliers], axis=0)), votes
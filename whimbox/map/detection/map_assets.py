@@ -1,8 +1,15 @@
+from collections.abc import Mapping
+
 import numpy as np
+import cv2
 
+from whimbox.common.cache import ArtifactCache
 from whimbox.map.detection.cvars import *
 from whimbox.map.detection.utils import create_circle_mask
-from whimbox.map.detection.utils import MapAsset
+from whimbox.map.detection.utils import MapAsset, rotate_bound, get_arrow_feature
+from whimbox.common.utils.img_utils import color_similarity_2d
+from whimbox.map.detection.feature_index import FeatureIndex, build_feature_index, feature_index_params
+from whimbox.map.map_pack import map_packs
 
 
 def create_minimap_mask():
@@ -19,48 +26,122 @@ def create_minimap_mask():
 
 def create_rotation_remap_table():
     d = MINIMAP_RADIUS * 2
-    mx = np.zeros((d, d), dtype=np.float32)
-    my = np.zeros((d, d), dtype=np.float32)
-    for i in range(d):
-        for j in range(d):
-            mx[i, j] = d / 2 + i / 2 * np.cos(2 * np.pi * j / d)
-            my[i, j] = d / 2 + i / 2 * np.sin(2 * np.pi * j / d)
+    i, j = np.meshgrid(np.arange(d), np.arange(d), indexing='ij')
+    mx = (d / 2 + i / 2 * np.cos(2 * np.pi * j / d)).astype(np.float32)
+    my = (d / 2 + i / 2 * np.sin(2 * np.pi * j / d)).astype(np.float32)
     return mx, my
 
 
+map_artifacts = ArtifactCache('map', MAP_ARTIFACT_VERSION)
+
 # 小地图遮罩，用于位置匹配
-MiniMapMask = create_minimap_mask()
+MiniMapMask = map_artifacts.get_or_build(
+    f'minimap_mask_{MINIMAP_POSITION_RADIUS}_{DIRECTION_RADIUS}', create_minimap_mask)
 # 用于识别小地图的镜头朝向
-RotationRemapTable = create_rotation_remap_table()
-
-# 箭头旋转表
-ArrowRotateMap = MapAsset("ArrowRotateMap")
-ArrowRotateMapAll = MapAsset("ArrowRotateMapAll")
-
-
-# 奇迹大陆地图，用于小地图位置匹配
-MiraLandMap = MapAsset("w01_v8_luma_05x")
-# 奇迹大陆地图，用于大地图匹配
-MiraLandBigMap = MapAsset("w01_v8_luma_0125x")
-# 奇迹大陆地图，可匹配位置遮罩
-MiraLandBigMapMask = MapAsset("w01_v8_mask_0125x")
-
-# 星海地图，用于小地图位置匹配
-StarSeaMap = MapAsset("w14000000_v2_luma_05x")
-# 星海地图，用于大地图匹配
-StarSeaBigMap = MapAsset("w14000000_v2_luma_0125x")
-# 星海地图，可匹配位置遮罩
-StarSeaBigMapMask = MapAsset("w14000000_v2_mask_0125x")
-
-MAP_ASSETS_DICT = {
-    MAP_NAME_MIRALAND: {
-        "luma_05x": MiraLandMap,
-        "luma_0125x": MiraLandBigMap,
-        "mask_0125x": MiraLandBigMapMask
-    },
-    MAP_NAME_STARSEA: {
-        "luma_05x": StarSeaMap,
-        "luma_0125x": StarSeaBigMap,
-        "mask_0125x": StarSeaBigMapMask
-    }
-}
\ No newline at end of file
+RotationRemapTable = tuple(map_artifacts.get_or_build(
+    f'rotation_remap_{MINIMAP_RADIUS}', lambda: np.stack(create_rotation_remap_table())))
+
+
+def get_minimap_mask(scale):
+    """缩放好的小地图遮罩，每种缩放只生成一次（各地图的缩放是固定的）"""
+    return map_artifacts.get_or_build(
+        f'minimap_mask_{MINIMAP_POSITION_RADIUS}_{DIRECTION_RADIUS}_{scale}',
+        lambda: cv2.resize(MiniMapMask, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST))
+
+
+def create_arrow_embedding():
+    '''箭头素材每旋转DIRECTION_EMBEDDING_STEP度的特征，(360 / DIRECTION_EMBEDDING_STEP, N)'''
+    arrow = MapAsset('ARROW').img
+    if DIRECTION_ROTATION_SCALE != 1:
+        arrow = cv2.resize(arrow, None, fx=1 / DIRECTION_ROTATION_SCALE, fy=1 / DIRECTION_ROTATION_SCALE,
+                           interpolation=cv2.INTER_LINEAR)
+    degrees = np.arange(0, 360, DIRECTION_EMBEDDING_STEP)
+    return np.stack([get_arrow_feature(color_similarity_2d(rotate_bound(arrow, degree), color=(255, 255, 255)))
+                     for degree in degrees]).astype(np.float32)
+
+
+def get_arrow_embedding():
+    """人物朝向用的箭头特征表，第i行为顺时针旋转i * DIRECTION_EMBEDDING_STEP度"""
+    return map_artifacts.get_or_build(
+        f'arrow_embedding_{DIRECTION_EMBEDDING_SIZE}_{DIRECTION_EMBEDDING_STEP}_{DIRECTION_ROTATION_SCALE}_{DIRECTION_BINARY_THRESHOLD}',
+        create_arrow_embedding)
+
+
+class MapAssetsDict(Mapping):
+    """
+    {地图名: {luma_05x, luma_0125x, mask_0125x}}
+    取某张地图时才加载对应的地图包，见map_pack.map_packs
+    """
+
+    def __getitem__(self, map_name):
+        if map_name not in map_packs:
+            raise KeyError(map_name)
+        return map_packs.load(map_name).assets
+
+    def __iter__(self):
+        return iter(map_packs)
+
+    def __len__(self):
+        return len(map_packs)
+
+
+MAP_ASSETS_DICT = MapAssetsDict()
+
+
+def create_coarse_mask(mask):
+    # 粗匹配的一个像素对应luma_0125x的一块区域，块内有任意可匹配位置就算可匹配
+    mask = (mask > 0).astype(np.uint8) * 255
+    mask = cv2.resize(mask, None, fx=BIGMAP_COARSE_SCALE, fy=BIGMAP_COARSE_SCALE, interpolation=cv2.INTER_AREA)
+    return (mask > 0).astype(np.uint8) * 255
+
+
+def get_bigmap_coarse(map_name):
+    """
+    大地图粗匹配用的地图和遮罩，由luma_0125x和mask_0125x缩小得到
+
+    Returns:
+        (luma, mask)
+    """
+    with map_packs.use(map_name) as pack:
+        # 由地图派生的数据放在pack.data中，随地图包一起释放
+        if 'bigmap_coarse' not in pack.data:
+            assets = pack.assets
+            # 地图包里有预生成的粗匹配图（1/32）时直接用
+            if "luma_003125x" in assets and "mask_003125x" in assets and BIGMAP_COARSE_SCALE == 0.25:
+                pack.data['bigmap_coarse'] = assets["luma_003125x"].img, assets["mask_003125x"].img
+            else:
+                luma = map_artifacts.get_or_build(
+                    f'{assets["luma_0125x"].name}_coarse_{BIGMAP_COARSE_SCALE}',
+                    lambda: cv2.resize(assets["luma_0125x"].img, None, fx=BIGMAP_COARSE_SCALE, fy=BIGMAP_COARSE_SCALE, interpolation=cv2.INTER_AREA),
+                    keep=False)
+                mask = map_artifacts.get_or_build(
+                    f'{assets["mask_0125x"].name}_coarse_{BIGMAP_COARSE_SCALE}',
+                    lambda: create_coarse_mask(assets["mask_0125x"].img), keep=False)
+                pack.data['bigmap_coarse'] = luma, mask
+        return pack.data['bigmap_coarse']
+
+
+def get_feature_index(map_name) -> FeatureIndex:
+    """小地图重定位用的特征索引，第一次使用时由luma_05x生成并缓存到磁盘"""
+    with map_packs.use(map_name) as pack:
+        if 'feature_index' not in pack.data:
+            # 地图包里有参数相同的预生成索引时直接用
+            features = pack.load_features(feature_index_params())
+            if features is not None:
+                pack.data['feature_index'] = FeatureIndex(*features)
+                return pack.data['feature_index']
+            asset = pack.assets["luma_05x"]
+            key = f'{asset.name}_{feature_index_params()}'
+            built = {}
+
+            def build(part):
+                # 特征点和描述子分两个文件保存，但只提取一次
+                if not built:
+                    built['points'], built['descriptors'] = build_feature_index(asset.img)
+                return built[part]
+
+            # 只用磁盘缓存，内存中的索引随地图包释放
+            points = map_artifacts.get_or_build(f'{key}_points', lambda: build('points'), keep=False)
+            descriptors = map_artifacts.get_or_build(f'{key}_descriptors', lambda: build('descriptors'), keep=False)
+            pack.data['feature_index'] = FeatureIndex(points, descriptors)
+        return pack.data['feature_index']
@@ -1,8 +1,10 @@
 import typing as t
+import time
 import cv2
 
 from whimbox.map.detection.utils import *
 from whimbox.interaction.interaction_core import itt
+from whimbox.interaction.frame_context import FrameContext
 from whimbox.common.timer_module import Timer
 from whimbox.common.utils.posi_utils import *
 from whimbox.map.detection.map_assets import *
@@ -29,21 +31,48 @@ class MiniMap:
         self.rotation: float = 0
 
         self.pos_change_timer = Timer(diff_start_time=30)
+        # 根据定位历史预测下一次位置，决定搜索框的中心和大小
+        self.motion_model = MotionModel()
+        # 匹配峰值的亚像素定位方法
+        self.subpixel_method = SUBPIXEL_METHOD
+        # 连续被丢弃的定位次数，达到POSITION_LOST_TIMES时尝试重定位
+        self.position_lost_times = 0
 
     def init_position(self, position: t.Tuple[int, int]):
         self.position = position
+        self.motion_model.reset()
+        self.position_lost_times = 0
+
+    def _get_minimap_area(self, radius):
+        return area_offset((-radius, -radius, radius, radius), offset=MINIMAP_CENTER)
 
     def _get_minimap(self, image, radius):
-        area = area_offset((-radius, -radius, radius, radius), offset=MINIMAP_CENTER)
+        """
+        Args:
+            image: 截图（左上角与全屏截图对齐）或FrameContext
+        """
+        area = self._get_minimap_area(radius)
+        if isinstance(image, FrameContext):
+            return image.bgr(area)
         image = crop(image, area)
         return image
 
+    def _get_minimap_luma(self, image, radius):
+        if isinstance(image, FrameContext):
+            # 先转换最大的小地图区域，其他半径直接从中切出，同一帧只转换一次
+            image.luma(self._get_minimap_area(MINIMAP_RADIUS))
+            return image.luma(self._get_minimap_area(radius))
+        return rgb2luma(self._get_minimap(image, radius))
 
-    def _predict_position(self, image, scale):
+
+    def _predict_position(self, image, scale, center=None, margin=None, map_name=None):
         """
         Args:
             image:
             scale:
+            center: 搜索框中心，默认为上一次的位置
+            margin: 搜索框比小地图向外扩展的距离（png坐标），默认按POSITION_SEARCH_RADIUS
+            map_name: 在哪张地图上搜索，默认为self.map_name
 
         Returns:
             float: Precise similarity
@@ -52,20 +81,25 @@ class MiniMap:
         """
         scale *= POSITION_SEARCH_SCALE
         local = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
-        mask = cv2.resize(MiniMapMask, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        mask = get_minimap_mask(scale)
         if CV_DEBUG_MODE:
             local_copy = local.copy()
             local_copy[mask == 0] = 0
             cv2.imshow('local', local_copy)
             cv2.waitKey(1)
         # Product search area
-        search_position = np.array(self.position, dtype=np.int64)
-        search_size = np.array(image_size(local)) * POSITION_SEARCH_RADIUS
+        search_position = np.array(self.position if center is None else center, dtype=np.int64)
+        if margin is None:
+            search_size = np.array(image_size(local)) * POSITION_SEARCH_RADIUS
+        else:
+            search_size = np.array(image_size(local)) + 2 * margin * POSITION_SEARCH_SCALE
         search_size = (search_size // 2 * 2).astype(np.int64)
         search_area = area_offset((0, 0, *search_size), offset=(-search_size // 2).astype(np.int64))
         search_area = area_offset(search_area, offset=np.multiply(search_position, POSITION_SEARCH_SCALE))
         search_area = np.array(search_area).astype(np.int64)
-        search_image = crop(MAP_ASSETS_DICT[self.map_name]['luma_05x'].img, search_area)
+        if map_name is None:
+            map_name = self.map_name
+        search_image = MAP_ASSETS_DICT[map_name]['luma_05x'].crop(search_area)
         if CV_DEBUG_MODE:
             show_search_image = search_image.copy()
             # 在show_search_image中心画一个半径为2px的方块
@@ -86,9 +120,9 @@ class MiniMap:
         local_maximum = cv2.subtract(result, cv2.GaussianBlur(result, (5, 5), 0))
         _, local_sim, _, loca = cv2.minMaxLoc(local_maximum)
 
-        # Calculate the precise location using CUBIC
+        # Calculate the precise location
         precise = crop(result, area=area_offset((-4, -4, 4, 4), offset=loca))
-        precise_sim, precise_loca = cubic_find_maximum(precise, precision=0.05)
+        precise_sim, precise_loca = subpixel_find_maximum(precise, precision=0.05, method=self.subpixel_method)
         precise_loca -= 5
 
         # Location on search_image
@@ -108,26 +142,114 @@ class MiniMap:
         - position_similarity
         - position
         """
-        image = self._get_minimap(origin_image, MINIMAP_POSITION_RADIUS)
-        image = rgb2luma(image)
+        image = self._get_minimap_luma(origin_image, MINIMAP_POSITION_RADIUS)
 
-        best_sim, best_local_sim, best_loca = self._predict_position(image, MINIMAP_POSITION_SCALE_DICT[self.map_name])
+        # 运动模型可用时，在预测位置附近按预测误差搜索；否则用上次位置和固定大小的搜索框
+        now = time.time()
+        if self.motion_model.is_ready(now):
+            predicted, margin = self.motion_model.predict(now)
+        else:
+            predicted, margin = None, None
+        best_sim, best_local_sim, best_loca = self._predict_position(
+            image, MINIMAP_POSITION_SCALE_DICT[self.map_name], center=predicted, margin=margin)
 
-        if self.verify_position(tuple(np.round(best_loca, 1))):
+        if self.verify_position(tuple(np.round(best_loca, 1)), predicted=predicted):
             self.position_similarity = round(best_sim, 5)
             self.position_similarity_local = round(best_local_sim, 5)
             self.position = tuple(np.round(best_loca, 1))
+            self.motion_model.update(self.position, now)
+            self.position_lost_times = 0
+        else:
+            self.position_lost_times += 1
+            # 重定位失败时不要每帧都试，每丢POSITION_LOST_TIMES次试一次
+            if self.position_lost_times % POSITION_LOST_TIMES == 0:
+                logger.warning(f'position lost {self.position_lost_times} times, try to relocate by minimap')
+                if self.relocate_position(image, prior=self.position):
+                    self.pos_change_timer.reset()
         return self.position
 
 
-    def verify_position(self, pos):
+    def search_relocate_position(self, image, prior=None, map_name=None):
+        """
+        跟丢后只凭小地图，用特征索引在地图上查找位置，不更新position和map_name
+
+        Args:
+            image: 小地图亮度（MINIMAP_POSITION_RADIUS）或截图、FrameContext
+            prior: 先验位置，先在附近查找，找不到再查全图
+            map_name: 在哪张地图上查找，默认为当前地图self.map_name
+
+        Returns:
+            (position, votes, sim, local_sim)，找不到时返回None
+        """
+        if not isinstance(image, np.ndarray) or image.ndim != 2:
+            image = self._get_minimap_luma(image, MINIMAP_POSITION_RADIUS)
+        if map_name is None:
+            map_name = self.map_name
+        scale = MINIMAP_POSITION_SCALE_DICT[map_name] * POSITION_SEARCH_SCALE
+        local = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # 特征块会超出遮罩，收缩一圈，避免小地图边框和中心箭头产生特征
+        mask = cv2.erode(get_minimap_mask(scale), np.ones((FEATURE_PATCH_SIZE, FEATURE_PATCH_SIZE), np.uint8))
+        index = get_feature_index(map_name)
+
+        areas = [None]
+        if prior is not None:
+            radius = FEATURE_RELOCATE_SEARCH_RADIUS
+            prior = np.array(prior)
+            areas.insert(0, tuple(np.concatenate([prior - radius, prior + radius]) * POSITION_SEARCH_SCALE))
+        for area in areas:
+            center, votes = index.query(local, mask, area)
+            if center is None:
+                continue
+            # 索引坐标换算为png坐标，再用模板匹配精修
+            center = np.array(center) / POSITION_SEARCH_SCALE + POSITION_MOVE
+            sim, local_sim, loca = self._predict_position(
+                image, MINIMAP_POSITION_SCALE_DICT[map_name], center=center, margin=FEATURE_RELOCATE_MAX_ERROR, map_name=map_name)
+            if euclidean_distance(loca, center) > FEATURE_RELOCATE_MAX_ERROR:
+                logger.debug(f'relocate result {center} not confirmed by template matching {loca}')
+                continue
+            return loca, votes, sim, local_sim
+        return None
+
+    def apply_relocate_position(self, result):
+        """采用search_relocate_position的结果"""
+        loca, votes, sim, local_sim = result
+        logger.info(f'relocate by minimap: {np.round(loca, 1)}, votes: {votes}, sim: {round(sim, 3)}')
+        self.init_position(tuple(np.round(loca, 1)))
+        self.position_similarity = round(sim, 5)
+        self.position_similarity_local = round(local_sim, 5)
+
+    def relocate_position(self, image, prior=None):
+        """
+        跟丢后只凭小地图，用特征索引在整张地图上找回位置，不需要打开大地图
+
+        Args:
+            image: 小地图亮度（MINIMAP_POSITION_RADIUS）或截图、FrameContext
+            prior: 先验位置，先在附近查找，找不到再查全图
+
+        Returns:
+            bool: 是否成功，成功时会更新position
+        """
+        result = self.search_relocate_position(image, prior=prior)
+        if result is None:
+            return False
+        self.apply_relocate_position(result)
+        return True
+
+
+    def verify_position(self, pos, predicted=None):
+        """
+        Args:
+            pos: 新的定位结果
+            predicted: 运动模型的预测位置。有预测时按偏离预测的距离校验，持续的冲刺不会被当成跳变丢弃
+        """
         dt = self.pos_change_timer.get_diff_time()
         if dt > 20:
             self.pos_change_timer.reset()
             return True
         else:
-            if euclidean_distance(pos, self.position) >= MOVE_SPEED * dt + 1:
-                logger.warning(f'position change above limit: {euclidean_distance(pos, self.position)} >= {MOVE_SPEED * dt + 1}. result will be abandon.')
+            ref = self.position if predicted is None else predicted
+            if euclidean_distance(pos, ref) >= MOVE_SPEED * dt + 1:
+                logger.warning(f'position change above limit: {euclidean_distance(pos, ref)} >= {MOVE_SPEED * dt + 1}. result will be abandon.')
                 return False
             else:
                 self.pos_change_timer.reset()
@@ -138,60 +260,31 @@ class MiniMap:
         """
         Get direction of character
 
+        箭头的特征向量和预先算好的各角度特征表做一次矩阵乘法，得到每个角度的相关系数，
+        再在最大值和左右相邻的角度上做抛物线插值（角度首尾相接）
+
         The following attributes will be set:
         - direction_similarity
         - direction
         """
         image = self._get_minimap(image, DIRECTION_RADIUS)
         image = color_similarity_2d(image, color=DIRECTION_SIMILARITY_COLOR)
-        try:
-            area = area_pad(get_bbox(image, threshold=128), pad=-1)
-        except IndexError:
-            # IndexError: index 0 is out of bounds for axis 0 with size 0
+        feature = get_arrow_feature(image)
+        if feature is None:
             logger.warning('No direction arrow on minimap')
             return
-        image = crop(image, area=area)
         if CV_DEBUG_MODE:
             cv2.imshow('direction_image', image)
             cv2.waitKey(1)
 
-        scale = DIRECTION_ROTATION_SCALE * DIRECTION_SEARCH_SCALE
-        mapping = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
-        result = cv2.matchTemplate(ArrowRotateMap.img, mapping, cv2.TM_CCOEFF_NORMED)
-        result = cv2.subtract(result, cv2.GaussianBlur(result, (5, 5), 0))
-        _, sim, _, loca = cv2.minMaxLoc(result)
-        loca = np.array(loca) / DIRECTION_SEARCH_SCALE // (DIRECTION_RADIUS * 2)
-        degree = int((loca[0] + loca[1] * 8) * 5)
-
-        def to_map(x):
-            return int((x * DIRECTION_RADIUS * 2 + DIRECTION_RADIUS) * POSITION_SEARCH_SCALE)
-
-        # Row on ArrowRotateMapAll
-        row = int(degree // 8) + 45
-        # Calculate +-1 rows to get result with a precision of 1
-        row = (row - 2, row + 3)
-        # Convert to ArrowRotateMapAll and to be 5px larger
-        row = (to_map(row[0]) - 5, to_map(row[1]) + 5)
-
-        precise_map = ArrowRotateMapAll.img[row[0]:row[1], :]
-        result = cv2.matchTemplate(precise_map, mapping, cv2.TM_CCOEFF_NORMED)
-        result = cv2.subtract(result, cv2.GaussianBlur(result, (5, 5), 0))
-
-        def to_map(x):
-            return int((x * DIRECTION_RADIUS * 2) * POSITION_SEARCH_SCALE)
-
-        def get_precise_sim(d):
-            y, x = divmod(d, 8)
-            im = result[to_map(y):to_map(y + 1), to_map(x):to_map(x + 1)]
-            _, sim, _, _ = cv2.minMaxLoc(im)
-            return sim
-
-        precise = np.array([[get_precise_sim(_) for _ in range(24)]])
-        precise_sim, precise_loca = cubic_find_maximum(precise, precision=0.1)
-        precise_loca = degree // 8 * 8 - 8 + precise_loca[0]
-
-        self.direction_similarity = round(precise_sim, 3)
-        self.direction = precise_loca % 360
+        scores = get_arrow_embedding() @ feature
+        index = int(np.argmax(scores))
+        left, peak, right = scores[index - 1], scores[index], scores[(index + 1) % len(scores)]
+        curvature = left - 2 * peak + right
+        offset = 0.5 * (left - right) / curvature if curvature < 0 else 0.
+
+        self.direction_similarity = round(float(peak), 3)
+        self.direction = (index + offset) * DIRECTION_EMBEDDING_STEP % 360
         # Convert
         if self.direction > 180:
             self.direction = 360 - self.direction
@@ -216,8 +309,7 @@ class MiniMap:
 
         # Get current minimap
         scale = MINIMAP_POSITION_SCALE_DICT[self.map_name] * POSITION_SEARCH_SCALE
-        minimap = self._get_minimap(image, radius=MINIMAP_RADIUS)
-        minimap = rgb2luma(minimap)
+        minimap = self._get_minimap_luma(image, radius=MINIMAP_RADIUS)
 
         radius = MINIMAP_RADIUS * scale
         area = area_offset((-radius, -radius, radius, radius),
@@ -227,7 +319,7 @@ class MiniMap:
         area = np.array(area).astype(int)
 
         # Crop pngmap around current position and resize to current minimap
-        image = crop(MAP_ASSETS_DICT[self.map_name]['luma_05x'].img, area)
+        image = MAP_ASSETS_DICT[self.map_name]['luma_05x'].crop(area)
         image = cv2.resize(image, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_LINEAR)
         # if CV_DEBUG_MODE:
         #     cv2.imshow('minimap', minimap)
@@ -236,7 +328,7 @@ class MiniMap:
         #     cv2.waitKey(1)
         # Search best match
         result = cv2.matchTemplate(image, minimap, cv2.TM_CCOEFF_NORMED)
-        sim, loca = cubic_find_maximum(result, precision=0.05)
+        sim, loca = subpixel_find_maximum(result, precision=0.05, method=self.subpixel_method)
         # Re-crop the pngmap that best match current map
         area = (0, 0, MINIMAP_RADIUS * 2, MINIMAP_RADIUS * 2)
         src = area2corner(area_offset(area, loca)).astype(np.float32)
@@ -271,27 +363,27 @@ class MiniMap:
             cv2.waitKey(1)
 
         # Magic parameters for scipy.find_peaks
-        para = {
-            'height': 100,
-            'wlen': d * scale,
-        }
+        # (wlen only affects prominence which is not used, so peaks are plain local maxima above height)
+        height = 100
+        n = d * scale
 
         # `l` for the left of sight area, derivative is positive
         # `r` for the right of sight area, derivative is negative
-        l = np.bincount(signal.find_peaks(gradx.ravel(), **para)[0] % (d * scale), minlength=d * scale)
-        r = np.bincount(signal.find_peaks(-gradx.ravel(), **para)[0] % (d * scale), minlength=d * scale)
+        gradx = gradx.ravel()
+        l = np.bincount(find_peaks_index(gradx, height=height) % n, minlength=n)
+        r = np.bincount(find_peaks_index(-gradx, height=height) % n, minlength=n)
         l, r = np.maximum(l - r, 0), np.maximum(r - l, 0)
 
-        conv0 = []
+        # convolve commutes with roll, so convolve r once and build every offset by indexing,
+        # then run the last convolution on all offsets as one batch
         kernel = 2 * scale
-        for offset in range(-kernel + 1, kernel):
-            result = l * convolve(np.roll(r, -d * scale // 4 + offset), kernel=3 * scale)
-            minus = l * convolve(np.roll(r, offset), kernel=10 * scale) // 5
-            result -= minus
-            result = convolve(result, kernel=3 * scale)
-            conv0 += [result]
-
-        conv0 = np.array(conv0)
+        offsets = np.arange(-kernel + 1, kernel)
+        index = np.arange(n)
+        conv_r = convolve(r, kernel=3 * scale)[(index[None, :] - (-n // 4 + offsets[:, None])) % n]
+        conv_minus = convolve(r, kernel=10 * scale)[(index[None, :] - offsets[:, None]) % n]
+        conv0 = l * conv_r - l * conv_minus // 5
+        conv0 = convolve(conv0, kernel=3 * scale)
+
         conv0[conv0 < 1] = 1
         maximum = np.max(conv0, axis=0)
         if peak_confidence(maximum) > 0.3:
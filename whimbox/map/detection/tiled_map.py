@@ -0,0 +1,127 @@
+import os
+import json
+
+import numpy as np
+
+from whimbox.map.detection.cvars import MAP_TILE_SIZE, MAP_ARTIFACT_VERSION
+
+
+class TiledMap:
+    """
+    瓦片化存储的地图，按tile_size切块后连续存放在.npy文件中，用memmap打开。
+    crop时只读取涉及的几个瓦片，常驻内存只和实际用到的区域有关。
+
+    每张地图两个文件：
+        {name}.npy: shape为(rows, cols, tile_size, tile_size[, channel])，边缘不满一块的部分补0
+        {name}.json: 索引，记录原图尺寸、瓦片大小、版本和源图片信息，最后写入，作为生成完成的标志
+    """
+
+    def __init__(self, data_file, shape, tile_size):
+        self.tiles = np.load(data_file, mmap_mode='r')
+        self.shape = tuple(shape)
+        self.tile_size = tile_size
+
+    @staticmethod
+    def _source_info(source):
+        stat = os.stat(source)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    @classmethod
+    def build(cls, image, data_file, index_file, source_info, tile_size=MAP_TILE_SIZE):
+        """把整张图切块写入磁盘"""
+        h, w = image.shape[:2]
+        rows, cols = -(-h // tile_size), -(-w // tile_size)
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        tmp_file = data_file + '.tmp.npy'
+        tiles = np.lib.format.open_memmap(
+            tmp_file, mode='w+', dtype=image.dtype, shape=(rows, cols, tile_size, tile_size, *image.shape[2:]))
+        for r in range(rows):
+            for c in range(cols):
+                block = image[r * tile_size:(r + 1) * tile_size, c * tile_size:(c + 1) * tile_size]
+                tiles[r, c, :block.shape[0], :block.shape[1]] = block
+        tiles.flush()
+        del tiles
+        os.replace(tmp_file, data_file)
+        index = {
+            'version': MAP_ARTIFACT_VERSION,
+            'shape': [h, w],
+            'tile_size': tile_size,
+            'source': source_info,
+        }
+        with open(index_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+
+    @classmethod
+    def open(cls, name, path, source_info, tile_size=MAP_TILE_SIZE):
+        """
+        打开已生成的瓦片地图，只读不写；不存在、版本不对或源图片信息不一致时返回None
+
+        Args:
+            name: 文件名
+            path: 瓦片目录
+            source_info: 期望的源图片信息，与索引中记录的比较
+        """
+        data_file = os.path.join(path, f'{name}.npy')
+        index_file = os.path.join(path, f'{name}.json')
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if (index['version'] == MAP_ARTIFACT_VERSION and index['tile_size'] == tile_size
+                    and index['source'] == source_info):
+                return cls(data_file, index['shape'], tile_size)
+        except (OSError, KeyError, ValueError):
+            pass
+        return None
+
+    @classmethod
+    def open_or_build(cls, name, source, load_func, path=None, tile_size=MAP_TILE_SIZE):
+        """
+        打开已生成的瓦片地图；不存在、版本不对或源图片变了时，调用load_func()读取整图重新生成
+
+        Args:
+            name: 文件名
+            source: 源图片路径，用于判断是否需要重新生成
+            load_func: 读取整张源图片的函数
+        """
+        if path is None:
+            from whimbox.common.path_lib import CACHE_PATH
+            path = os.path.join(CACHE_PATH, 'map_tiles')
+        source_info = cls._source_info(source)
+        tiled_map = cls.open(name, path, source_info, tile_size=tile_size)
+        if tiled_map is not None:
+            return tiled_map
+        from whimbox.common.logger import logger
+        logger.info(f'build tiled map {name}')
+        data_file = os.path.join(path, f'{name}.npy')
+        index_file = os.path.join(path, f'{name}.json')
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        image = load_func()
+        cls.build(image, data_file, index_file, source_info, tile_size=tile_size)
+        return cls(data_file, image.shape[:2], tile_size)
+
+    def crop(self, area) -> np.ndarray:
+        """
+        同img_utils.crop，超出地图的部分为黑色
+
+        Args:
+            area: (x1, y1, x2, y2)
+        """
+        x1, y1, x2, y2 = map(int, map(round, area))
+        h, w = self.shape
+        size = self.tile_size
+        image = np.zeros((max(y2 - y1, 0), max(x2 - x1, 0), *self.tiles.shape[4:]), dtype=self.tiles.dtype)
+        # 与地图相交的部分
+        ix1, iy1, ix2, iy2 = max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+        if ix2 <= ix1 or iy2 <= iy1:
+            return image
+        for r in range(iy1 // size, (iy2 - 1) // size + 1):
+            for c in range(ix1 // size, (ix2 - 1) // size + 1):
+                bx1, by1 = max(ix1, c * size), max(iy1, r * size)
+                bx2, by2 = min(ix2, (c + 1) * size), min(iy2, (r + 1) * size)
+                image[by1 - y1:by2 - y1, bx1 - x1:bx2 - x1] = \
+                    self.tiles[r, c, by1 - r * size:by2 - r * size, bx1 - c * size:bx2 - c * size]
+        return image
+
+    def __repr__(self):
+        return f'TiledMap(shape={self.shape}, tile_size={self.tile_size})'
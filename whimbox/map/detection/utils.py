@@ -2,6 +2,12 @@ from scipy import signal
 from whimbox.common.utils.img_utils import *
 from whimbox.common.utils.asset_utils import *
 from whimbox.map.detection.cvars import REGION_NAME_TO_MAP_NAME_DICT, MAP_NAME_HOME
+from whimbox.map.detection.cvars import SUBPIXEL_CUBIC, SUBPIXEL_QUADRATIC, SUBPIXEL_GAUSSIAN
+from whimbox.map.detection.cvars import POSITION_SEARCH_MARGIN_MIN, POSITION_SEARCH_MARGIN_MAX, POSITION_SEARCH_MARGIN_SIGMA, \
+    MOVE_ACCELERATION, MOTION_MODEL_MAX_DT, MOTION_MODEL_ALPHA, MOTION_MODEL_BETA
+from whimbox.map.detection.cvars import DIRECTION_BINARY_THRESHOLD, DIRECTION_EMBEDDING_SIZE
+from whimbox.map.detection.tiled_map import TiledMap
+import threading
 import traceback
 
 def trans_region_name_to_map_name(region_name):
@@ -12,13 +18,109 @@ def trans_region_name_to_map_name(region_name):
 
 
 class MapAsset(AssetBase):
-    def __init__(self, name=None):
+    """
+    地图图片，第一次用到时才读取，没去过的地图不占内存。
+    tiled为True时转换为瓦片存储（见TiledMap），crop只读取涉及的瓦片，适合只在局部搜索的大图。
+    """
+
+    def __init__(self, name=None, tiled=False, path=None, tiles_path=None, source_sha256=None):
         if name is None:
             super().__init__(get_name(traceback.extract_stack()[-2]))
         else:
             super().__init__(name)
-        self.path = self.get_img_path()
-        self.img = load_image(self.path)
+        # 地图包中的图片可以直接指定路径，不需要放在imgs中
+        self.path = self.get_img_path() if path is None else path
+        self.tiled = tiled
+        # 地图包中预生成的瓦片目录，只读，用source_sha256（清单中源图片的校验和）验证是否对应当前图片
+        self.tiles_path = tiles_path
+        self.source_sha256 = source_sha256
+        self._img = None
+        self._tiles = None
+        self._lock = threading.RLock()
+
+    @property
+    def img(self) -> np.ndarray:
+        """整张图片"""
+        if self._img is None:
+            with self._lock:
+                if self._img is None:
+                    if self.tiled:
+                        self._img = self.tiles.crop((0, 0, self.tiles.shape[1], self.tiles.shape[0]))
+                    else:
+                        self._img = load_image(self.path)
+        return self._img
+
+    @property
+    def tiles(self) -> TiledMap:
+        if self._tiles is None:
+            with self._lock:
+                if self._tiles is None:
+                    tiles = None
+                    if self.tiles_path is not None and self.source_sha256 is not None:
+                        tiles = TiledMap.open(self.name, self.tiles_path, {'sha256': self.source_sha256})
+                    if tiles is None:
+                        # 没有预生成的瓦片或者对不上时在缓存目录中生成，不改动地图包
+                        tiles = TiledMap.open_or_build(self.name, self.path, lambda: load_image(self.path))
+                    self._tiles = tiles
+        return self._tiles
+
+    def crop(self, area) -> np.ndarray:
+        """同crop(self.img, area)"""
+        if self.tiled and self._img is None:
+            return self.tiles.crop(area)
+        return crop(self.img, area)
+
+
+class MotionModel:
+    """
+    匀速运动模型（alpha-beta滤波），根据带时间戳的定位历史预测下一次的位置和搜索范围。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, position=None, t=None):
+        self.position = None if position is None else np.array(position, dtype=np.float64)
+        self.velocity = np.zeros(2)
+        self.last_time = t
+        # 预测误差的滑动平均
+        self.residual = float(POSITION_SEARCH_MARGIN_MAX)
+        self.update_times = 0
+
+    def is_ready(self, t):
+        """至少定位过两次、且间隔不太久时，预测才可信"""
+        return self.update_times >= 2 and t - self.last_time <= MOTION_MODEL_MAX_DT
+
+    def predict(self, t):
+        """
+        Returns:
+            np.ndarray: 预测位置
+            float: 搜索框需要向外扩展的距离
+        """
+        dt = t - self.last_time
+        predicted = self.position + self.velocity * dt
+        sigma = self.residual + MOVE_ACCELERATION * dt * dt / 2
+        margin = np.clip(POSITION_SEARCH_MARGIN_SIGMA * sigma, POSITION_SEARCH_MARGIN_MIN, POSITION_SEARCH_MARGIN_MAX)
+        return predicted, float(margin)
+
+    def update(self, position, t):
+        position = np.array(position, dtype=np.float64)
+        if self.position is None or self.last_time is None or t - self.last_time > MOTION_MODEL_MAX_DT:
+            self.reset(position, t)
+            self.update_times = 1
+            return
+        dt = max(t - self.last_time, 1e-3)
+        predicted = self.position + self.velocity * dt
+        innovation = position - predicted
+        if self.update_times >= 2:
+            self.residual += (np.linalg.norm(innovation) - self.residual) * MOTION_MODEL_ALPHA
+        else:
+            self.residual = float(np.linalg.norm(innovation))
+        # 定位结果本身比较准，位置直接用观测值，只滤波速度
+        self.velocity = self.velocity + MOTION_MODEL_BETA * innovation / dt if self.update_times >= 2 else (position - self.position) / dt
+        self.position = position
+        self.last_time = t
+        self.update_times += 1
 
 
 def create_circle_mask(h, w, center=None, radius=None):
@@ -35,6 +137,37 @@ def create_circle_mask(h, w, center=None, radius=None):
     return mask
 
 
+def get_arrow_feature(image):
+    """
+    人物箭头的特征向量，和各角度的箭头特征表做点积即可得到朝向
+
+    二值化并遮掉圆外后，把箭头重心平移到DIRECTION_EMBEDDING_SIZE见方的中心，和箭头在截图中的准确位置无关。
+    减均值、归一化后，两个特征的点积就是相关系数（同TM_CCOEFF_NORMED）
+
+    Args:
+        image: color_similarity_2d后的箭头图片
+
+    Returns:
+        np.ndarray: 一维float32向量，没有箭头时为None
+    """
+    h, w = image.shape[:2]
+    binary = ((image > DIRECTION_BINARY_THRESHOLD) & create_circle_mask(h, w)).astype(np.float32)
+    moments = cv2.moments(binary, binaryImage=True)
+    if moments['m00'] == 0:
+        return None
+    size = DIRECTION_EMBEDDING_SIZE
+    center = (size - 1) / 2
+    shift = np.float32([[1, 0, center - moments['m10'] / moments['m00']],
+                        [0, 1, center - moments['m01'] / moments['m00']]])
+    patch = cv2.warpAffine(binary, shift, (size, size), flags=cv2.INTER_LINEAR)
+    feature = patch[create_circle_mask(size, size)]
+    feature -= feature.mean()
+    norm = np.linalg.norm(feature)
+    if norm == 0:
+        return None
+    return feature / norm
+
+
 def rotate_bound(image, angle):
     """
     Rotate an image with outbound
@@ -90,6 +223,69 @@ def cubic_find_maximum(image, precision=0.05):
     return sim, loca
 
 
+def _quadratic_offset(f):
+    """
+    3x3邻域拟合二次曲面，返回峰值相对中心的偏移和峰值。
+    f为3x3数组，中心是离散最大值。
+    """
+    gx = (f[1, 2] - f[1, 0]) / 2
+    gy = (f[2, 1] - f[0, 1]) / 2
+    hxx = f[1, 2] - 2 * f[1, 1] + f[1, 0]
+    hyy = f[2, 1] - 2 * f[1, 1] + f[0, 1]
+    hxy = (f[2, 2] - f[0, 2] - f[2, 0] + f[0, 0]) / 4
+    det = hxx * hyy - hxy * hxy
+    if hxx < 0 and det > 0:
+        dx = (hxy * gy - hyy * gx) / det
+        dy = (hxy * gx - hxx * gy) / det
+        if abs(dx) <= 1 and abs(dy) <= 1:
+            return np.array([dx, dy]), f[1, 1] + (gx * dx + gy * dy) / 2
+    # 不是良好的峰，两个方向分别拟合抛物线
+    dx = -gx / hxx if hxx < 0 else 0.
+    dy = -gy / hyy if hyy < 0 else 0.
+    dx, dy = np.clip(dx, -0.5, 0.5), np.clip(dy, -0.5, 0.5)
+    return np.array([dx, dy]), f[1, 1] + (gx * dx + gy * dy) / 2
+
+
+def subpixel_find_maximum(image, precision=0.05, method=SUBPIXEL_CUBIC):
+    """
+    找到匹配结果的亚像素峰值，返回值和cubic_find_maximum的坐标约定一致，可以直接替换。
+
+    Args:
+        image (np.ndarray): 一般是峰值附近的匹配结果，可以只有一行
+        precision (float): cubic方法的精度；解析方法不受它影响，只用于对齐坐标约定
+        method (str): SUBPIXEL_CUBIC/SUBPIXEL_QUADRATIC/SUBPIXEL_GAUSSIAN
+
+    Returns:
+        float: 峰值
+        np.ndarray[float, float]: 峰值位置
+    """
+    if method == SUBPIXEL_CUBIC:
+        return cubic_find_maximum(image, precision=precision)
+
+    _, sim, _, loca = cv2.minMaxLoc(image)
+    x, y = loca
+    # 边界上补一圈，补出来的值等于中心，该方向上不会偏移
+    h, w = image.shape[:2]
+    if 0 < x < w - 1 and 0 < y < h - 1:
+        f = image[y - 1:y + 2, x - 1:x + 2].astype(np.float64)
+    else:
+        f = np.full((3, 3), sim, dtype=np.float64)
+        for j in range(-1, 2):
+            for i in range(-1, 2):
+                if 0 <= y + j < h and 0 <= x + i < w:
+                    f[j + 1, i + 1] = image[y + j, x + i]
+
+    if method == SUBPIXEL_GAUSSIAN and f.min() > 0:
+        offset, log_sim = _quadratic_offset(np.log(f))
+        sim = float(np.exp(log_sim))
+    else:
+        offset, sim = _quadratic_offset(f)
+        sim = float(sim)
+    # cubic放大后以像素中心对齐，坐标整体偏移了0.5-precision/2
+    loca = np.array(loca, dtype=np.float64) + offset + 0.5 - precision / 2
+    return sim, loca
+
+
 def image_center_pad(image, size, value=(0, 0, 0)):
     """
     Create a new image with given `size`, placing given `image` in the middle.
@@ -140,14 +336,59 @@ def area2corner(area):
 
 def convolve(arr, kernel=3):
     """
+    Circular triangular convolution along the last axis.
+
     Args:
-        arr (np.ndarray): Shape (N,)
+        arr (np.ndarray): Shape (N,) or (M, N), a batch of M rows is convolved at once
         kernel (int):
 
     Returns:
         np.ndarray:
     """
-    return sum(np.roll(arr, i) * (kernel - abs(i)) // kernel for i in range(-kernel + 1, kernel))
+    return sum(np.roll(arr, i, axis=-1) * (kernel - abs(i)) // kernel for i in range(-kernel + 1, kernel))
+
+
+def find_peaks_index(x, height=None):
+    """
+    Vectorised equivalent of `signal.find_peaks(x, height=height)[0]`.
+    Flat peaks return their middle index, samples at both ends are never peaks, same as scipy.
+
+    Args:
+        x (np.ndarray): Shape (N,)
+        height (float): Minimum height of peaks
+
+    Returns:
+        np.ndarray: Indices of peaks
+    """
+    if height is None:
+        diff = np.diff(x)
+        # Indices where the value changes, a peak is a rise followed by a fall (plateau between them)
+        change = np.flatnonzero(diff)
+        if len(change) < 2:
+            return np.zeros(0, dtype=np.int64)
+        sign = diff[change] > 0
+        rise = sign[:-1] & ~sign[1:]
+        return (change[:-1][rise] + 1 + change[1:][rise]) // 2
+
+    # Only samples above height can be peaks, which are usually a small part of x
+    index = np.flatnonzero(x[1:-1] >= height) + 1
+    value = x[index]
+    left = x[index - 1] < value
+    right = x[index + 1]
+    peaks = [index[left & (right < value)]]
+    # Rare flat peaks, walk from the left edge to the right edge
+    flat = []
+    n = len(x)
+    for i in index[left & (right == value)]:
+        j = i + 1
+        while j < n and x[j] == x[i]:
+            j += 1
+        if j < n and x[j] < x[i]:
+            flat.append((i + j - 1) // 2)
+    if flat:
+        peaks.append(np.array(flat, dtype=np.int64))
+        return np.sort(np.concatenate(peaks))
+    return peaks[0]
 
 
 def peak_confidence(arr, **kwargs):
@@ -1,5 +1,5 @@
 from whimbox.common import timer_module
-from whimbox.map.detection.cvars import MOVE_SPEED
+from whimbox.map.detection.cvars import MOVE_SPEED, FEATURE_RELOCATE_MAP_MARGIN, MINIMAP_CAPTURE_AREA
 from whimbox.ui.ui import ui_control
 from whimbox.ui.ui_assets import *
 from whimbox.ui.page_assets import *
@@ -8,6 +8,8 @@ from whimbox.map.data.nikki_teleporter import DICT_TELEPORTER
 from whimbox.map.detection.bigmap import BigMap
 from whimbox.map.detection.minimap import MiniMap
 from whimbox.map.detection.utils import trans_region_name_to_map_name
+from whimbox.map.detection.map_assets import MAP_ASSETS_DICT
+from whimbox.map.map_pack import map_packs
 from whimbox.map.convert import *
 from whimbox.common.logger import logger
 from whimbox.common.utils.posi_utils import *
@@ -42,11 +44,23 @@ class Map(MiniMap, BigMap):
         self.history_position_list = []
         self.region_name = None
         self.map_name = None
-        
+
+    @property
+    def map_name(self):
+        return self._map_name
+
+    @map_name.setter
+    def map_name(self, map_name):
+        # 切换到某张地图时才加载它的地图包，太久没去的地图会被释放
+        if map_name in map_packs:
+            map_packs.load(map_name)
+            map_packs.set_last_used(map_name)
+        self._map_name = map_name
 
     def _upd_smallmap(self) -> None:
-        if itt.get_img_existence(IconPageMainFeature):
-            self.update_position(itt.capture())
+        frame = itt.capture_frame()
+        if itt.get_img_existence(IconPageMainFeature, frame=frame):
+            self.update_position(itt.frame_context(frame))
 
 
     def _is_reset_position(self, curr_posi, threshold=0.8):
@@ -109,12 +123,50 @@ class Map(MiniMap, BigMap):
         else:
             hsv_lower = [0, 0, 0]
             hsv_upper = [180, 255, 180] # hsv阈值处理，排除地图背景图案和文字的干扰
-            self.region_name= itt.ocr_single_line(AreaBigMapRegionName, padding=50, hsv_limit=(hsv_lower, hsv_upper))
+            self.region_name= itt.ocr_single_line(AreaBigMapRegionName, hsv_limit=(hsv_lower, hsv_upper), rec_only=True)
             self.map_name = trans_region_name_to_map_name(self.region_name)
             return self.region_name, self.map_name
 
 
+    def relocate_from_minimap(self) -> bool:
+        """
+        在主界面只凭小地图找回位置，不用打开大地图。
+        先在当前地图上找；当前地图未知或找不到时才查其他地图，
+        其他地图的最佳结果要明显好于第二名（FEATURE_RELOCATE_MAP_MARGIN）才换地图，否则交给大地图判断。
+        """
+        if not ui_control.verify_page(page_main):
+            return False
+        ctx = itt.frame_context()
+        last_map_name = self.map_name
+        if last_map_name in MAP_ASSETS_DICT and self.relocate_position(ctx, prior=self.position):
+            return True
+        # 试探其他地图时不切换map_name，确定换地图后才切换（并记录为上次使用的地图）
+        candidates = []
+        for map_name in MAP_ASSETS_DICT:
+            if map_name == last_map_name:
+                continue
+            result = self.search_relocate_position(ctx, map_name=map_name)
+            if result is not None:
+                candidates.append((result[1], map_name, result))
+        if not candidates:
+            return False
+        candidates.sort(key=lambda x: x[0], reverse=True)
+        votes, map_name, result = candidates[0]
+        if len(candidates) > 1 and votes < candidates[1][0] * FEATURE_RELOCATE_MAP_MARGIN:
+            logger.info(f'relocate by minimap is ambiguous: {[(c[1], c[0]) for c in candidates]}')
+            return False
+        self.map_name = map_name
+        # 换了地图，之前OCR的区域名不再可信
+        self.region_name = None
+        self.apply_relocate_position(result)
+        return True
+
     def reinit_smallmap(self) -> None:
+        if self.relocate_from_minimap():
+            self.small_map_init_flag = True
+            self.last_valid_position = self.position
+            self.smallmap_upd_timer.reset()
+            return
         ui_control.goto_page(page_bigmap)
         self.update_region_and_map_name()
         # 如果在未支持的地图，就先传送到花愿镇
@@ -167,12 +219,12 @@ class Map(MiniMap, BigMap):
         self.reinit_smallmap()
 
     def get_direction(self) -> float:
-        self.update_direction(itt.capture())
+        self.update_direction(itt.frame_context())
         return self.direction
 
     def get_rotation(self) -> float:
         pt = time.time()
-        self.update_rotation(itt.capture())
+        self.update_rotation(itt.frame_context())
         if time.time() - pt > 0.1:
             logger.info(f"get_rotation spent too long: {time.time() - pt}")
         return self.rotation
@@ -189,7 +241,8 @@ class Map(MiniMap, BigMap):
     def get_bigmap_posi(self, is_upd=True) -> t.Tuple[float, float]:
         self.maximize_bigmap_scale()
         if is_upd:
-            self.update_bigmap(itt.capture())
+            # 区域名是在大地图上OCR得到的，用来缩小大地图的搜索范围
+            self.update_bigmap(itt.capture(), region_name=self.region_name)
         logger.debug(f"bigmap px posi: {self.bigmap_position}")
         return self.bigmap_position
 
@@ -356,7 +409,8 @@ class Map(MiniMap, BigMap):
         # 等待传送完成
         while not (ui_control.verify_page(page_main)) and not global_stop_flag.is_set():
             time.sleep(0.5)
-        itt.wait_until_stable(threshold=0.9)
+        # 大世界场景一直在动，只检测小地图区域
+        itt.wait_until_stable(area=MINIMAP_CAPTURE_AREA)
 
         self.init_position(tp_posi) 
 
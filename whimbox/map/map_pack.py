@@ -0,0 +1,224 @@
+"""
+地图包：一张地图用到的图片资源、缩放、坐标偏移、区域名、传送点，写在一个manifest（json）里。
+启动时只读取manifest，地图图片在切换到该地图后才加载，长时间不用的地图会被淘汰释放。
+
+manifest格式：
+{
+    "name": "miraland",                       # 地图名，即Map.map_name
+    "regions": ["花愿镇", ...],               # 大地图上OCR到的区域名
+    "gameloc_to_pngmap_offset": [6718, 5587],
+    "minimap_position_scale": 0.975,
+    "bigmap_position_scale": 0.637,
+    "assets": {                               # luma_05x, luma_0125x, mask_0125x
+        # 不在imgs中的图片可以用path指定，相对于manifest所在目录
+        "luma_0125x": {"name": "xxx_luma_0125x", "path": "xxx_luma_0125x.png"},
+        # tiled为True时按瓦片读取，tiles为可选的预生成瓦片目录（见TiledMap），只读，按checksums中path的sha256验证
+        "luma_05x": {"name": "xxx_luma_05x", "path": "xxx/luma_05x.png", "tiled": true, "tiles": "xxx/tiles"},
+        ...
+    },
+    "teleporters": "xxx_checkpoints.json",    # 可选，格式同checkpoints.json中的一张地图，相对于manifest所在目录
+    # 可选，预生成的重定位特征索引，params与feature_index_params()不同时不使用
+    "features": {"params": "orb_...", "points": "xxx/points.npy", "descriptors": "xxx/descriptors.npy"}
+}
+
+dev_tool/map_assets_gen.py可以从原始地图生成完整的地图包。
+"""
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from whimbox.common.cache import LRUCache
+from whimbox.common.logger import logger
+from whimbox.common.path_lib import MAP_PACK_PATH, USER_MAP_PACK_PATH, CACHE_PATH
+
+# 同时加载的地图包数量，超过时淘汰最久没用的
+MAP_PACK_CACHE_SIZE = 2
+# 记录上次使用的地图，启动预热时只加载这一张
+LAST_MAP_FILE = os.path.join(CACHE_PATH, 'last_map_pack.txt')
+
+
+class MapPack:
+    def __init__(self, manifest: dict, path):
+        self.path = path
+        self.name = manifest['name']
+        self.regions = list(manifest.get('regions', []))
+        self.gameloc_to_pngmap_offset = tuple(manifest['gameloc_to_pngmap_offset'])
+        self.minimap_position_scale = manifest['minimap_position_scale']
+        self.bigmap_position_scale = manifest['bigmap_position_scale']
+        self.asset_specs = manifest['assets']
+        self.teleporters = manifest.get('teleporters')
+        self.features = manifest.get('features')
+        self.checksums = manifest.get('checksums', {})
+        # 加载后为{luma_05x: MapAsset, ...}
+        self.assets = None
+        # 由地图派生的数据（如特征索引），随地图包一起释放
+        self.data = {}
+        # 正在使用的调用方数量，大于0时被淘汰也先不释放，等用完再释放
+        self.pins = 0
+        self.evicted = False
+
+    @classmethod
+    def from_file(cls, file):
+        with open(file, 'r', encoding='utf-8') as f:
+            return cls(json.load(f), os.path.dirname(file))
+
+    @property
+    def loaded(self):
+        return self.assets is not None
+
+    def load(self):
+        from whimbox.map.detection.utils import MapAsset
+        if self.assets is None:
+            assets = {}
+            for kind, spec in self.asset_specs.items():
+                path, tiles_path = spec.get('path'), spec.get('tiles')
+                source_sha256 = self.checksums.get(path)
+                if path is not None:
+                    path = os.path.join(self.path, path)
+                if tiles_path is not None:
+                    tiles_path = os.path.join(self.path, tiles_path)
+                assets[kind] = MapAsset(spec['name'], tiled=spec.get('tiled', False), path=path,
+                                        tiles_path=tiles_path, source_sha256=source_sha256)
+            self.assets = assets
+            logger.debug(f'map pack {self.name} loaded')
+        self.evicted = False
+        return self
+
+    def unload(self):
+        self.assets = None
+        self.data = {}
+        logger.debug(f'map pack {self.name} unloaded')
+
+    def load_teleporters(self) -> list:
+        """manifest中指定的传送点，没有指定时返回空列表"""
+        if not self.teleporters:
+            return []
+        with open(os.path.join(self.path, self.teleporters), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_features(self, params):
+        """
+        预生成的特征索引
+
+        Returns:
+            (points, descriptors)，没有或参数不同时返回None
+        """
+        if not self.features or self.features.get('params') != params:
+            return None
+        try:
+            return (np.load(os.path.join(self.path, self.features['points'])),
+                    np.load(os.path.join(self.path, self.features['descriptors'])))
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f'load features of map pack {self.name} failed: {e}')
+            return None
+
+    def __repr__(self):
+        return f'MapPack({self.name}, loaded={self.loaded})'
+
+
+class MapPackRegistry:
+    """
+    扫描目录中的地图包manifest。
+    load(name)加载并返回地图包，最近用过的MAP_PACK_CACHE_SIZE个保持加载，其余的释放。
+    跨多条语句使用pack.assets、pack.data时用with use(name) as pack，期间即使被淘汰也不会释放。
+    加载不等于玩家在这张地图上（比如重定位时试探其他地图），上次使用的地图由调用方通过set_last_used记录。
+    """
+
+    def __init__(self, paths, cache_size=MAP_PACK_CACHE_SIZE, last_map_file=LAST_MAP_FILE):
+        self.packs = {}
+        self.last_map_file = last_map_file
+        self._last_used = None
+        self.loaded = LRUCache(cache_size, name='map_packs', on_evict=self._evict)
+        # 加载、淘汰和pins的增减都在这个锁里进行
+        self._lock = threading.RLock()
+        for path in paths:
+            self.discover(path)
+
+    def discover(self, path):
+        if not os.path.isdir(path):
+            return
+        for file in sorted(os.listdir(path)):
+            if not file.endswith('.json'):
+                continue
+            try:
+                pack = MapPack.from_file(os.path.join(path, file))
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f'invalid map pack {file}: {e}')
+                continue
+            if pack.name in self.packs:
+                logger.info(f'map pack {pack.name} overridden by {path}')
+            self.packs[pack.name] = pack
+
+    def __contains__(self, name):
+        return name in self.packs
+
+    def __iter__(self):
+        return iter(self.packs)
+
+    def __len__(self):
+        return len(self.packs)
+
+    def get(self, name) -> MapPack:
+        """只取manifest，不加载"""
+        return self.packs[name]
+
+    def _evict(self, name, pack):
+        if pack.pins > 0:
+            pack.evicted = True
+        else:
+            pack.unload()
+
+    def load(self, name) -> MapPack:
+        pack = self.packs[name]
+        with self._lock:
+            pack = self.loaded.get_or_compute(name, pack.load)
+        return pack
+
+    @contextmanager
+    def use(self, name):
+        """加载地图包，并在with期间保持加载"""
+        with self._lock:
+            pack = self.load(name)
+            pack.pins += 1
+        try:
+            yield pack
+        finally:
+            with self._lock:
+                pack.pins -= 1
+                if pack.pins == 0 and pack.evicted:
+                    pack.unload()
+                    pack.evicted = False
+
+    def set_last_used(self, name):
+        """记录玩家当前所在的地图，下次启动时预热它"""
+        if name == self._last_used or name not in self.packs:
+            return
+        self._last_used = name
+        try:
+            os.makedirs(os.path.dirname(self.last_map_file), exist_ok=True)
+            with open(self.last_map_file, 'w', encoding='utf-8') as f:
+                f.write(name)
+        except OSError as e:
+            logger.debug(f'save last map pack failed: {e}')
+
+    def last_used(self, default=None):
+        """上次（包括上次运行时）使用的地图名，没有记录或地图包已不存在时返回default"""
+        name = self._last_used
+        if name is None:
+            try:
+                with open(self.last_map_file, 'r', encoding='utf-8') as f:
+                    name = f.read().strip()
+            except OSError:
+                name = None
+        return name if name in self.packs else default
+
+    def collect(self, field) -> dict:
+        """所有地图包的某个字段，{地图名: 值}"""
+        return {name: getattr(pack, field) for name, pack in self.packs.items()}
+
+
+map_packs = MapPackRegistry([MAP_PACK_PATH, USER_MAP_PACK_PATH])
@@ -89,11 +89,10 @@ class Track:
 
     def get_material_track_degree(self):
         '''根据小地图，计算材料与玩家之间的角度'''
-        cap = itt.capture()
-        minimap_img = nikki_map._get_minimap(cap, MINIMAP_RADIUS)
+        ctx = itt.frame_context()
         lower = [13, 90, 160]
         upper = [15, 200, 255]
-        minimap_hsv = process_with_hsv_limit(minimap_img, lower, upper)
+        minimap_hsv = ctx.hsv_mask(nikki_map._get_minimap_area(MINIMAP_RADIUS), lower, upper)
         minimap_blur = cv2.GaussianBlur(minimap_hsv, (3, 3), 1)
         if CV_DEBUG_MODE:
             cv2.imshow("minimap_blur", minimap_blur)
@@ -129,6 +128,7 @@ class Track:
             if CV_DEBUG_MODE:
                 print(min_dist)
                 x, y, r = np.uint16(np.around(track_circle))
+                minimap_img = nikki_map._get_minimap(ctx, MINIMAP_RADIUS).copy()
                 cv2.circle(minimap_img, (x, y), r, (0, 0, 255), 2)
                 cv2.circle(minimap_img, (x, y), 2, (0, 0, 255), 3)
                 cv2.imshow("minimap_img", minimap_img)
@@ -177,10 +177,9 @@ class Track:
         '''
         判断能力是否激活，通过判断能力按钮外圈是否发光，来判断是否可以使用能力了
         '''
-        img = itt.capture(AreaAbilityButton.position)
         lower = [0, 80, 240]
         upper = [30, 110, 255]
-        px_count = count_px_with_hsv_limit(img, lower, upper)
+        px_count = itt.frame_context().count_hsv(AreaAbilityButton.position, lower, upper)
         if px_count > 200:
             return True
         return False
@@ -103,7 +103,8 @@ class ZhaoxiTask(TaskTemplate):
     def step2(self):
         try:
             # time.sleep(2) # 等待分数变化
-            itt.wait_until_stable(threshold=0.90)
+            # 只检测分数区域，等待分数滚动结束
+            itt.wait_until_stable(area=AreaZxxyScore)
             score_str = itt.ocr_single_line(AreaZxxyScore)
             score = int(score_str.strip())
             if score % 100 != 0:
@@ -40,6 +40,7 @@ class AutoPathTask(TaskTemplate):
         self.last_need_move_mode = MOVE_MODE_WALK
         self.current_game_move_mode = MOVE_MODE_WALK
         self.once_loop_time = 0
+        self.last_frame_id = 0
 
         # 各类材料获取任务的结果记录
         self.material_count_dict = {}
@@ -117,6 +118,8 @@ class AutoPathTask(TaskTemplate):
 
     @register_step("初始化各种信息")
     def step0(self):
+        # 跑图期间由后台线程截图，控制循环只等待新帧
+        itt.start_capture_producer()
         # 启动动作控制线程
         self.jump_controller = JumpController()
         self.move_controller = MoveController()
@@ -150,6 +153,8 @@ class AutoPathTask(TaskTemplate):
                 break
             self.inner_step_control_move()
             time.sleep(self.step_sleep)
+            # 等到有新画面再进入下一轮，避免对同一帧重复识别
+            self.last_frame_id = itt.wait_frame(self.last_frame_id).frame_id
             self.once_loop_time = time.time() - start_time
         return "step2"
 
@@ -270,6 +275,7 @@ class AutoPathTask(TaskTemplate):
     def clear_all(self):
         self.stop_move()
         self.change_to_walk()
+        itt.stop_capture_producer()
         if self.jump_controller is not None and self.move_controller is not None:
             self.jump_controller.stop_threading()
             self.move_controller.stop_threading()
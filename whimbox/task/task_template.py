@@ -1,11 +1,18 @@
 # 因为我们的task将直接被mcp调用
 # 所以就不整原项目thread管理那一套了，怎么简单怎么来
+import sys
+
 from whimbox.common.logger import logger
-from whimbox.ingame_ui.ingame_ui import win_ingame_ui
+if sys.platform == 'win32':
+    from whimbox.ingame_ui.ingame_ui import win_ingame_ui
+    from pynput import keyboard
+else:
+    # 非Windows系统只用于回放截图测试识别，没有游戏内UI，也不监听热键（pynput在没有显示器时无法导入）
+    win_ingame_ui = None
+    keyboard = None
 from whimbox.common.cvars import DEBUG_MODE, global_stop_flag
 from whimbox.common.utils.ui_utils import back_to_page_main
 
-from pynput import keyboard
 import time
 import traceback
 
@@ -63,9 +70,11 @@ class TaskTemplate:
 
         # 创建pynput监听器
         self.key_callbacks = {}  # 存储按键回调
-        self.listener = keyboard.Listener(on_press=self._on_key_press)
-        self.listener.daemon = True  # 设为守护线程
-        self.listener.start()
+        self.listener = None
+        if keyboard is not None:
+            self.listener = keyboard.Listener(on_press=self._on_key_press)
+            self.listener.daemon = True  # 设为守护线程
+            self.listener.start()
 
         # 添加默认停止热键
         self.add_hotkey("/", self.task_stop)
@@ -86,6 +95,8 @@ class TaskTemplate:
     def add_hotkey(self, key_str, callback):
         """添加热键监听"""
         # 将字符串键转换为pynput键对象
+        if keyboard is None:
+            return
         if len(key_str) == 1:  # 单个字符
             self.key_callbacks[key_str] = callback
         else:
@@ -182,7 +193,7 @@ class TaskTemplate:
             back_to_page_main()
             # 停止键盘监听器
             self.key_callbacks.clear()
-            if self.listener.is_alive():
+            if self.listener is not None and self.listener.is_alive():
                 self.listener.stop()
                 self.listener.join()
             return self.task_result
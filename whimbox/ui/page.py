@@ -1,6 +1,10 @@
 import traceback
+import threading
 from typing import List, Union
 
+import cv2
+import numpy as np
+
 from whimbox.ui.template.img_manager import ImgIcon
 from whimbox.ui.template.text_manager import Text
 from whimbox.ui.ui_assets import AreaPageTitleFeature
@@ -36,13 +40,16 @@ class UIPage():
         """
         self.links[destination] = button
 
-    def is_current_page(self, itt):
+    def is_current_page(self, itt, frame=None):
+        # 所有特征都在同一帧上判断，重复判断时可以命中识别缓存
+        if frame is None:
+            frame = itt.capture_frame()
         for imgicon in self.check_icon_list:
             ret = False
             if isinstance(imgicon, ImgIcon):
-                ret = itt.get_img_existence(imgicon)
+                ret = itt.get_img_existence(imgicon, frame=frame)
             elif isinstance(imgicon, Text):
-                ret = itt.get_text_existence(imgicon)
+                ret = itt.get_text_existence(imgicon, frame=frame)
             if ret:
                 return True
         return False
@@ -57,6 +64,161 @@ class TitlePage(UIPage):
         self.title = title
         self.links = {}
 
-    def is_current_page(self, itt):
-        return itt.ocr_single_line(area = AreaPageTitleFeature) == self.title
+    def is_current_page(self, itt, frame=None):
+        return itt.ocr_single_line(area = AreaPageTitleFeature, frame=frame) == self.title
+
+
+class PageClassifier():
+    """
+    页面分类索引，启动时把所有页面的特征汇总起来，在同一帧上一次性判断当前页面。
+
+    图片特征先比较截图区域的平均颜色，差别很大的直接跳过，不做模板匹配；
+    轮到第一个需要OCR的页面时，把剩下的页面要读的单行文字区域（标题、rec_only的Text）用itt.ocr_batch
+    一次识别，后面的判断直接命中同一帧的缓存。判断顺序和pages列表一致。
+    """
+
+    SIGNATURE_TOLERANCE = 40 # 平均颜色任一通道差超过该值时跳过模板匹配
+
+    def __init__(self, pages: List[UIPage]):
+        # (page, kind, feature, signature)
+        self.entries = []
+        for page in pages:
+            if isinstance(page, TitlePage):
+                self.entries.append((page, 'title', page.title, None))
+                continue
+            for icon in page.check_icon_list:
+                if isinstance(icon, ImgIcon):
+                    self.entries.append((page, 'img', icon, self._icon_signature(icon)))
+                elif isinstance(icon, Text):
+                    self.entries.append((page, 'text', icon, None))
+
+    @staticmethod
+    def _icon_signature(icon: ImgIcon):
+        # 只有截图区域和模板一样大时，平均颜色才能代表匹配结果
+        x1, y1, x2, y2 = icon.cap_posi
+        if icon.image.shape[:2] != (y2 - y1, x2 - x1):
+            return None
+        return np.array(cv2.mean(icon.image)[:3])
+
+    def _signature_mismatch(self, itt, icon: ImgIcon, signature, frame):
+        cap = itt.capture(posi=icon.cap_posi, frame=frame)
+        diff = np.abs(np.array(cv2.mean(cap)[:3]) - signature)
+        return diff.max() > self.SIGNATURE_TOLERANCE
+
+    @staticmethod
+    def _prefetch_ocr(itt, entries, frame):
+        areas = []
+        for page, kind, feature, signature in entries:
+            if kind == 'title':
+                area = AreaPageTitleFeature
+            elif kind == 'text' and feature.rec_only:
+                area = feature.cap_area
+            else:
+                continue
+            if area not in areas:
+                areas.append(area)
+        if len(areas) > 1:
+            itt.ocr_batch(areas, frame=frame)
+
+    def classify(self, itt, frame=None):
+        """
+        返回当前页面，都不匹配时返回None
+        """
+        if frame is None:
+            frame = itt.capture_frame()
+        title_text = None
+        ocr_prefetched = False
+        for i, (page, kind, feature, signature) in enumerate(self.entries):
+            if kind != 'img' and not ocr_prefetched:
+                self._prefetch_ocr(itt, self.entries[i:], frame)
+                ocr_prefetched = True
+            if kind == 'title':
+                if title_text is None:
+                    title_text = itt.ocr_single_line(area = AreaPageTitleFeature, frame=frame)
+                if title_text == feature:
+                    return page
+            elif kind == 'img':
+                if signature is not None and self._signature_mismatch(itt, feature, signature, frame):
+                    continue
+                if itt.get_img_existence(feature, frame=frame):
+                    return page
+            elif itt.get_text_existence(feature, frame=frame):
+                return page
+        return None
+
+
+class PageRouter():
+    """
+    页面路由表，把页面之间的links编译成全源最短路的下一跳表。
+
+    每条边的代价是切换页面的耗时（秒），初始为DEFAULT_COST，
+    每次成功切换后用实测耗时做指数平均，代价变化后在下次查询时重新编译。
+    """
+
+    DEFAULT_COST = 1.0
+    COST_SMOOTHING = 0.3 # 新测量值的权重
+
+    def __init__(self, pages: List[UIPage]):
+        self.lock = threading.Lock()
+        self.pages = []
+        # 把只出现在links里的页面也收进来
+        for page in pages:
+            for p in [page, *page.links.keys()]:
+                if p not in self.pages:
+                    self.pages.append(p)
+        self.costs = {}
+        for page in self.pages:
+            for next_page in page.links:
+                self.costs[(page, next_page)] = self.DEFAULT_COST
+        self.next_hops = {}
+        self.dirty = True
+
+    def compile(self):
+        """Floyd-Warshall求出所有页面对之间的最短路，只保存下一跳"""
+        inf = float('inf')
+        dist = {}
+        next_hops = {}
+        for a in self.pages:
+            for b in self.pages:
+                dist[(a, b)] = 0 if a == b else self.costs.get((a, b), inf)
+                if (a, b) in self.costs:
+                    next_hops[(a, b)] = b
+        for k in self.pages:
+            for a in self.pages:
+                dak = dist[(a, k)]
+                if dak == inf:
+                    continue
+                for b in self.pages:
+                    d = dak + dist[(k, b)]
+                    if d < dist[(a, b)]:
+                        dist[(a, b)] = d
+                        next_hops[(a, b)] = next_hops[(a, k)]
+        self.next_hops = next_hops
+        self.dirty = False
+
+    def next_hop(self, from_page: UIPage, to_page: UIPage):
+        """返回从from_page去to_page要先去的页面，不可达时返回None"""
+        with self.lock:
+            if self.dirty:
+                self.compile()
+            return self.next_hops.get((from_page, to_page), None)
+
+    def path(self, from_page: UIPage, to_page: UIPage) -> list:
+        """返回完整路径（包含首尾），不可达时返回空列表"""
+        path = [from_page]
+        while path[-1] != to_page:
+            next_page = self.next_hop(path[-1], to_page)
+            if next_page is None or len(path) > len(self.pages):
+                return []
+            path.append(next_page)
+        return path
 
+    def update_cost(self, from_page: UIPage, to_page: UIPage, cost: float):
+        """用实测的切换耗时更新边的代价"""
+        with self.lock:
+            old = self.costs.get((from_page, to_page), self.DEFAULT_COST)
+            new = old + (cost - old) * self.COST_SMOOTHING
+            self.costs[(from_page, to_page)] = new
+            # 只有变化较大时才需要重新编译
+            if abs(new - old) > 0.05 * old:
+                self.dirty = True
@@ -43,9 +43,14 @@ class PosiTemplate(AssetBase):
             self.position = self.posi_list
 
 class Area(PosiTemplate):
-    def __init__(self, name=None):
+    def __init__(self, name=None, rec_only=False):
+        """
+        Args:
+            rec_only (bool, optional): 区域内固定只有一行文字。单行OCR时跳过文字检测和方向分类，直接识别. Defaults to False.
+        """
         name = get_name(traceback.extract_stack()[-2])
         super().__init__(name)
+        self.rec_only = rec_only
     
     def center_position(self):
         center_posi = []
@@ -6,7 +6,7 @@ from whimbox.ui.template.posi_manager import Area
 
 
 class TextTemplate(AssetBase):
-    def __init__(self, text:str, cap_area:Area, name=None, match_mode=CONTAIN_MATCHING, print_log=LOG_WHEN_TRUE):
+    def __init__(self, text:str, cap_area:Area, name=None, match_mode=CONTAIN_MATCHING, print_log=LOG_WHEN_TRUE, rec_only=None):
         if name is None:
             super().__init__(get_name(traceback.extract_stack()[-2]))
         else:
@@ -16,6 +16,8 @@ class TextTemplate(AssetBase):
         self.cap_area = cap_area
         self.match_mode = match_mode
         self.print_log = print_log
+        # 只识别不检测，不指定时跟随cap_area
+        self.rec_only = getattr(cap_area, 'rec_only', False) if rec_only is None else rec_only
     def gettext(self):
         return self.text
 
@@ -39,10 +41,10 @@ class TextTemplate(AssetBase):
         return False
 
 class Text(TextTemplate):
-    def __init__(self, text, cap_area, name=None, print_log = LOG_WHEN_TRUE) -> None:
+    def __init__(self, text, cap_area, name=None, print_log = LOG_WHEN_TRUE, rec_only=None) -> None:
         if name is None:
             name = get_name(traceback.extract_stack()[-2])
-        super().__init__(text, cap_area=cap_area, name=name, print_log=print_log)
+        super().__init__(text, cap_area=cap_area, name=name, print_log=print_log, rec_only=rec_only)
 
 
 # if __name__ == '__main__':  
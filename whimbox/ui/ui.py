@@ -3,15 +3,18 @@ from whimbox.interaction.interaction_core import itt
 from whimbox.ui.page_assets import *
 from whimbox.ui.template.button_manager import Button
 from whimbox.common.logger import logger
-from whimbox.ui.page import TitlePage
+from whimbox.ui.page import TitlePage, PageClassifier, PageRouter
 from whimbox.common.utils.ui_utils import back_to_page_main
 
+import time
 from threading import Lock
 
 class UI():
 
     def __init__(self) -> None:
         self.switch_ui_lock = Lock()
+        self.page_classifier = PageClassifier(ui_pages)
+        self.page_router = PageRouter(ui_pages)
 
     def ui_additional(self):
         """
@@ -28,17 +31,7 @@ class UI():
             return False
 
     def get_current_page(self):
-        ret_page = None
-        title_text = itt.ocr_single_line(area = AreaPageTitleFeature)
-        for page in ui_pages:
-            if isinstance(page, TitlePage):
-                if page.title == title_text:
-                    ret_page = page
-                    break
-            else:
-                if page.is_current_page(itt):
-                    ret_page = page
-                    break
+        ret_page = self.page_classifier.classify(itt)
         if not ret_page:
             raise Exception("无法识别当前页面")
         else:
@@ -47,115 +40,78 @@ class UI():
     def verify_page(self, page: UIPage) -> bool:
         return page.is_current_page(itt)
 
-    def goto_page(self, target_page: UIPage, retry_times=0, max_retry=1):
-        from collections import deque
+    def goto_page(self, target_page: UIPage, max_retry=1):
         try:
-            self.switch_ui_lock.acquire()
-            
-            logger.info(f"Goto page: {target_page}")
-            
-            # Get current page
-            try:
-                current_page = self.get_current_page()
-            except Exception as e:
-                logger.warning(f"Cannot recognize current page, going back to main page: {e}")
-                back_to_page_main()
-                current_page = page_main
-            
-            # Check if already at destination
-            if current_page == target_page:
-                logger.debug(f'Already at destination page: {target_page}')
-                self.switch_ui_lock.release()
-                return
-            
-            # Use BFS to find path from current page to target page
-            queue = deque([(current_page, [current_page])])
-            visited = {current_page}
-            path = None
-            
-            while queue:
-                page, current_path = queue.popleft()
-                
-                # Check all links from this page
-                for next_page, button in page.links.items():
-                    if next_page in visited:
-                        continue
-                    
-                    visited.add(next_page)
-                    new_path = current_path + [next_page]
-                    
-                    if next_page == target_page:
-                        path = new_path
-                        break
-                    
-                    queue.append((next_page, new_path))
-                
-                if path:
-                    break
-            
-            # If no path found, raise exception
-            if not path:
-                error_msg = f"No path found from {current_page} to {target_page}"
-                logger.error(error_msg)
-                self.switch_ui_lock.release()
-                raise Exception(error_msg)
-            
-            # Log the complete path
-            path_str = " -> ".join([str(p) for p in path])
-            logger.info(f"Navigation path: {path_str}")
-            
-            # Execute the path step by step
-            success = True
-            for i in range(len(path) - 1):
-                if global_stop_flag.is_set():
-                    self.switch_ui_lock.release()
-                    return 
-                from_page = path[i]
-                to_page = path[i + 1]
-                button = from_page.links.get(to_page, None)
-                
-                if button is None:
-                    error_msg = f"No button found to go from {from_page} to {to_page}"
+            with self.switch_ui_lock:
+                logger.info(f"Goto page: {target_page}")
+
+                # Get current page
+                try:
+                    current_page = self.get_current_page()
+                except Exception as e:
+                    logger.warning(f"Cannot recognize current page, going back to main page: {e}")
+                    back_to_page_main()
+                    current_page = page_main
+
+                # Check if already at destination
+                if current_page == target_page:
+                    logger.debug(f'Already at destination page: {target_page}')
+                    return
+
+                path = self.page_router.path(current_page, target_page)
+                if not path:
+                    error_msg = f"No path found from {current_page} to {target_page}"
                     logger.error(error_msg)
-                    self.switch_ui_lock.release()
                     raise Exception(error_msg)
-                
-                logger.debug(f'Page switch: {from_page} -> {to_page}')
-                
-                # Click the button
-                if isinstance(button, str):
-                    itt.key_press(button)
-                elif isinstance(button, Button):
-                    itt.appear_then_click(button)
-                elif isinstance(button, Text):
-                    itt.appear_then_click(button)
-                
-                # itt.delay(1, comment="goto_page is waiting for page transition")
-                logger.info("waiting for page transition")
-                itt.wait_until_stable(threshold=0.90)
-                # Handle loading screen
-                self.ui_additional()
-                logger.info("page transition completed")
-                
-                # Verify we reached the expected page
-                if not to_page.is_current_page(itt):
-                    logger.warning(f"Expected to be at {to_page}, but verification failed. Retrying...")
-                    success = False
-                    break
-
-            if not success:
-                self.switch_ui_lock.release()
-                if retry_times >= max_retry:
-                    raise Exception(f"Failed to navigate to {target_page} after {max_retry} retries")
-                self.goto_page(target_page, retry_times=retry_times + 1, max_retry=max_retry)
-            else:
+                path_str = " -> ".join([str(p) for p in path])
+                logger.info(f"Navigation path: {path_str}")
+
+                # 逐跳执行，每一跳都按路由表查下一页；某一跳失败时从实际所在页面（识别不出则为上一个确认过的页面）继续
+                retry_times = 0
+                while current_page != target_page:
+                    if global_stop_flag.is_set():
+                        return
+                    to_page = self.page_router.next_hop(current_page, target_page)
+                    if to_page is None:
+                        error_msg = f"No path found from {current_page} to {target_page}"
+                        logger.error(error_msg)
+                        raise Exception(error_msg)
+                    button = current_page.links[to_page]
+
+                    logger.debug(f'Page switch: {current_page} -> {to_page}')
+                    pt = time.time()
+
+                    # Click the button
+                    if isinstance(button, str):
+                        itt.key_press(button)
+                    elif isinstance(button, Button):
+                        itt.appear_then_click(button)
+                    elif isinstance(button, Text):
+                        itt.appear_then_click(button)
+
+                    logger.info("waiting for page transition")
+                    itt.wait_until_stable(threshold=STABLE_THRESHOLD_TRANSITION)
+                    # Handle loading screen
+                    self.ui_additional()
+                    logger.info("page transition completed")
+
+                    # Verify we reached the expected page
+                    if to_page.is_current_page(itt):
+                        self.page_router.update_cost(current_page, to_page, time.time() - pt)
+                        current_page = to_page
+                        continue
+
+                    retry_times += 1
+                    if retry_times > max_retry:
+                        raise Exception(f"Failed to navigate to {target_page} after {max_retry} retries")
+                    actual_page = self.page_classifier.classify(itt)
+                    if actual_page is not None:
+                        current_page = actual_page
+                    logger.warning(f"Expected to be at {to_page}, but verification failed. Retrying from {current_page}...")
+
                 logger.info(f"Successfully arrived at {target_page}")
-                self.switch_ui_lock.release()
-            
         except Exception as e:
             logger.error(f"goto_page failed: {e}")
-            if self.switch_ui_lock.locked():
-                self.switch_ui_lock.release()
             raise e
 
     def ensure_page(self, page: UIPage):
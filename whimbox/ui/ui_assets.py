@@ -4,7 +4,7 @@ from whimbox.ui.template.posi_manager import PosiTemplate, Area
 from whimbox.ui.template.text_manager import TextTemplate, Text
 
 # 很多界面左上角都有的文字标题区域
-AreaPageTitleFeature = Area()
+AreaPageTitleFeature = Area(rec_only=True)
 
 # 主界面、esc菜单相关
 IconPageMainFeature = ImgIcon(print_log=LOG_NONE, threshold=0.99)
@@ -20,7 +20,7 @@ IconUIBigmap = ImgIcon(print_log=LOG_WHEN_TRUE)
 IconBigMapMaxScale = ImgIcon(print_log=LOG_WHEN_TRUE)
 ButtonBigMapZoom = Button(print_log=LOG_WHEN_TRUE)
 ButtonBigMapTeleport = ImgIcon(print_log=LOG_WHEN_TRUE)
-AreaBigMapRegionName = Area()
+AreaBigMapRegionName = Area(rec_only=True)
 AreaBigMapRegionSelect = Area()
 AreaBigMapTeleporterSelect = Area()
 # 大地图材料追踪
@@ -89,7 +89,7 @@ ButtonJihuaFinallyConfirm = Button(print_log=LOG_WHEN_TRUE)
 ButtonDigGather = Button(print_log=LOG_WHEN_TRUE)
 ButtonDigGatherConfirm = Button(print_log=LOG_WHEN_TRUE)
 ButtonDigAgain = Button(print_log=LOG_WHEN_TRUE)
-AreaDigingNumText = Area()
+AreaDigingNumText = Area(rec_only=True)
 AreaDigMainTypeSelect = Area()
 AreaDigSubTypeSelect = Area()
 AreaDigItemSelect = Area()
@@ -121,7 +121,7 @@ ButtonWardrobeDressDIY = Button(print_log=LOG_WHEN_TRUE)
 # 能力配置界面
 AreaWardrobeTab3 = Area()
 TextWardrobeAbilityTab = Text("能力配置", cap_area = AreaWardrobeTab3)
-AreaWardrobeAbilityBattleText = Area()
+AreaWardrobeAbilityBattleText = Area(rec_only=True)
 TextWardrobeAbilityBattle = Text("净化", cap_area = AreaWardrobeAbilityBattleText)
 IconAbilityFloat = ImgIcon()    # 泡泡套跳跃
 IconAbilityWing = ImgIcon()    # 飞鸟套跳跃